@@ -0,0 +1,212 @@
+import asyncio
+import os
+import time
+from multiprocessing.util import Finalize
+from typing import Dict, List, Tuple
+
+import aiohttp
+
+from dbpedia_utils import build_query, dbpedia_format
+from linking_backends import LinkingBackend
+from profiling import count, observe
+
+
+class _RateLimiter:
+    def __init__(self, requests_per_second: float):
+        """Spaces the start of requests to an endpoint so at most requests_per_second requests start per second.
+        Must be created inside the event loop it is used in.
+
+        :param requests_per_second: Maximum amount of started requests per second, 0 or less disables the limit.
+        :type requests_per_second: float
+        """
+        self.interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        """Wait until the next request is allowed to start."""
+        if self.interval == 0:
+            return
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            delay = self.next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = max(self.next_start, loop.time()) + self.interval
+
+
+class _ProcessSession:
+    def __init__(self, max_in_flight: int, requests_per_second: float, timeout: float):
+        """Event loop and HTTP session of a process, with the concurrency limit and rate limiter bound to the loop.
+
+        :param max_in_flight: Maximum amount of concurrent requests, also the size of the connection pool.
+        :type max_in_flight: int
+        :param requests_per_second: Maximum amount of requests started per second on the endpoint.
+        :type requests_per_second: float
+        :param timeout: Seconds before a request times out.
+        :type timeout: float
+        """
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._setup(max_in_flight, requests_per_second, timeout))
+
+    async def _setup(self, max_in_flight: int, requests_per_second: float, timeout: float):
+        """Create the session, the concurrency limit and the rate limiter inside the event loop."""
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_in_flight, ssl=False),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            headers={"Accept": "application/sparql-results+json"}
+        )
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.rate_limiter = _RateLimiter(requests_per_second)
+
+    def close(self):
+        """Close the HTTP session and the event loop."""
+        if not self.loop.is_closed():
+            self.loop.run_until_complete(self.session.close())
+            self.loop.close()
+
+
+# Sessions by pid and endpoint. Pool tasks receive a pickled copy of the client, the session of a process is kept here
+# so all tasks of a worker share its connection pool. A forked child ignores the sessions of its parent.
+_sessions: Dict[Tuple[int, str], _ProcessSession] = {}
+
+
+def _close_session(key: Tuple[int, str]):
+    """Close a session of this process and forget it.
+
+    :param key: Pid and endpoint of the session.
+    :type key: Tuple[int, str]
+    """
+    process_session = _sessions.pop(key, None)
+    if process_session is not None:
+        process_session.close()
+
+
+class AsyncSparqlClient(LinkingBackend):
+    endpoint = None
+    max_in_flight = None
+    requests_per_second = None
+
+    def __init__(
+            self,
+            endpoint: str = "http://dbpedia.org/sparql",
+            max_in_flight: int = 16,
+            requests_per_second: float = 10,
+            timeout: float = 150,
+            retry_delay: float = 15
+    ):
+        """Concurrent candidate generation on a SPARQL endpoint using asyncio and a pooled HTTP client.
+        The event loop and HTTP session are created once per process and kept outside the object, so the object can be
+        pickled into every pool task while the tasks of a worker share one connection pool. The session of a worker is
+        closed when the worker exits.
+
+        :param endpoint: URL of the SPARQL endpoint.
+        :type endpoint: str
+        :param max_in_flight: Maximum amount of concurrent requests, also the size of the connection pool.
+        :type max_in_flight: int
+        :param requests_per_second: Maximum amount of requests started per second on the endpoint.
+        :type requests_per_second: float
+        :param timeout: Seconds before a request times out.
+        :type timeout: float
+        :param retry_delay: Seconds to wait before the single retry of a failed request.
+        :type retry_delay: float
+        """
+        self.endpoint = endpoint
+        self.max_in_flight = max_in_flight
+        self.requests_per_second = requests_per_second
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+
+    def _session(self) -> _ProcessSession:
+        """Get the event loop and session of this process, creating them if they don't exist yet.
+
+        :return: Session used for all requests of this process.
+        :rtype: _ProcessSession
+        """
+        key = (os.getpid(), self.endpoint)
+        process_session = _sessions.get(key)
+        if process_session is None:
+            process_session = _sessions[key] = _ProcessSession(
+                self.max_in_flight,
+                self.requests_per_second,
+                self.timeout
+            )
+            # Runs when the process exits normally, including pool workers of a pool that is closed and joined.
+            Finalize(process_session, _close_session, args=(key,), exitpriority=10)
+        return process_session
+
+    async def _query(self, process_session: _ProcessSession, query: str) -> object:
+        """Execute a query on the endpoint, retrying once after retry_delay seconds if it fails.
+
+        :param process_session: Session of this process.
+        :type process_session: _ProcessSession
+        :param query: SPARQL query str.
+        :type query: str
+        :return: JSON results, None if both attempts failed.
+        :rtype: object
+        """
+        for attempt in range(2):
+            if attempt > 0:
+                count("sparql_retries")
+            count("sparql_queries")
+            try:
+                async with process_session.semaphore:
+                    await process_session.rate_limiter.wait()
+                    # The latency excludes the time waiting for a free slot and the rate limit.
+                    start = time.perf_counter()
+                    try:
+                        async with process_session.session.post(self.endpoint, data={"query": query}) as response:
+                            if response.status == 200:
+                                return await response.json(content_type=None)
+                    finally:
+                        observe("sparql_latency", time.perf_counter() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                pass
+            count("sparql_errors")
+            if attempt == 0:
+                await asyncio.sleep(self.retry_delay)
+        count("sparql_failures")
+
+    async def generate_candidates_async(
+            self,
+            process_session: _ProcessSession,
+            mention_groups: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], object]:
+        """Generate the candidates of all mentions concurrently, a request per unique mention.
+
+        :param process_session: Session of this process.
+        :type process_session: _ProcessSession
+        :param mention_groups: Pairs of the original mention and the group to which the mention belongs.
+        :type mention_groups: List[Tuple[str, str]]
+        :return: Candidates per mention-group pair. None for mentions of which the query failed.
+        :rtype: Dict[Tuple[str, str], object]
+        """
+        unique_mention_groups = list(dict.fromkeys(mention_groups))
+        queries = []
+        for mention, group in unique_mention_groups:
+            mentions = dbpedia_format(mention)
+            queries.append(build_query(mentions, group, extra=mentions[0] != mentions[2]))
+        results = await asyncio.gather(*(self._query(process_session, query) for query in queries))
+        return dict(zip(unique_mention_groups, results))
+
+    def generate_candidates(self, mention_groups: List[Tuple[str, str]]) -> Dict[Tuple[str, str], object]:
+        """Blocking entry point with the same interface as generate_candidates_batch().
+        Every mention is sent as a separate request, at most max_in_flight at the same time.
+
+        :param mention_groups: Pairs of the original mention and the group to which the mention belongs.
+        :type mention_groups: List[Tuple[str, str]]
+        :return: Candidates per mention-group pair. None for mentions of which the query failed.
+        :rtype: Dict[Tuple[str, str], object]
+        """
+        process_session = self._session()
+        return process_session.loop.run_until_complete(
+            self.generate_candidates_async(process_session, mention_groups)
+        )
+
+    def source(self) -> str:
+        # Sends the same queries as SparqlBackend, one mention per query.
+        return f"sparql {self.endpoint}"
+
+    def close(self):
+        """Close the HTTP session and the event loop of this process."""
+        _close_session((os.getpid(), self.endpoint))
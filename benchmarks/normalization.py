@@ -0,0 +1,123 @@
+import argparse
+import gzip
+import sys
+import time
+import unicodedata
+from collections import Counter
+from html import unescape
+from typing import Tuple, Union
+
+from sentences import configure as configure_sentences
+from warc import (
+    HTML_ENGINES, _LINE_BREAKS, _UNICODE_LINE_BREAK_RE, _build_row, _extract_text, _normalize_text, html_records,
+    process_payload, split_records
+)
+
+
+def normalize_document(html_body: bytes) -> str:
+    """Decode and normalize the entire HTML, like process_payload() did before parsing.
+
+    :param html_body: Undecoded HTML body.
+    :type html_body: bytes
+    :return: Normalized HTML.
+    :rtype: str
+    """
+    return unicodedata.normalize("NFKC", unescape(" ".join(html_body.decode("utf-8", errors="ignore").splitlines())))
+
+
+def normalize_text(html_body: bytes, html_engine: str = "bs4") -> float:
+    """Decode the HTML and normalize only its extracted text, like process_payload() does.
+
+    :param html_body: Undecoded HTML body.
+    :type html_body: bytes
+    :param html_engine: One of HTML_ENGINES.
+    :type html_engine: str
+    :return: Seconds spent decoding and normalizing, the extraction of the text isn't timed.
+    :rtype: float
+    """
+    start = time.perf_counter()
+    html = html_body.translate(_LINE_BREAKS).decode("utf-8", errors="ignore")
+    if not html.isascii():
+        html = _UNICODE_LINE_BREAK_RE.sub(" ", html)
+    seconds = time.perf_counter() - start
+
+    title_text, headers, paragraphs = _extract_text(html, html_engine)
+    start = time.perf_counter()
+    _normalize_text(title_text)
+    [_normalize_text(header) for header in headers]
+    [_normalize_text(paragraph) for paragraph in paragraphs]
+    return seconds + time.perf_counter() - start
+
+
+def reference_process_payload(
+        key_html: Tuple[str, bytes],
+        html_engine: str = "bs4"
+) -> Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]:
+    """Process the HTML body like process_payload() did when the entire HTML was normalized before parsing.
+
+    :param key_html: WARC-TREC-ID and undecoded HTML body of the warc file.
+    :type key_html: Tuple[str, bytes]
+    :param html_engine: One of HTML_ENGINES.
+    :type html_engine: str
+    :return: Tuple of WARC-TREC-ID, HTML title, HTML headers, and HTML text tags. None tuple if no contents were found.
+    :rtype: Union[Tuple[str, str, str, str], Tuple[None, None, None, None]
+    """
+    file_key, html_body = key_html
+    if file_key is None:
+        return None, None, None, None
+
+    return _build_row(file_key, *_extract_text(normalize_document(html_body), html_engine))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("normalization")
+    parser.add_argument(
+        "--warc",
+        dest="warc",
+        required=False,
+        default="data/warcs/sample.warc.gz",
+        help="Path to the warc zip of which the rows of both normalizations are compared.",
+        type=str
+    )
+    parser.add_argument(
+        "--html_engine",
+        dest="html_engine",
+        required=False,
+        default="bs4",
+        choices=HTML_ENGINES,
+        help="Engine used to extract the text of the HTML.",
+        type=str
+    )
+    args = parser.parse_args()
+
+    # Load the punkt model once, downloading it only if it is missing.
+    configure_sentences()
+
+    # Compare the rows of both normalizations on every HTML record and time them in a single process.
+    seconds = Counter()
+    records = 0
+    different = []
+    with gzip.open(args.warc, "rb") as warc_file:
+        for key_html in html_records(split_records(warc_file), Counter()):
+            rows = {}
+            for name, process in (("document", reference_process_payload), ("text", process_payload)):
+                start = time.perf_counter()
+                rows[name] = process(key_html, args.html_engine)
+                seconds[name] += time.perf_counter() - start
+            start = time.perf_counter()
+            normalize_document(key_html[1])
+            seconds["normalize_document"] += time.perf_counter() - start
+            seconds["normalize_text"] += normalize_text(key_html[1], args.html_engine)
+            records += 1
+            if rows["document"] != rows["text"]:
+                different.append(key_html[0])
+
+    print(f"{records} HTML records, {records - len(different)} identical rows.")
+    for key in different[:10]:
+        print(f"Different row: {key}")
+    for stage, total, normalization in (("document", "document", "normalize_document"), ("text", "text", "normalize_text")):
+        print(f"Normalized {stage}: {seconds[total]:.2f}s, of which decoding and normalizing {seconds[normalization]:.2f}s")
+    if seconds["text"] > 0 and seconds["normalize_text"] > 0:
+        print(f"Speedup: {seconds['document'] / seconds['text']:.2f}x, "
+              f"normalization {seconds['normalize_document'] / seconds['normalize_text']:.2f}x")
+    sys.exit(1 if different else 0)
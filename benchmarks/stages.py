@@ -0,0 +1,405 @@
+import argparse
+import contextlib
+import datetime
+import gc
+import gzip
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+from benchmarks.synthetic_warc import generate_warc
+from checkpoint import Checkpoint
+from dbpedia_with_EL import link_entities
+from linking_backends import StubBackend
+from main import Extraction, write_results
+from pipeline import chunked
+from ner import load_model, pipe_docs
+from relation_extraction import ReverbNoNlp
+from sentences import SENTENCE_SPLITTERS, configure as configure_sentences
+from warc import HTML_ENGINES, html_records, process_payload, split_records
+
+STAGES = ("split", "process_payload", "ner", "link_entity", "reverb", "write")
+
+
+def measure(run: Callable[[], Any], repetitions: int, warmup: int = 1) -> List[float]:
+    """Time a stage a number of times after warming it up, with a garbage collection before every repetition.
+
+    :param run: Runs the stage once over all its input.
+    :type run: Callable[[], Any]
+    :param repetitions: Amount of timed repetitions.
+    :type repetitions: int
+    :param warmup: Amount of untimed repetitions before the timed ones.
+    :type warmup: int
+    :return: Seconds per repetition.
+    :rtype: List[float]
+    """
+    for _ in range(warmup):
+        run()
+    seconds = []
+    for _ in range(repetitions):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def summarize(seconds: List[float], items: int) -> Dict[str, float]:
+    """Summarize the repetitions of a stage.
+
+    :param seconds: Seconds per repetition.
+    :type seconds: List[float]
+    :param items: Amount of items processed per repetition.
+    :type items: int
+    :return: Items, seconds per repetition, and the min, median, and standard deviation, and items per second at the
+    median.
+    :rtype: Dict[str, float]
+    """
+    median = statistics.median(seconds)
+    return {
+        "items": items,
+        "seconds": [round(value, 6) for value in seconds],
+        "min": round(min(seconds), 6),
+        "median": round(median, 6),
+        "stdev": round(statistics.stdev(seconds), 6) if len(seconds) > 1 else 0.0,
+        "items_per_second": round(items / median, 3) if median > 0 else 0.0
+    }
+
+
+def benchmark_stages(
+        warc_path: str,
+        model_name: str,
+        repetitions: int = 5,
+        warmup: int = 1,
+        html_engine: str = "bs4",
+        ner_batch_size: int = 64,
+        link_batch_size: int = 32
+) -> Dict[str, Dict[str, float]]:
+    """Time every stage of the pipeline in a single process. The input of a stage is the output of the previous stage,
+    produced before the stage is timed. Linking uses StubBackend without latency, so no endpoint is contacted.
+
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :param model_name: Name of the used spaCy model.
+    :type model_name: str
+    :param repetitions: Amount of timed repetitions per stage.
+    :type repetitions: int
+    :param warmup: Amount of untimed repetitions per stage.
+    :type warmup: int
+    :param html_engine: One of HTML_ENGINES.
+    :type html_engine: str
+    :param ner_batch_size: Batch size of nlp.pipe.
+    :type ner_batch_size: int
+    :param link_batch_size: Amount of docs of which the mentions are linked together.
+    :type link_batch_size: int
+    :return: Summary per stage, see summarize().
+    :rtype: Dict[str, Dict[str, float]]
+    """
+    results = {}
+
+    def read_records() -> List:
+        with gzip.open(warc_path, "rb") as warc_file:
+            return list(html_records(split_records(warc_file), Counter()))
+
+    records = read_records()
+    results["split"] = summarize(measure(read_records, repetitions, warmup), len(records))
+
+    def process_records() -> List:
+        return [process_payload(key_html, html_engine) for key_html in records]
+
+    rows = [row for row in process_records() if row[0] is not None and len(row[3]) > 0]
+    results["process_payload"] = summarize(measure(process_records, repetitions, warmup), len(records))
+
+    nlp = load_model(model_name)
+    text_context = [(row[3], row[0]) for row in rows]
+
+    def recognize() -> List:
+        return list(pipe_docs(nlp, text_context, batch_size=ner_batch_size))
+
+    doc_keys = recognize()
+    results["ner"] = summarize(measure(recognize, repetitions, warmup), len(doc_keys))
+
+    backend = StubBackend()
+
+    def link() -> List:
+        # Every repetition starts without known mentions, like a new run.
+        mention_entity = {}
+        linked_batches = (
+            link_entities([doc for doc, _ in batch], mention_entity, None, backend.generate_candidates)
+            for batch in chunked(doc_keys, link_batch_size)
+        )
+        return [entities for batch in linked_batches for entities in batch]
+
+    linked = link()
+    results["link_entity"] = summarize(measure(link, repetitions, warmup), len(doc_keys))
+    results["link_entity"]["entities"] = sum(len(doc.ents) for doc, _ in doc_keys)
+
+    reverb = ReverbNoNlp(nlp.vocab)
+
+    def extract() -> List:
+        return [reverb.extract_spacy_relations(doc, entities) for (doc, _), entities in zip(doc_keys, linked)]
+
+    relations = extract()
+    results["reverb"] = summarize(measure(extract, repetitions, warmup), len(doc_keys))
+
+    entries = []
+    for (_, key), entities, doc_relations in zip(doc_keys, linked, relations):
+        result = [Extraction.entity_to_str(key, mention, wiki) for mention, wiki in entities.items()]
+        result += [
+            Extraction.relation_to_str(key, entities[wiki1], entities[wiki2], relation)
+            for wiki1, relation, wiki2 in doc_relations
+        ]
+        entries.append((key, result))
+
+    with tempfile.TemporaryDirectory() as directory:
+        def write():
+            # Written with a checkpoint like run() does, the printed results are discarded.
+            checkpoint = Checkpoint(os.path.join(directory, "out"))
+            checkpoint.open()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                write_results(entries, "", checkpoint)
+            checkpoint.close()
+
+        results["write"] = summarize(measure(write, repetitions, warmup), len(entries))
+    return results
+
+
+def file_digest(path: str) -> str:
+    """Hash a file, so results are only compared when they were measured on the same input.
+
+    :param path: Path to the file.
+    :type path: str
+    :return: SHA-256 hex digest.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def git_commit() -> str:
+    """Get the commit of the working tree.
+
+    :return: Commit hash, empty if it can't be determined.
+    :rtype: str
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Compare the median time per stage with a baseline and print the ratios.
+
+    :param results: Results of this run.
+    :type results: Dict[str, Any]
+    :param baseline: Results of an earlier run.
+    :type baseline: Dict[str, Any]
+    :param tolerance: Fraction by which a stage may be slower than the baseline before it counts as a regression.
+    :type tolerance: float
+    :return: Stages that regressed.
+    :rtype: List[str]
+    """
+    if results["meta"]["warc_sha256"] != baseline["meta"]["warc_sha256"]:
+        print("Warning: the baseline was measured on a different warc zip.", file=sys.stderr)
+
+    regressions = []
+    for name in STAGES:
+        if name not in results["stages"] or name not in baseline["stages"]:
+            continue
+        median = results["stages"][name]["median"]
+        baseline_median = baseline["stages"][name]["median"]
+        ratio = median / baseline_median if baseline_median > 0 else 1.0
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name}: {baseline_median:.3f}s -> {median:.3f}s ({ratio:.2f}x){' REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("stages")
+    parser.add_argument(
+        "--warc",
+        dest="warc",
+        required=False,
+        default="data/warcs/synthetic.warc.gz",
+        help="Warc zip to benchmark, generated with benchmarks.synthetic_warc if missing.",
+        type=str
+    )
+    parser.add_argument(
+        "--records",
+        dest="records",
+        required=False,
+        default=500,
+        help="Amount of records of a generated warc zip.",
+        type=int
+    )
+    parser.add_argument(
+        "--entity_density",
+        dest="entity_density",
+        required=False,
+        default=0.05,
+        help="Fraction of the words that is an entity name in a generated warc zip.",
+        type=float
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        required=False,
+        default=0,
+        help="Seed of a generated warc zip.",
+        type=int
+    )
+    parser.add_argument(
+        "--ner_model",
+        dest="ner_model",
+        required=False,
+        default="en_core_web_sm",
+        help="spaCy model used for NER.",
+        type=str
+    )
+    parser.add_argument(
+        "--ner_batch_size",
+        dest="ner_batch_size",
+        required=False,
+        default=64,
+        help="Batch size of nlp.pipe.",
+        type=int
+    )
+    parser.add_argument(
+        "--link_batch_size",
+        dest="link_batch_size",
+        required=False,
+        default=32,
+        help="Amount of docs of which the mentions are linked together.",
+        type=int
+    )
+    parser.add_argument(
+        "--html_engine",
+        dest="html_engine",
+        choices=HTML_ENGINES,
+        default="bs4",
+        help="Engine used to extract the text of the HTML."
+    )
+    parser.add_argument(
+        "--sentence_splitter",
+        dest="sentence_splitter",
+        choices=SENTENCE_SPLITTERS,
+        default="punkt",
+        help="Sentence splitter of the text processing."
+    )
+    parser.add_argument(
+        "--offline",
+        dest="offline",
+        action="store_true",
+        help="Never download the punkt model."
+    )
+    parser.add_argument(
+        "--repetitions",
+        dest="repetitions",
+        required=False,
+        default=5,
+        help="Amount of timed repetitions per stage.",
+        type=int
+    )
+    parser.add_argument(
+        "--warmup",
+        dest="warmup",
+        required=False,
+        default=1,
+        help="Amount of untimed repetitions per stage before the timed ones.",
+        type=int
+    )
+    parser.add_argument(
+        "--out",
+        dest="out",
+        required=False,
+        default=None,
+        help="File the results are stored in, defaults to benchmarks/results/<date and time>.json.",
+        type=str
+    )
+    parser.add_argument(
+        "--baseline",
+        dest="baseline",
+        required=False,
+        default=None,
+        help="Results of an earlier run to compare with, exits with 1 if a stage regressed.",
+        type=str
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        required=False,
+        default=0.1,
+        help="Fraction by which the median of a stage may exceed the baseline before it counts as a regression.",
+        type=float
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.warc):
+        print(f"Generating {args.warc} with {args.records} records.", file=sys.stderr)
+        generate_warc(args.warc, records=args.records, entity_density=args.entity_density, seed=args.seed)
+    configure_sentences(args.sentence_splitter, args.offline)
+
+    stage_results = benchmark_stages(
+        args.warc,
+        args.ner_model,
+        repetitions=args.repetitions,
+        warmup=args.warmup,
+        html_engine=args.html_engine,
+        ner_batch_size=args.ner_batch_size,
+        link_batch_size=args.link_batch_size
+    )
+    benchmark_results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "warc": args.warc,
+            "warc_sha256": file_digest(args.warc),
+            "ner_model": args.ner_model,
+            "ner_batch_size": args.ner_batch_size,
+            "link_batch_size": args.link_batch_size,
+            "html_engine": args.html_engine,
+            "sentence_splitter": args.sentence_splitter,
+            "repetitions": args.repetitions,
+            "warmup": args.warmup
+        },
+        "stages": stage_results
+    }
+
+    for stage_name, stage in stage_results.items():
+        print(
+            f"{stage_name}: median {stage['median']:.3f}s, min {stage['min']:.3f}s, stdev {stage['stdev']:.3f}s, "
+            f"{stage['items_per_second']:.1f} items/s"
+        )
+
+    out = args.out or os.path.join("benchmarks", "results", f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(out) and not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    with open(out, "w", encoding="UTF-8") as file:
+        json.dump(benchmark_results, file, indent=2)
+    print(f"Results written to {out}.")
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="UTF-8") as file:
+            baseline_results = json.load(file)
+        sys.exit(1 if compare(benchmark_results, baseline_results, args.tolerance) else 0)
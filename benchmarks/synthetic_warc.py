@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import gzip
+import itertools
+import random
+from typing import List
+
+# Words of the sentences around the entities.
+_WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but have an they "
+    "you were her she there been one all we their has would when if so no what up out more about into than them can "
+    "only other new some time could these two may then first any like now my such make over our even most after also "
+    "did many before must through back years where much your way well down should because each just those people how "
+    "too little state good very world still own see men work long get here between both life being under never day "
+    "same another know while last might great old year off come since against go came right used take three"
+).split()
+_FIRST_NAMES = (
+    "James Mary John Patricia Robert Jennifer Michael Linda William Elizabeth David Barbara Richard Susan Joseph Jessica "
+    "Thomas Sarah Charles Karen Daniel Nancy Matthew Lisa Anthony Betty Mark Margaret Paul Sandra Steven Ashley"
+).split()
+_LAST_NAMES = (
+    "Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez Hernandez Lopez Gonzalez Wilson Anderson "
+    "Thomas Taylor Moore Jackson Martin Lee Perez Thompson White Harris Sanchez Clark Ramirez Lewis Robinson Walker"
+).split()
+_PLACES = (
+    "Amsterdam Rotterdam London Paris Berlin Madrid Rome Vienna Prague Warsaw Dublin Lisbon Brussels Copenhagen Oslo "
+    "Stockholm Helsinki Athens Budapest Zurich Chicago Boston Seattle Denver Toronto Sydney Tokyo Seoul Mumbai Cairo"
+).split()
+_ORGANIZATION_SUFFIXES = ("University", "Corporation", "Institute", "Museum", "Foundation", "Bank", "Airlines", "Group")
+
+
+def entity_pool(size: int, rng: random.Random) -> List[str]:
+    """Generate the named entities used by the pages, a mix of persons, places, and organizations.
+    Names can occur more than once in the pool.
+
+    :param size: Amount of entities.
+    :type size: int
+    :param rng: Random number generator.
+    :type rng: random.Random
+    :return: Entity names.
+    :rtype: List[str]
+    """
+    entities = []
+    while len(entities) < size:
+        kind = rng.random()
+        if kind < 0.4:
+            entities.append(f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}")
+        elif kind < 0.7:
+            entities.append(rng.choice(_PLACES))
+        else:
+            entities.append(f"{rng.choice(_PLACES)} {rng.choice(_ORGANIZATION_SUFFIXES)}")
+    return entities
+
+
+def _sentence(rng: random.Random, entities: List[str], weights: List[float], entity_density: float) -> str:
+    """Generate a sentence of 8 to 24 words of which about entity_density are entity names.
+
+    :param rng: Random number generator.
+    :type rng: random.Random
+    :param entities: Entity names.
+    :type entities: List[str]
+    :param weights: Cumulative Zipf weights of the entities, so some entities occur on many pages.
+    :type weights: List[float]
+    :param entity_density: Fraction of the words that is an entity name.
+    :type entity_density: float
+    :return: Sentence ending with a dot.
+    :rtype: str
+    """
+    words = []
+    for _ in range(rng.randint(8, 24)):
+        if rng.random() < entity_density:
+            words.append(rng.choices(entities, cum_weights=weights)[0])
+        else:
+            words.append(rng.choice(_WORDS))
+    words[0] = words[0][0].upper() + words[0][1:]
+    return " ".join(words) + "."
+
+
+def html_page(
+        rng: random.Random,
+        entities: List[str],
+        weights: List[float],
+        paragraphs: int,
+        entity_density: float
+) -> str:
+    """Generate an HTML page with a title, headers, paragraphs, and the scripts, styles, and navigation of a real page.
+
+    :param rng: Random number generator.
+    :type rng: random.Random
+    :param entities: Entity names.
+    :type entities: List[str]
+    :param weights: Cumulative Zipf weights of the entities.
+    :type weights: List[float]
+    :param paragraphs: Mean amount of paragraphs.
+    :type paragraphs: int
+    :param entity_density: Fraction of the words that is an entity name.
+    :type entity_density: float
+    :return: HTML page.
+    :rtype: str
+    """
+    def sentences(amount: int) -> str:
+        return " ".join(_sentence(rng, entities, weights, entity_density) for _ in range(amount))
+
+    body = []
+    for index in range(max(1, int(rng.expovariate(1 / max(1, paragraphs))))):
+        if index % 4 == 0:
+            level = rng.randint(1, 3)
+            body.append(f"<h{level}>{sentences(1)[:-1]}</h{level}>")
+        body.append(f"<p>{sentences(rng.randint(1, 6))}</p>")
+        if rng.random() < 0.3:
+            body.append(f"<div class=\"aside\"><span>{sentences(1)}</span> &amp; <a href=\"/more\">more</a></div>")
+
+    navigation = "".join(f"<li><a href=\"/section/{index}?a=1&amp;b=2\">Section {index}</a></li>" for index in range(20))
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        f"<title>{sentences(1)[:-1]}</title>"
+        "<style>body{margin:0} .aside{color:#333}</style>"
+        "<script>var config = {page: 1, items: [1, 2, 3]}; function init() { return config; }</script>"
+        f"</head><body><nav><ul>{navigation}</ul></nav>\n"
+        + "\n".join(body) +
+        "\n<footer><p>Copyright &copy; 2022</p></footer><script>init();</script></body></html>"
+    )
+
+
+def _record(warc_type: bytes, headers: bytes, block: bytes) -> bytes:
+    """Build a WARC record with a Content-Length header.
+
+    :param warc_type: Value of the WARC-Type header.
+    :type warc_type: bytes
+    :param headers: Other WARC headers, each ending with CRLF.
+    :type headers: bytes
+    :param block: Content block of the record.
+    :type block: bytes
+    :return: The record including the two CRLF after its block.
+    :rtype: bytes
+    """
+    return (
+        b"WARC/1.0\r\nWARC-Type: " + warc_type + b"\r\n" + headers +
+        b"Content-Length: " + str(len(block)).encode() + b"\r\n\r\n" + block + b"\r\n\r\n"
+    )
+
+
+def generate_warc(
+        path: str,
+        records: int = 1000,
+        html_ratio: float = 0.8,
+        paragraphs: int = 12,
+        entity_density: float = 0.05,
+        entities: int = 2000,
+        seed: int = 0,
+        per_record: bool = True
+):
+    """Write a synthetic warc zip in the format of the ClueWeb warc files, the same arguments give the same file.
+
+    :param path: Path of the warc zip.
+    :type path: str
+    :param records: Amount of response records.
+    :type records: int
+    :param html_ratio: Fraction of the response records that contain HTML, the others contain an image.
+    :type html_ratio: float
+    :param paragraphs: Mean amount of paragraphs per page.
+    :type paragraphs: int
+    :param entity_density: Fraction of the words that is an entity name.
+    :type entity_density: float
+    :param entities: Amount of entities in the pool, which occur with Zipf distributed frequencies.
+    :type entities: int
+    :param seed: Seed of the generated content.
+    :type seed: int
+    :param per_record: Compress every record as a separate gzip member like real warc zips, otherwise the whole file is
+    a single member.
+    :type per_record: bool
+    """
+    rng = random.Random(seed)
+    names = entity_pool(entities, rng)
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(names) + 1)))
+
+    with open(path, "wb") as raw, contextlib.ExitStack() as stack:
+        single = None if per_record else stack.enter_context(
+            gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0)
+        )
+
+        def write(record: bytes):
+            if single is None:
+                raw.write(gzip.compress(record, mtime=0))
+            else:
+                single.write(record)
+
+        write(_record(b"warcinfo", b"WARC-Date: 2012-02-10T21:51:20Z\r\n", b"software: synthetic_warc\r\n"))
+        for index in range(records):
+            key = f"clueweb12-synthetic-{index:06d}".encode()
+            if rng.random() < html_ratio:
+                content_type = b"text/html; charset=utf-8"
+                payload = html_page(rng, names, weights, paragraphs, entity_density).encode("UTF-8")
+            else:
+                content_type = b"image/png"
+                payload = bytes(rng.getrandbits(8) for _ in range(rng.randint(64, 512)))
+            http = b"HTTP/1.1 200 OK\r\nContent-Type: " + content_type + b"\r\nServer: synthetic\r\n\r\n" + payload
+            headers = (
+                b"WARC-Target-URI: http://example.com/" + key + b"\r\n"
+                b"WARC-TREC-ID: " + key + b"\r\n"
+                b"Content-Type: application/http; msgtype=response\r\n"
+            )
+            write(_record(b"response", headers, http))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("synthetic_warc")
+    parser.add_argument(
+        "--out",
+        dest="out",
+        required=False,
+        default="data/warcs/synthetic.warc.gz",
+        help="Path of the generated warc zip.",
+        type=str
+    )
+    parser.add_argument(
+        "--records",
+        dest="records",
+        required=False,
+        default=1000,
+        help="Amount of response records.",
+        type=int
+    )
+    parser.add_argument(
+        "--html_ratio",
+        dest="html_ratio",
+        required=False,
+        default=0.8,
+        help="Fraction of the response records that contain HTML.",
+        type=float
+    )
+    parser.add_argument(
+        "--paragraphs",
+        dest="paragraphs",
+        required=False,
+        default=12,
+        help="Mean amount of paragraphs per page.",
+        type=int
+    )
+    parser.add_argument(
+        "--entity_density",
+        dest="entity_density",
+        required=False,
+        default=0.05,
+        help="Fraction of the words that is an entity name.",
+        type=float
+    )
+    parser.add_argument(
+        "--entities",
+        dest="entities",
+        required=False,
+        default=2000,
+        help="Amount of entities in the pool, which occur with Zipf distributed frequencies.",
+        type=int
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        required=False,
+        default=0,
+        help="Seed of the generated content.",
+        type=int
+    )
+    parser.add_argument(
+        "--single_member",
+        dest="single_member",
+        action="store_true",
+        help="Compress the whole file as one gzip member instead of every record separately."
+    )
+    args = parser.parse_args()
+
+    generate_warc(
+        args.out,
+        records=args.records,
+        html_ratio=args.html_ratio,
+        paragraphs=args.paragraphs,
+        entity_density=args.entity_density,
+        entities=args.entities,
+        seed=args.seed,
+        per_record=not args.single_member
+    )
@@ -0,0 +1,134 @@
+import argparse
+import csv
+import glob
+import re
+import sys
+import time
+from typing import Callable, List
+
+from warc import _filter_words, _join_sentences
+
+
+def valid_word(word: str) -> bool:
+    """Filters invalid words the way it was done per word before _filter_words().
+    Invalid words include:
+    - Empty words: len of 0.
+    - Words only containing one symbol: len of 0 and contains symbol.
+    - Words containing invalid symbols: valid symbols include alphanumerical, '$', '€', ':', '.', ',', and '-'.
+
+    :param word: A single word directly taken from the HTML file.
+    :type word: str
+    :return: True if the word is valid, False otherwise.
+    :rtype: bool
+    """
+    return len(word) > 0 and \
+           not (re.match(r'[^a-zA-Z\d$€:.,-]', word) or (len(word) == 1 and re.match(r'[^a-zA-Z\d]', word)))
+
+
+def sanitize_word(word: str) -> str:
+    """Sanitizes a word the way it was done per word before _filter_words(). Removes potential double punctuation or
+    other invalid symbols at the end of the word.
+
+    :param word: A potentially dirty, but valid word. Could include additional punctuation due to joining of sentence.
+    :type word: str
+    :return: Word with double punctuation or invalid symbols at end of word removed.
+    :rtype: str
+    """
+    if len(word) == 0:
+        return word
+    # Check if last character is dot.
+    if word[-1] == '.':
+        # Check if second last character is not alpha numerical.
+        if not word[-2].isalnum():
+            # Prune invalid characters and add dot.
+            return word[:-2] + '.'
+    # Check if last character is not alpha numerical.
+    elif not word[-1].isalnum():
+        # Prune invalid character at end of word
+        return word[:-1]
+    return word
+
+
+def reference_filter_words(text: str) -> str:
+    """Word filtering as it was done per word before _filter_words().
+
+    :param text: All unprocessed text found within a tag.
+    :type text: str
+    :return: Valid sanitized words separated by single spaces.
+    :rtype: str
+    """
+    return " ".join([sanitize_word(word) for word in text.split(' ') if valid_word(word)])
+
+
+def load_texts(pattern: str) -> List[str]:
+    """Load the title, headers, and text of every row of the pre-processed CSV files.
+
+    :param pattern: Glob pattern of the pre-processed CSV files.
+    :type pattern: str
+    :return: Texts of all rows.
+    :rtype: List[str]
+    """
+    texts = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, newline='', encoding='UTF-8') as file:
+            for row in csv.reader(file, quoting=csv.QUOTE_NONE, escapechar='\\'):
+                texts.extend(row[1:4])
+    return texts
+
+
+def time_filter(filter_words: Callable[[str], str], texts: List[str], repetitions: int) -> float:
+    """Time a word filter over all texts.
+
+    :param filter_words: Word filter.
+    :type filter_words: Callable[[str], str]
+    :param texts: Texts to filter.
+    :type texts: List[str]
+    :param repetitions: Amount of times all texts are filtered, the fastest repetition counts.
+    :type repetitions: int
+    :return: Seconds of the fastest repetition.
+    :rtype: float
+    """
+    best = float("inf")
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        for text in texts:
+            filter_words(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("word_filter")
+    parser.add_argument(
+        "--pre_proc",
+        dest="pre_proc",
+        required=False,
+        default="pre-proc/*.csv",
+        help="Glob pattern of the pre-processed CSV files used as corpus.",
+        type=str
+    )
+    parser.add_argument(
+        "--repetitions",
+        dest="repetitions",
+        required=False,
+        default=5,
+        help="Amount of times the corpus is filtered per implementation.",
+        type=int
+    )
+    args = parser.parse_args()
+
+    corpus = load_texts(args.pre_proc)
+    if len(corpus) == 0:
+        parser.error(f"No pre-processed rows found in {args.pre_proc}.")
+    # The rows are already filtered, joining them as sentences gives the filters punctuation to remove.
+    corpus += [_join_sentences(corpus[index:index + 3]) for index in range(0, len(corpus), 3)]
+
+    different = sum(1 for text in corpus if _filter_words(text) != reference_filter_words(text))
+    reference_seconds = time_filter(reference_filter_words, corpus, args.repetitions)
+    seconds = time_filter(_filter_words, corpus, args.repetitions)
+
+    print(f"{len(corpus)} texts, {sum(len(text) for text in corpus)} characters, {different} different results.")
+    print(f"Per word: {reference_seconds:.3f}s")
+    print(f"Regex: {seconds:.3f}s")
+    print(f"Speedup: {reference_seconds / seconds:.2f}x")
+    sys.exit(1 if different else 0)
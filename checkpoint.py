@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+from typing import List, Optional, Set
+
+
+def truncate_partial_line(path: str):
+    """Remove an incomplete last line of a file, left behind when the program stopped while writing it.
+
+    :param path: Path to the file.
+    :type path: str
+    """
+    with open(path, "r+b") as file:
+        size = file.seek(0, os.SEEK_END)
+        position = size
+        while position > 0:
+            start = max(0, position - (1 << 16))
+            file.seek(start)
+            newline = file.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position < size:
+            file.truncate(position)
+
+
+class CheckpointAborted(RuntimeError):
+    """Raised when writing to a checkpoint that was aborted, for example because another worker took over its shard."""
+
+
+class Checkpoint:
+    out_path = None
+    manifest_path = None
+    state_path = None
+    sync_interval = None
+
+    def __init__(self, out_path: str, sync_interval: int = 100, abort: Optional[threading.Event] = None):
+        """Incremental output with a manifest of the completed WARC-TREC-IDs, so an interrupted run can be resumed.
+        After the results of a key are appended to the out file, the key and the size of the out file are appended to
+        the manifest at out_path.manifest. When resuming, the out file is truncated to the size recorded by the last
+        complete manifest line, which removes the results of a key that was being written when the run stopped.
+        The state of the pre-processing stage is stored at out_path.state.json.
+
+        :param out_path: File the results get written to.
+        :type out_path: str
+        :param sync_interval: Amount of keys after which the out file and the manifest are synced to disk.
+        :type sync_interval: int
+        :param abort: Once set, every write raises CheckpointAborted, so the run stops without writing to the files.
+        :type abort: Optional[threading.Event]
+        """
+        self.out_path = out_path
+        self.manifest_path = f"{out_path}.manifest"
+        self.state_path = f"{out_path}.state.json"
+        self.sync_interval = sync_interval
+        self.abort = abort
+        self.completed = set()
+        self.state = {}
+        self._out = None
+        self._manifest = None
+        self._unsynced = 0
+
+    def open(self, resume: bool = False) -> Set[str]:
+        """Open the out file and the manifest, continuing where the previous run stopped if resume is True.
+
+        :param resume: Continue the previous run, otherwise the out file, manifest, and state are overwritten.
+        :type resume: bool
+        :return: WARC-TREC-IDs of which the results have already been written.
+        :rtype: Set[str]
+        """
+        directory = os.path.dirname(self.out_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if resume and os.path.exists(self.manifest_path):
+            self._recover()
+            mode = "ab"
+        else:
+            self.completed = set()
+            self.state = {}
+            self._write_state()
+            mode = "wb"
+        self._out = open(self.out_path, mode)
+        self._manifest = open(self.manifest_path, mode)
+        return self.completed
+
+    def _recover(self):
+        """Load the completed keys and the state, and truncate the out file and manifest to the last complete key."""
+        out_size = os.path.getsize(self.out_path) if os.path.exists(self.out_path) else 0
+        out_offset = 0
+        manifest_size = 0
+        with open(self.manifest_path, "rb") as manifest:
+            for line in manifest:
+                if not line.endswith(b"\n"):
+                    break
+                key, offset = line[:-1].decode("UTF-8").rsplit("\t", 1)
+                # The manifest may have reached the disk before the results it refers to.
+                if int(offset) > out_size:
+                    break
+                self.completed.add(key)
+                out_offset = int(offset)
+                manifest_size += len(line)
+
+        os.truncate(self.manifest_path, manifest_size)
+        if out_size > out_offset:
+            os.truncate(self.out_path, out_offset)
+
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="UTF-8") as file:
+                self.state = json.load(file)
+
+    def _check_abort(self):
+        """Raise if the checkpoint was aborted.
+
+        :raises CheckpointAborted: If the abort event is set.
+        """
+        if self.abort is not None and self.abort.is_set():
+            raise CheckpointAborted(f"The checkpoint of {self.out_path} was aborted.")
+
+    def _write_state(self):
+        """Replace the state file atomically."""
+        self._check_abort()
+        temporary_path = f"{self.state_path}.tmp"
+        with open(temporary_path, "w", encoding="UTF-8") as file:
+            json.dump(self.state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.state_path)
+
+    def update_state(self, **values):
+        """Store values in the state, for example the location of the pre-processed file.
+
+        :param values: Values to store, they have to be JSON serializable.
+        """
+        self.state.update(values)
+        self._write_state()
+
+    def write(self, key: str, entries: List[str]):
+        """Append the results of a key to the out file and record the key as completed.
+
+        :param key: WARC-TREC-ID of the processed row.
+        :type key: str
+        :param entries: Formatted assignment strings of the row, can be empty.
+        :type entries: List[str]
+        :raises CheckpointAborted: If the checkpoint was aborted.
+        """
+        self._check_abort()
+        if len(entries) > 0:
+            self._out.write("".join(f"{entry}\n" for entry in entries).encode("UTF-8"))
+        self._out.flush()
+        self._manifest.write(f"{key}\t{self._out.tell()}\n".encode("UTF-8"))
+        self._manifest.flush()
+        self.completed.add(key)
+
+        self._unsynced += 1
+        if self._unsynced >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """Sync the out file before the manifest to disk, so the manifest never refers to lost results."""
+        os.fsync(self._out.fileno())
+        os.fsync(self._manifest.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        """Sync and close the out file and the manifest."""
+        if self._out is not None:
+            self.sync()
+            self._out.close()
+            self._manifest.close()
+        self._out = None
+        self._manifest = None
@@ -1,11 +1,13 @@
 import ssl
 import time
-from typing import Tuple
+from typing import Dict, List, Tuple
 
-from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper import SPARQLWrapper, JSON, GET, POST
 from titlecase import titlecase
 import time
 
+from profiling import count, observe
+
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
@@ -163,27 +165,202 @@ def build_query(mentions: Tuple[str, str, str, str], group: str, extra=False) ->
         """
 
 
-def generate_candidates(mention: str, group: str) -> object:
-    """Generate candidates by executing a SPARQL query on the dbpedia endpoint using the mention and group.
+def _query_endpoint(query: str, post: bool = False) -> object:
+    """Execute a query on the SPARQL endpoint, retrying once after 15 seconds if it fails.
 
-    :param mention: Original mention.
-    :type mention: str
-    :param group: Group to which the mention belongs.
-    :type group: str
-    :return: Candidates.
+    :param query: SPARQL query str.
+    :type query: str
+    :param post: If True send the query in a POST request, used for long batch queries.
+    :type post: bool
+    :return: Converted JSON results, None if both attempts failed.
     :rtype: object
     """
-    mentions = dbpedia_format(mention)
-    extra = mentions[0] != mentions[2]
-    query = build_query(mentions, group, extra=extra)
+    sparql.setMethod(POST if post else GET)
     sparql.setQuery(query)
     sparql.setTimeout(150)
-    for _ in range(2):
+    for attempt in range(2):
+        if attempt > 0:
+            count("sparql_retries")
+        count("sparql_queries")
+        start = time.perf_counter()
         try:
             results = sparql.query().convert()
+            observe("sparql_latency", time.perf_counter() - start)
             return results
         except (ConnectionError, TimeoutError):
             pass
         except Exception as e:
             pass
+        observe("sparql_latency", time.perf_counter() - start)
+        count("sparql_errors")
         time.sleep(15)
+    count("sparql_failures")
+
+
+def set_endpoint(url: str):
+    """Point the queries to another SPARQL endpoint, for example a local stand-in of dbpedia.
+
+    :param url: URL of the SPARQL endpoint.
+    :type url: str
+    """
+    global sparql
+    sparql = SPARQLWrapper(url)
+    sparql.setReturnFormat(JSON)
+
+
+def generate_candidates(mention: str, group: str) -> object:
+    """Generate candidates by executing a SPARQL query on the dbpedia endpoint using the mention and group.
+
+    :param mention: Original mention.
+    :type mention: str
+    :param group: Group to which the mention belongs.
+    :type group: str
+    :return: Candidates.
+    :rtype: object
+    """
+    mentions = dbpedia_format(mention)
+    extra = mentions[0] != mentions[2]
+    query = build_query(mentions, group, extra=extra)
+    return _query_endpoint(query)
+
+
+def _sparql_literal(value: str) -> str:
+    """Escape a value for use as a string literal in a SPARQL query.
+
+    :param value: Unescaped value.
+    :type value: str
+    :return: Quoted and escaped literal.
+    :rtype: str
+    """
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _resource_iri(name: str) -> str:
+    """Build the dbpedia resource IRI of a formatted mention, percent-encoding characters that aren't allowed in IRIs.
+
+    :param name: Mention with spaces replaced by underscores.
+    :type name: str
+    :return: IRI enclosed in angle brackets.
+    :rtype: str
+    """
+    escaped = ''.join(
+        f"%{ord(char):02X}" if char in '<>"{}|^`\\' or ord(char) <= 0x20 else char
+        for char in name
+    )
+    return f"<http://dbpedia.org/resource/{escaped}>"
+
+
+def build_batch_query(mention_groups: List[Tuple[str, str]]) -> str:
+    """Build a single query for multiple mentions. Every mention gets a key, its index in mention_groups, which is
+    returned in the ?key binding so the results can be split per mention.
+    The formatted mentions are passed in a VALUES block, one row per mention format, covering the same cases as
+    build_query().
+
+    :param mention_groups: Pairs of the original mention and the group to which the mention belongs.
+    :type mention_groups: List[Tuple[str, str]]
+    :return: SPARQL query str.
+    :rtype: str
+    """
+    rows = []
+    for key, (mention, group) in enumerate(mention_groups):
+        mention_0, mention_1, mention_2, mention_3 = dbpedia_format(mention)
+        formats = [(mention_2, mention_3)]
+        # Same condition as the extra query of generate_candidates().
+        if mention_0 != mention_2:
+            formats.append((mention_0, mention_1))
+        for label, resource in formats:
+            rows.append(
+                f'("{key}" {_sparql_literal(label)}@en {_resource_iri(resource)} '
+                f'{_resource_iri(resource + "_(disambiguation)")} {group})'
+            )
+    values = "\n                ".join(rows)
+    return f"""
+            PREFIX owl:     <http://www.w3.org/2002/07/owl#>
+            PREFIX xsd:     <http://www.w3.org/2001/XMLSchema#>
+            PREFIX rdfs:    <http://www.w3.org/2000/01/rdf-schema#>
+            PREFIX rdf:     <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+            PREFIX foaf:    <http://xmlns.com/foaf/0.1/>
+            PREFIX dc:      <http://purl.org/dc/elements/1.1/>
+            PREFIX dbr:     <http://dbpedia.org/resource/>
+            PREFIX dpr:     <http://dbpedia.org/property/>
+            PREFIX dbpedia: <http://dbpedia.org/>
+            PREFIX skos:    <http://www.w3.org/2004/02/skos/core#>
+            PREFIX dbo:     <http://dbpedia.org/ontology/>
+            PREFIX geo:     <http://www.w3.org/2003/01/geo/wgs84_pos#>
+
+
+            SELECT ?key ?item ?name ?page (COUNT(?source) as ?count) WHERE {{
+            VALUES (?key ?label ?resource ?disambiguation ?group) {{
+                {values}
+            }}
+            {{
+                # [Case 1] no disambiguation at all (eg. Twitter)
+                ?item rdfs:label ?label .
+            }}
+            UNION
+            {{
+                # [Case 1] lands in a redirect page (eg. "Google, Inc." -> "Google")
+                ?temp rdfs:label ?label .
+                ?temp dbo:wikiPageRedirects ?item .
+            }}
+            UNION
+            {{
+                # [Case 2] a dedicated disambiguation page (eg. Michael Jordan)
+                ?disambiguation dbo:wikiPageDisambiguates ?item .
+            }}
+            UNION
+            {{
+                # [Case 3] disambiguation list within entity page (eg. New York)
+                ?resource dbo:wikiPageDisambiguates ?item .
+            }}
+
+            # Filter by entity class
+            ?item rdf:type ?group .
+
+            ?source dbo:wikiPageWikiLink ?item .
+
+            # Grab wikipedia link
+            ?item foaf:isPrimaryTopicOf ?page .
+
+            # Get name
+            ?item rdfs:label ?name .
+            FILTER (langMatches(lang(?name),"en"))
+        }}
+        GROUP BY ?key ?item ?name ?page
+        """
+
+
+def generate_candidates_batch(
+        mention_groups: List[Tuple[str, str]],
+        batch_size: int = 20
+) -> Dict[Tuple[str, str], object]:
+    """Generate candidates for many mentions using one SPARQL query per batch of mentions.
+    The bindings are split back per mention into the same format as generate_candidates() returns.
+
+    :param mention_groups: Pairs of the original mention and the group to which the mention belongs.
+    :type mention_groups: List[Tuple[str, str]]
+    :param batch_size: Maximum amount of mentions per query. A batch size of 1 uses generate_candidates().
+    :type batch_size: int
+    :return: Candidates per mention-group pair. None for mentions of which the query failed.
+    :rtype: Dict[Tuple[str, str], object]
+    """
+    unique_mention_groups = list(dict.fromkeys(mention_groups))
+    if batch_size <= 1:
+        return {(mention, group): generate_candidates(mention, group) for mention, group in unique_mention_groups}
+
+    candidates = {}
+    for start in range(0, len(unique_mention_groups), batch_size):
+        batch = unique_mention_groups[start:start + batch_size]
+        results = _query_endpoint(build_batch_query(batch), post=True)
+
+        # Failed queries give no candidates for the entire batch.
+        if results is None:
+            candidates.update(dict.fromkeys(batch, None))
+            continue
+
+        bindings_per_key = [[] for _ in batch]
+        for binding in results["results"]["bindings"]:
+            bindings_per_key[int(binding["key"]["value"])].append(binding)
+        for mention_group, bindings in zip(batch, bindings_per_key):
+            candidates[mention_group] = {"results": {"bindings": bindings}}
+    return candidates
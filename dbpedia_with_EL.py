@@ -1,17 +1,22 @@
 import ssl
-from typing import Tuple, List
+from typing import Callable, Dict, Tuple, List, Optional
 
-import requests
-import numpy as np
-import time
 import json
 from Levenshtein import distance as levenshtein_distance
 
-from dbpedia_utils import generate_candidates
+from dbpedia_utils import generate_candidates_batch
+from entity_cache import EntityLinkCache
+from popularity import PopularityTable
+from profiling import count, stage
 
 # Prevent crash from SSL verification.
 ssl._create_default_https_context = ssl._create_unverified_context
 
+# Generates the candidates of mention-group pairs, giving back the candidates per pair.
+CandidateGenerator = Callable[[List[Tuple[str, str]]], Dict[Tuple[str, str], object]]
+# Marks a mention that is not in the mention dictionary, None means the mention couldn't be linked.
+_UNKNOWN = object()
+
 # Mapping of NER tag to SPARQL query group.
 pruned_groups_dict = {
     "PERSON"        : "dbo:Person",
@@ -28,94 +33,32 @@ pruned_groups_dict = {
 }
 
 
-def get_most_popular_pages(mention: str, candidates: dict) -> Tuple:
-    """Get the most popular candidate based on the backlinks in other Wikipedia articles using the Wikipedia API.
+def get_most_popular_pages(
+        mention: str,
+        candidates: dict,
+        popularity: PopularityTable
+) -> Optional[Tuple[str, str, str, int]]:
+    """Get the most popular candidate using an offline popularity table, which costs a lookup per candidate instead of
+    a request to the Wikipedia API per candidate. Ties are broken on the levenshtein distance like rank_candidates().
 
     :param mention: Entity mention.
     :type mention: str
     :param candidates: SPARQL dict containing all resulting bindings.
     :type candidates: dict
-    :return: Tuple with link to most popular page and the entity name.
-    :rtype: Tuple
+    :param popularity: Popularity table built by popularity.py from a link count or pageview dump.
+    :type popularity: PopularityTable
+    :return: Entity name, page, item, and popularity of the most popular candidate, None if there are no candidates.
+    :rtype: Optional[Tuple[str, str, str, int]]
     """
-    max_backlinks_len = 0
-    popular_pages = []
-    session = requests.Session()
-    url = "https://en.wikipedia.org/w/api.php"
-
     # No pages present.
     if candidates is None or len(candidates["results"]["bindings"]) == 0:
         return None
 
-    # Only one page present.
-    if len(candidates) == 1:
-        entity_name = candidates[0]["name"]["value"] if "value" in candidates[0]["name"] else candidates[0]["name"]
-        return [(entity_name, candidates[0]["page"]["value"], candidates[0]["item"]["value"])]
-
-    for candidate in candidates["results"]["bindings"]:
-        # Get the candidate name.
-        name = candidate["page"]["value"].split("/")[-1]
-
-        # Set request params.
-        params = {
-            "action"        : "query",
-            "format"        : "json",
-            "list"          : "backlinks",
-            "bltitle"       : name, 
-            "bllimit"       : 'max',
-            "blnamespace"   : 4,
-            "blredirect"    : "False"
-        }
-
-        # Get response.
-        response = session.get(url=url, params=params)
-        if not response:
-            # Reattempt get once if it failed initially.
-            time.sleep(5)
-            response = session.get(url=url, params=params)
-
-            # Go to next candidate if a response is still missing.
-            if not response:
-                continue
+    best, popularity_count = _best_binding(
+        mention, candidates["results"]["bindings"], lambda binding: popularity.page_count(binding["page"]["value"])
+    )
+    return _binding_name(best), best["page"]["value"], best["item"]["value"], popularity_count
 
-        json_data = response.json()
-        if "query" in json_data:
-            # Get the backlinks length.
-            backlinks = json_data["query"]["backlinks"]
-            backlinks_len = len(backlinks)
-
-            # Store popular page if new backlinks_len was found.
-            if backlinks_len >= max_backlinks_len:
-                max_backlinks_len = backlinks_len
-                entity_name = candidate["name"]["value"] if "value" in candidate["name"] else candidate["name"]
-                popular_pages.append((entity_name, candidate["page"]["value"], candidate["item"]["value"], backlinks_len))
-
-    # Return first page as default.
-    if len(popular_pages) == 0:
-        return popular_pages[0]
-
-    # Break ties using levenshtein distance.
-    if len(popular_pages) > 0:
-        most_popular_pages = [page for page in popular_pages if page[-1] == max_backlinks_len]
-
-        # Calculate levenshtein distance from mention to page.
-        distances = [levenshtein_distance(mention, page[0]) for page in most_popular_pages]
-        best = np.argmin(distances)
-        return most_popular_pages[best]
-
-    # Alternative to levenshtein distance as tie breaker.
-    distances = []
-    for candidate in candidates["results"]["bindings"]:
-        entity_name = candidate["name"]["value"] if "value" in candidate["name"] else candidate["name"]
-        distance = levenshtein_distance(mention, entity_name)
-        if distance == 0:
-            return entity_name, candidate["page"]["value"], candidate["item"]["value"]
-        distances.append(distance)
-    best = np.argmin(distances)
-    candidate = candidates[best]
-    entity_name = candidate["name"]["value"] if "value" in candidate["name"] else candidate["name"]
-    return entity_name, candidate["page"]["value"], candidate["item"]["value"]
-    
 
 def get_most_similar_entity(mention: str, pages: List) -> object:
     """Get the most similar entity using levenshtein distance.
@@ -124,109 +67,306 @@ def get_most_similar_entity(mention: str, pages: List) -> object:
     :type mention: str
     :param pages: Pages from the possible candidates.
     :type pages: List
-    :return: Most similar page.
+    :return: Most similar page, the first page if several pages are equally similar.
     :rtype: object
     """
     # No pages present.
-    if not pages or len(pages) == 0:
+    if not pages:
         return None
 
     # Only one page present.
     if len(pages) == 1:
         return pages[0]
 
-    distances = []
+    best = None
+    best_distance = 0
     for page in pages:
         # Calculate the levenshtein distance from the entity to the page.
-        distance = levenshtein_distance(mention, page[0]) 
+        distance = levenshtein_distance(mention, page[0])
         if distance == 0:
             return page
-        distances.append(distance)
-    # Find the index of the best levenshtein distance.
-    best = np.argmin(distances)
-    return pages[best]
+        if best is None or distance < best_distance:
+            best = page
+            best_distance = distance
+    return best
+
+
+class Candidate:
+    __slots__ = ("name", "page", "count")
+
+    def __init__(self, name: str, page: str, count: int):
+        """Candidate page of a mention with only the fields used for ranking.
+
+        :param name: Entity name of the page.
+        :type name: str
+        :param page: URL of the Wikipedia page.
+        :type page: str
+        :param count: Amount of dbpedia referrals of the page.
+        :type count: int
+        """
+        self.name = name
+        self.page = page
+        self.count = count
+
+    def __repr__(self) -> str:
+        return f"Candidate({self.name!r}, {self.page!r}, {self.count})"
+
+
+def _binding_name(binding: dict) -> str:
+    """Get the entity name of a SPARQL binding, which is a literal or a plain string.
+
+    :param binding: Binding with a name.
+    :type binding: dict
+    :return: The entity name.
+    :rtype: str
+    """
+    name = binding["name"]
+    return name["value"] if "value" in name else name
+
+
+def _referral_count(binding: dict) -> int:
+    """Get the amount of dbpedia referrals of a SPARQL binding.
+
+    :param binding: Binding with a count.
+    :type binding: dict
+    :return: The referral count.
+    :rtype: int
+    """
+    return int(binding["count"]["value"])
+
+
+def _best_binding(mention: str, bindings: List[dict], score: Callable[[dict], int]) -> Tuple[Optional[dict], int]:
+    """Select the binding with the highest score in a single pass. Ties are broken on the levenshtein distance of the
+    name to the mention, which is only computed for the tied bindings. The first binding wins remaining ties.
+
+    :param mention: Entity mention.
+    :type mention: str
+    :param bindings: SPARQL bindings of the mention.
+    :type bindings: List[dict]
+    :param score: Gives the score of a binding.
+    :type score: Callable[[dict], int]
+    :return: The best binding and its score, None and 0 if there are no bindings.
+    :rtype: Tuple[Optional[dict], int]
+    """
+    best = None
+    best_score = 0
+    best_distance = None
+    for binding in bindings:
+        binding_score = score(binding)
+        if best is None or binding_score > best_score:
+            best = binding
+            best_score = binding_score
+            # Computed once another binding ties with this one.
+            best_distance = None
+        elif binding_score == best_score:
+            if best_distance is None:
+                best_distance = levenshtein_distance(mention, _binding_name(best))
+            distance = levenshtein_distance(mention, _binding_name(binding))
+            if distance < best_distance:
+                best = binding
+                best_distance = distance
+    return best, best_score
+
+
+def rank_candidates(
+        mention: str,
+        candidates: Optional[dict],
+        popularity: Optional[PopularityTable] = None
+) -> Optional[Candidate]:
+    """Select the most referred candidate in a single pass over the bindings, or the most popular page if a popularity
+    table is given. Only the score of every binding is read, ties are broken on the levenshtein distance of the name to
+    the mention. The first candidate wins remaining ties.
 
+    :param mention: Entity mention.
+    :type mention: str
+    :param candidates: SPARQL dict containing all resulting bindings, or None if the lookup failed.
+    :type candidates: Optional[dict]
+    :param popularity: Popularity table replacing the referral counts.
+    :type popularity: Optional[PopularityTable]
+    :return: The best candidate with its score as count, None if there are no candidates.
+    :rtype: Optional[Candidate]
+    """
+    if candidates is None or not candidates["results"]["bindings"]:
+        return None
+
+    score = _referral_count if popularity is None else lambda binding: popularity.page_count(binding["page"]["value"])
+    best, best_score = _best_binding(mention, candidates["results"]["bindings"], score)
+    return Candidate(_binding_name(best), best["page"]["value"], best_score)
+
+
+def rank_candidates_batch(
+        candidates_per_mention: Dict[Tuple[str, str], object],
+        popularity: Optional[PopularityTable] = None
+) -> Dict[Tuple[str, str], Optional[Candidate]]:
+    """Select the best candidate of many mentions at once, see rank_candidates().
 
-def get_most_refered_page(mention: str, candidates: List) -> str:
+    :param candidates_per_mention: SPARQL results per mention-group pair as given by a CandidateGenerator.
+    :type candidates_per_mention: Dict[Tuple[str, str], object]
+    :param popularity: Popularity table replacing the referral counts.
+    :type popularity: Optional[PopularityTable]
+    :return: The best candidate per mention-group pair, None if a mention has no candidates.
+    :rtype: Dict[Tuple[str, str], Optional[Candidate]]
+    """
+    return {
+        (mention, group): rank_candidates(mention, candidates, popularity)
+        for (mention, group), candidates in candidates_per_mention.items()
+    }
+
+
+def get_most_refered_page(mention: str, candidates: dict) -> Optional[str]:
     """Select the most referred page, with referred being the most count of dbpedia referrals.
+    Ties are broken on the levenshtein distance to the mention.
 
     :param mention: Entity mention.
     :type mention: str
-    :param candidates: List of candidates to asses referral counts.
-    :type candidates: List
+    :param candidates: SPARQL dict containing the candidates to asses referral counts.
+    :type candidates: dict
     :return: The link from the most referred page, None if no value is found.
+    :rtype: Optional[str]
+    """
+    best = rank_candidates(mention, candidates)
+    return None if best is None else best.page
+
+
+def normalize_mention(mention: str) -> str:
+    """Normalize a mention to the key of the mention dictionaries and the link cache.
+
+    :param mention: Entity mention.
+    :type mention: str
+    :return: Lowercased mention with single spaces.
     :rtype: str
     """
-    # No candidates present.
-    if candidates is None or candidates["results"]["bindings"] is None or len(candidates["results"]["bindings"]) == 0:
-        return None
-    
-    candidates = candidates["results"]["bindings"]
-    # Only one candidate present.
-    if len(candidates) == 1:
-        return candidates[0]["page"]["value"]
-    
-    max_refered_count = 0
-    popular_pages = []
-    for candidate in candidates:
-        # Get referred count.
-        refered_count = int(candidate["count"]["value"])
-
-        # Check if the referred count is better.
-        if refered_count >= max_refered_count:
-            # Set the new max.
-            max_refered_count = refered_count
-            entity_name = candidate["name"]["value"] if "value" in candidate["name"] else candidate["name"]
-
-            # Store page.
-            popular_pages.append((entity_name, candidate["page"]["value"], refered_count))
-    
-    most_popular_pages = [page for page in popular_pages if page[-1] == max_refered_count]
-    # One page is the most referred.
-    if len(most_popular_pages) == 1:
-        return most_popular_pages[0][1]
-
-    # Calculate the levenshtein distances to the mention. Used to break ties.
-    distances = [levenshtein_distance(mention, page[0]) for page in most_popular_pages]
-
-    # Find index based on best levenshtein distance to the mention.
-    best = np.argmin(distances)
-    return most_popular_pages[best][1]
-
-
-def link_entity(text: object, global_mention_entity: dict) -> dict:
+    return ' '.join(mention.strip().lower().split())
+
+
+def link_entities(
+        texts: List[object],
+        global_mention_entity: dict,
+        link_cache: Optional[EntityLinkCache] = None,
+        candidate_generator: CandidateGenerator = generate_candidates_batch,
+        popularity: Optional[PopularityTable] = None
+) -> List[dict]:
+    """Links the entities of a batch of spaCy Doc objects to a Wikipedia URL if one can be found.
+    The unknown normalized mentions of all docs are collected first, so a mention occurring in many docs of the batch
+    is resolved once. They are passed together to the candidate generator, ordered on the amount of docs they occur
+    in, so the most frequent mentions are in the first queries. The links are then given to every doc containing the
+    mention.
+
+    :param texts: spaCy Doc text objects containing the named entities.
+    :type texts: List[object]
+    :param global_mention_entity: Dictionary of already queried mentions, a dict or a
+    mention_cache.SharedMentionCache.
+    :type global_mention_entity: dict
+    :param link_cache: Persistent cache consulted before querying, shared across runs and processes.
+    :type link_cache: Optional[EntityLinkCache]
+    :param candidate_generator: Generates the candidates of a list of mention-group pairs, giving back the candidates
+    per pair in the format of generate_candidates(). For example generate_candidates_batch() or
+    AsyncSparqlClient.generate_candidates().
+    :type candidate_generator: CandidateGenerator
+    :param popularity: Popularity table, if given the candidates are ranked on the popularity of their page instead of
+    their dbpedia referrals.
+    :type popularity: Optional[PopularityTable]
+    :return: Dictionary of linked entities per doc, in the order of the docs.
+    :rtype: List[dict]
+    """
+    local_mention_entities = [{} for _ in texts]
+
+    # Unknown mentions by normalized mention. The first mention and group are queried, the link is used for all
+    # mentions in all docs.
+    unknown_mentions = {}
+    # Docs and their mentions per unknown normalized mention.
+    occurrences = {}
+    for doc_index, text in enumerate(texts):
+        # Pack ents.
+        ents = {(ent.text, ent.label_) for ent in text.ents}
+        for mention, group in ents:
+            mention_key = normalize_mention(mention)
+            if group not in pruned_groups_dict:
+                continue
+            # Check if mention is not in global dictionary. A single get, so a shared dictionary is asked once.
+            link = global_mention_entity.get(mention_key, _UNKNOWN)
+            if link is _UNKNOWN:
+                if mention_key in unknown_mentions:
+                    count("mention_batch_hits")
+                else:
+                    count("mention_dict_misses")
+                    unknown_mentions[mention_key] = (mention, group)
+                occurrences.setdefault(mention_key, []).append((doc_index, mention))
+            else:
+                count("mention_dict_hits")
+                # Mention has a valid entity link in global dictionary.
+                if link:
+                    local_mention_entities[doc_index][mention] = link
+
+    def store_link(mention_key: str, link: Optional[str]):
+        """Store the link of the normalized mention for all its mentions in all docs."""
+        # Check if mention is linked.
+        global_mention_entity[mention_key] = link if link else None
+        if link:
+            for doc_index, linked_mention in occurrences[mention_key]:
+                local_mention_entities[doc_index][linked_mention] = link
+
+    unresolved_keys = []
+    for mention_key, (mention, group) in unknown_mentions.items():
+        # Check if the mention was linked in an earlier run or by another process.
+        found, link = link_cache.get(mention_key, group) if link_cache is not None else (False, None)
+        if found:
+            store_link(mention_key, link)
+        else:
+            unresolved_keys.append(mention_key)
+        if link_cache is not None:
+            count("link_cache_hits" if found else "link_cache_misses")
+
+    # The most frequent mentions first, a stable sort keeps the order of appearance for equal frequencies.
+    unresolved_keys.sort(key=lambda key: len({doc_index for doc_index, _ in occurrences[key]}), reverse=True)
+
+    # Generate candidates for all unknown named entity mentions and groups at once.
+    with stage("lookup"):
+        candidates_per_mention = candidate_generator(
+            [(unknown_mentions[key][0], pruned_groups_dict[unknown_mentions[key][1]]) for key in unresolved_keys]
+        )
+    count("lookups", len(unresolved_keys))
+
+    # Pick the most referred or most popular link from the possible candidates of every mention.
+    best_candidates = rank_candidates_batch(candidates_per_mention, popularity)
+
+    for mention_key in unresolved_keys:
+        mention, group = unknown_mentions[mention_key]
+        candidates = candidates_per_mention[(mention, pruned_groups_dict[group])]
+        best = best_candidates[(mention, pruned_groups_dict[group])]
+        link = None if best is None else best.page
+
+        # Failed queries are not stored, so they are retried in the next run.
+        if link_cache is not None and candidates is not None:
+            link_cache.put(mention_key, group, link)
+
+        store_link(mention_key, link)
+    return local_mention_entities
+
+
+def link_entity(
+        text: object,
+        global_mention_entity: dict,
+        link_cache: Optional[EntityLinkCache] = None,
+        candidate_generator: CandidateGenerator = generate_candidates_batch,
+        popularity: Optional[PopularityTable] = None
+) -> dict:
     """Links all entities in the spaCy Doc object to a Wikipedia URL if one can be found.
+    Mentions that are not known yet are passed together to the candidate generator, which by default sends batched
+    SPARQL queries.
 
     :param text: spaCy Doc text object containing the named entities.
     :type text: object
     :param global_mention_entity: Dictionary of already queried mentions.
     :type global_mention_entity: dict
+    :param link_cache: Persistent cache consulted before querying, shared across runs and processes.
+    :type link_cache: Optional[EntityLinkCache]
+    :param candidate_generator: Generates the candidates of a list of mention-group pairs, see link_entities().
+    :type candidate_generator: CandidateGenerator
+    :param popularity: Popularity table, if given the candidates are ranked on the popularity of their page instead of
+    their dbpedia referrals.
+    :type popularity: Optional[PopularityTable]
     :return: Dictionary of linked entities.
     :rtype: dict
     """
-    # Pack ents.
-    ents = {(ent.text, ent.label_) for ent in text.ents}
-
-    local_mention_entity = {}
-    for mention, group in ents:
-        mention_key = ' '.join(mention.strip().lower().split())
-        if group in pruned_groups_dict:
-            # Check if mention is not in global dictionary.
-            if mention_key not in global_mention_entity:
-                # Generate candidates using SPARQL query on named entity mention and group.
-                candidates = generate_candidates(mention, pruned_groups_dict[group])
-
-                # Pick the most referred link from the possible candidates.
-                link = get_most_refered_page(mention, candidates)
-
-                # Check if mention is linked.
-                if link:
-                    global_mention_entity[mention_key] = link
-                    local_mention_entity[mention] = link
-                # Mention is not linked.
-                else:
-                    global_mention_entity[mention_key] = None
-            # Mention has a valid entity link in global dictionary.
-            elif global_mention_entity[mention_key]:
-                local_mention_entity[mention] = global_mention_entity[mention_key]
-    return local_mention_entity
+    return link_entities([text], global_mention_entity, link_cache, candidate_generator, popularity)[0]
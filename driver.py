@@ -0,0 +1,244 @@
+import argparse
+import glob
+import multiprocessing as mp
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from checkpoint import CheckpointAborted
+from main import build_parser, create_dirs, run, validate_args
+from work_queue import WorkQueue, keep_alive
+
+
+def find_warcs(patterns: Iterable[str], manifest: Optional[str] = None) -> List[str]:
+    """Collect the warc zips matching glob patterns and listed in a manifest file.
+
+    :param patterns: Glob patterns of warc zips, for example data/warcs/*.warc.gz.
+    :type patterns: Iterable[str]
+    :param manifest: File with one path of a warc zip per line, lines starting with # are ignored.
+    :type manifest: Optional[str]
+    :return: Sorted paths without duplicates.
+    :rtype: List[str]
+    """
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(pattern, recursive=True))
+    if manifest is not None:
+        with open(manifest, encoding="UTF-8") as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    paths.add(line)
+    return sorted(paths)
+
+
+def shard_ids(paths: Iterable[str]) -> Dict[str, str]:
+    """Name every warc zip after its file name without extension, used for its lease, output, and pre-processed rows.
+
+    :param paths: Paths to the warc zips.
+    :type paths: Iterable[str]
+    :return: Path per shard id, sorted on shard id.
+    :rtype: Dict[str, str]
+    """
+    shards = {}
+    for path in paths:
+        shard = os.path.basename(path)
+        for extension in (".gz", ".warc"):
+            if shard.endswith(extension):
+                shard = shard[:-len(extension)]
+        if shard in shards:
+            raise ValueError(f"The warc zips {shards[shard]} and {path} have the same file name.")
+        shards[shard] = path
+    return dict(sorted(shards.items()))
+
+
+def work(args: argparse.Namespace, shards: Dict[str, str], worker_id: str):
+    """Claim and process shards until none are left.
+
+    :param args: Arguments parsed by the parser of build_parser(), extended by the driver arguments.
+    :type args: argparse.Namespace
+    :param shards: Path to the warc zip per shard id.
+    :type shards: Dict[str, str]
+    :param worker_id: Unique id of this worker.
+    :type worker_id: str
+    """
+    queue = WorkQueue(args.queue_dir, worker_id, args.lease_timeout)
+    while True:
+        shard = queue.claim(shards)
+        if shard is None:
+            return
+
+        print(f"Worker {worker_id} processes shard {shard}.", file=sys.stderr)
+        start = time.perf_counter()
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=keep_alive, args=(queue, shard, stop, lost), daemon=True)
+        heartbeat.start()
+        try:
+            # Always resumed, so a shard taken over from a stopped worker continues from its checkpoint.
+            metrics_path = os.path.join(args.out_dir, f"{shard}.metrics.json") if args.metrics_out else None
+            run(args, shards[shard], os.path.join(args.out_dir, f"{shard}.out"), shard, True, metrics_path, lost)
+        except CheckpointAborted:
+            stop.set()
+            heartbeat.join()
+            print(f"Worker {worker_id} stopped shard {shard}, its lease was lost.", file=sys.stderr)
+            continue
+        except Exception:
+            stop.set()
+            heartbeat.join()
+            if not lost.is_set() and queue.fail(shard, traceback.format_exc()):
+                print(f"Worker {worker_id} failed on shard {shard}.", file=sys.stderr)
+            else:
+                print(f"Worker {worker_id} failed on shard {shard} after its lease was lost.", file=sys.stderr)
+            continue
+        stop.set()
+        heartbeat.join()
+        # The lease may have been lost after the last write, then the other worker completes the shard.
+        if lost.is_set() or not queue.complete(shard, time.perf_counter() - start):
+            print(f"Worker {worker_id} finished shard {shard}, but its lease was lost.", file=sys.stderr)
+
+
+def _read_segments(out_path: str) -> List[Tuple[str, bytes]]:
+    """Split the out file of a shard into the results per key using its manifest.
+
+    :param out_path: Out file of the shard.
+    :type out_path: str
+    :return: Key and results per completed key.
+    :rtype: List[Tuple[str, bytes]]
+    """
+    segments = []
+    with open(out_path, "rb") as out_file, open(f"{out_path}.manifest", "rb") as manifest:
+        start = 0
+        for line in manifest:
+            key, end = line[:-1].decode("UTF-8").rsplit("\t", 1)
+            segments.append((key, out_file.read(int(end) - start)))
+            start = int(end)
+    return segments
+
+
+def merge_outputs(shards: Iterable[str], out_dir: str, merged_path: str):
+    """Merge the out files of the shards into one file. The shards are ordered on shard id and the results within a
+    shard on key, so the merged file doesn't depend on the order in which the rows were processed.
+
+    :param shards: Shard ids.
+    :type shards: Iterable[str]
+    :param out_dir: Directory containing the out file and manifest per shard.
+    :type out_dir: str
+    :param merged_path: File the merged results get written to.
+    :type merged_path: str
+    """
+    temporary_path = f"{merged_path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as merged_file:
+        for shard in sorted(shards):
+            segments = _read_segments(os.path.join(out_dir, f"{shard}.out"))
+            for _, results in sorted(segments, key=lambda segment: segment[0]):
+                merged_file.write(results)
+    # Workers that finish at the same time may all merge, every merge writes the same file.
+    os.replace(temporary_path, merged_path)
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    parser.add_argument(
+        "--warcs",
+        dest="warcs",
+        nargs="*",
+        default=[],
+        help="Glob patterns of the warc zips to process, for example 'data/warcs/*.warc.gz'.",
+        type=str
+    )
+    parser.add_argument(
+        "--warc_manifest",
+        dest="warc_manifest",
+        required=False,
+        help="File with one path of a warc zip to process per line.",
+        type=str
+    )
+    parser.add_argument(
+        "--queue_dir",
+        dest="queue_dir",
+        required=False,
+        default="data/queue",
+        help="Directory of the work queue, must be on a file system shared by all machines.",
+        type=str
+    )
+    parser.add_argument(
+        "--out_dir",
+        dest="out_dir",
+        required=False,
+        default="data/shards",
+        help="Directory of the out file per shard, must be on a file system shared by all machines.",
+        type=str
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        required=False,
+        default=1,
+        help="Amount of shards processed at the same time on this machine, --processes and --requests_per_second are "
+             "divided over them.",
+        type=int
+    )
+    parser.add_argument(
+        "--worker_id",
+        dest="worker_id",
+        required=False,
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="Unique id of this machine in the work queue.",
+        type=str
+    )
+    parser.add_argument(
+        "--lease_timeout",
+        dest="lease_timeout",
+        required=False,
+        default=600,
+        help="Seconds after which the shard of a worker that stopped renewing its lease is taken over.",
+        type=float
+    )
+    parser.add_argument(
+        "--merge_only",
+        dest="merge_only",
+        action="store_true",
+        help="Only merge the out files of the shards into --out."
+    )
+    args = parser.parse_args()
+    validate_args(parser, args)
+
+    shards = shard_ids(find_warcs(args.warcs, args.warc_manifest))
+    if len(shards) == 0:
+        parser.error("No warc zips found, use --warcs or --warc_manifest.")
+    create_dirs(args.queue_dir, args.out_dir)
+
+    if not args.merge_only:
+        if args.workers > 1:
+            args.processes = max(1, args.processes // args.workers)
+            args.requests_per_second /= args.workers
+            # Not daemonic, the workers start pools themselves.
+            workers = [
+                mp.Process(target=work, args=(args, shards, f"{args.worker_id}-{index}"))
+                for index in range(args.workers)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            work(args, shards, args.worker_id)
+
+    queue = WorkQueue(args.queue_dir, args.worker_id, args.lease_timeout)
+    failed = [shard for shard in shards if queue.is_failed(shard)]
+    remaining = [shard for shard in shards if not queue.is_done(shard) and shard not in failed]
+    if len(failed) > 0:
+        print(f"Failed shards, see {args.queue_dir}/<shard>.failed: {', '.join(failed)}", file=sys.stderr)
+    if len(remaining) > 0:
+        print(f"{len(remaining)} shards are still being processed by other workers.", file=sys.stderr)
+    if len(failed) > 0 or len(remaining) > 0:
+        print("Not merging, run again with --merge_only when all shards are done.", file=sys.stderr)
+        sys.exit(1)
+
+    merge_outputs(shards, args.out_dir, args.out)
+    print(f"Merged {len(shards)} shards into {args.out}.", file=sys.stderr)
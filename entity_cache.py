@@ -0,0 +1,271 @@
+import os
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+DAY = 24 * 60 * 60
+_STATS = ("hits", "negative_hits", "misses", "expired")
+
+
+class _ProcessConnection:
+    connection = None
+    settings = None
+    touched = None
+    stats = None
+    lookups = None
+    writes = None
+
+    def __init__(self, connection: sqlite3.Connection, settings: Dict[str, str]):
+        """Connection of a process to a cache database, with the access times and statistics it hasn't written yet.
+
+        :param connection: Connection to the database.
+        :type connection: sqlite3.Connection
+        :param settings: Settings the database was checked against when it was opened.
+        :type settings: Dict[str, str]
+        """
+        self.connection = connection
+        self.settings = settings
+        self.touched = {}
+        self.stats = dict.fromkeys(_STATS, 0)
+        self.lookups = 0
+        self.writes = 0
+
+
+# Connections by pid and database path. Pool tasks receive a pickled copy of the cache, the connection and pending
+# changes of a process are kept here so all tasks of a worker share them. A forked child ignores the entries of its
+# parent.
+_connections: Dict[Tuple[int, str], _ProcessConnection] = {}
+
+
+class EntityLinkCache:
+    path = None
+    ttl = None
+    negative_ttl = None
+    max_entries = None
+    flush_interval = None
+    settings = None
+
+    def __init__(
+            self,
+            path: str,
+            ttl: float = 30 * DAY,
+            negative_ttl: float = 7 * DAY,
+            max_entries: int = 1_000_000,
+            flush_interval: int = 100,
+            settings: Optional[Dict[str, str]] = None
+    ):
+        """Persistent cache of entity links stored in a SQLite database.
+        The cache is keyed on the normalized mention and the NER group and also stores mentions that could not be
+        linked. The database is opened once per process and the connection is kept outside the object, so the object
+        can be pickled into every pool task while the tasks of a worker share one connection. Pending access times and
+        statistics are written every flush_interval lookups and by flush(), which Extraction calls after every batch.
+        The database uses write-ahead logging, which only works on a local file system.
+        The settings that produced the links, such as the linking backend and the ranking, are stored in the database
+        when it is created. A database filled with other settings is refused, so links of for example the stub backend
+        are never served to a run on dbpedia.
+
+        :param path: Path to the SQLite database, created if it doesn't exist.
+        :type path: str
+        :param ttl: Seconds a found link stays valid.
+        :type ttl: float
+        :param negative_ttl: Seconds a mention without link stays valid.
+        :type negative_ttl: float
+        :param max_entries: Maximum amount of stored mentions, least recently used mentions are evicted first.
+        :type max_entries: int
+        :param flush_interval: Amount of lookups after which access times and statistics are written.
+        :type flush_interval: int
+        :param settings: Settings that determine the links, the database may only be used with the same settings.
+        :type settings: Optional[Dict[str, str]]
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.settings = dict(settings or {})
+
+    def _process_connection(self) -> _ProcessConnection:
+        """Open the database for the current process if that hasn't been done yet.
+
+        :return: Connection of this process with its pending changes.
+        :rtype: _ProcessConnection
+        """
+        key = (os.getpid(), self.path)
+        process_connection = _connections.get(key)
+        if process_connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=60)
+            # Write-ahead logging lets the pool workers read while another worker writes. It needs shared memory, so
+            # the database must be on a local file system, not on the shared file system of driver.py.
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            try:
+                with connection:
+                    connection.execute("""
+                        CREATE TABLE IF NOT EXISTS links (
+                            mention TEXT NOT NULL,
+                            grp TEXT NOT NULL,
+                            link TEXT,
+                            created REAL NOT NULL,
+                            accessed REAL NOT NULL,
+                            PRIMARY KEY (mention, grp)
+                        ) WITHOUT ROWID
+                    """)
+                    connection.execute("CREATE INDEX IF NOT EXISTS links_accessed ON links (accessed)")
+                    connection.execute("""
+                        CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)
+                    """)
+                    connection.execute("""
+                        CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)
+                    """)
+                    self._check_settings(connection)
+            except ValueError:
+                connection.close()
+                raise
+            process_connection = _connections[key] = _ProcessConnection(connection, self.settings)
+        elif process_connection.settings != self.settings:
+            # Another cache object of this process opened the database with other settings.
+            self._settings_error(process_connection.settings)
+        return process_connection
+
+    def _check_settings(self, connection: sqlite3.Connection):
+        """Store the settings in a new database, or check that they are the settings the database was filled with.
+
+        :param connection: Connection to the database, inside a transaction.
+        :type connection: sqlite3.Connection
+        :raises ValueError: If the database was filled with other settings.
+        """
+        stored = dict(connection.execute("SELECT name, value FROM settings").fetchall())
+        if len(stored) == 0 and connection.execute("SELECT COUNT(*) FROM links").fetchone()[0] == 0:
+            connection.executemany("INSERT INTO settings (name, value) VALUES (?, ?)", self.settings.items())
+        elif stored != self.settings:
+            self._settings_error(stored)
+
+    def _settings_error(self, stored: Dict[str, str]):
+        """Refuse the database.
+
+        :param stored: Settings the database was filled with.
+        :type stored: Dict[str, str]
+        :raises ValueError: Always.
+        """
+        raise ValueError(
+            f"The entity link cache {self.path} was filled with the settings {stored}, not {self.settings}. "
+            f"Use another cache file or remove it."
+        )
+
+    def check(self):
+        """Open the database in this process, so a database filled with other settings is refused before any work is
+        done.
+
+        :raises ValueError: If the database was filled with other settings.
+        """
+        self._process_connection()
+
+    def get(self, mention_key: str, group: str) -> Tuple[bool, Optional[str]]:
+        """Look up the link of a mention.
+
+        :param mention_key: Normalized mention.
+        :type mention_key: str
+        :param group: NER group of the mention.
+        :type group: str
+        :return: Pair of whether the mention was found and the link. The link is None for mentions without link.
+        :rtype: Tuple[bool, Optional[str]]
+        """
+        process_connection = self._process_connection()
+        row = process_connection.connection.execute(
+            "SELECT link, created FROM links WHERE mention = ? AND grp = ?", (mention_key, group)
+        ).fetchone()
+
+        now = time.time()
+        process_connection.lookups += 1
+        if row is None:
+            process_connection.stats["misses"] += 1
+            found, link = False, None
+        elif now - row[1] > (self.ttl if row[0] is not None else self.negative_ttl):
+            process_connection.stats["expired"] += 1
+            found, link = False, None
+        else:
+            process_connection.stats["hits" if row[0] is not None else "negative_hits"] += 1
+            process_connection.touched[(mention_key, group)] = now
+            found, link = True, row[0]
+
+        if process_connection.lookups >= self.flush_interval:
+            self.flush()
+        return found, link
+
+    def put(self, mention_key: str, group: str, link: Optional[str]):
+        """Store the link of a mention, None stores that the mention could not be linked.
+
+        :param mention_key: Normalized mention.
+        :type mention_key: str
+        :param group: NER group of the mention.
+        :type group: str
+        :param link: Link of the mention or None.
+        :type link: Optional[str]
+        """
+        process_connection = self._process_connection()
+        now = time.time()
+        with process_connection.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO links (mention, grp, link, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (mention_key, group, link, now, now)
+            )
+        process_connection.writes += 1
+        if process_connection.writes >= self.flush_interval:
+            self.flush()
+            self.evict()
+
+    def flush(self):
+        """Write the pending access times and statistics of this process."""
+        process_connection = self._process_connection()
+        if process_connection.lookups == 0:
+            return
+        with process_connection.connection as connection:
+            connection.executemany(
+                "UPDATE links SET accessed = ? WHERE mention = ? AND grp = ?",
+                [(accessed, mention, group) for (mention, group), accessed in process_connection.touched.items()]
+            )
+            connection.executemany(
+                "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                [(name, value, value) for name, value in process_connection.stats.items() if value > 0]
+            )
+        process_connection.touched = {}
+        process_connection.stats = dict.fromkeys(_STATS, 0)
+        process_connection.lookups = 0
+
+    def evict(self):
+        """Evict the least recently used mentions if the cache grew past max_entries."""
+        process_connection = self._process_connection()
+        with process_connection.connection as connection:
+            excess = connection.execute("SELECT COUNT(*) FROM links").fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM links WHERE (mention, grp) IN "
+                    "(SELECT mention, grp FROM links ORDER BY accessed LIMIT ?)",
+                    (excess,)
+                )
+        process_connection.writes = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Get the hit and miss statistics of all runs and processes that used the database, including this one.
+
+        :return: Dictionary with the counts, the stored entries, and the hit rate.
+        :rtype: Dict[str, float]
+        """
+        self.flush()
+        connection = self._process_connection().connection
+        stats = dict.fromkeys(_STATS, 0)
+        stats.update(connection.execute("SELECT name, value FROM stats").fetchall())
+        stats["entries"] = connection.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+        lookups = sum(stats[name] for name in _STATS)
+        stats["hit_rate"] = (stats["hits"] + stats["negative_hits"]) / lookups if lookups > 0 else 0.0
+        return stats
+
+    def close(self):
+        """Write pending changes and close the connection of this process."""
+        if (os.getpid(), self.path) in _connections:
+            self.flush()
+            self.evict()
+            _connections.pop((os.getpid(), self.path)).connection.close()
@@ -0,0 +1,289 @@
+from html.entities import html5
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+# Tag sets of BeautifulSoup's HTMLTreeBuilder, the collector follows the same tree building rules.
+_EMPTY_ELEMENT_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param", "source",
+    "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer"
+])
+_STRING_CONTAINER_TAGS = frozenset(["rt", "rp", "style", "script", "template"])
+_PRESERVE_WHITESPACE_TAGS = frozenset(["pre", "textarea"])
+_HEADER_TAGS = frozenset(["h1", "h2", "h3", "h4", "h5", "h6"])
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+_ENTITIES = {name[:-1] if name.endswith(";") else name: character for name, character in html5.items()}
+
+
+class _Element:
+    __slots__ = ("name", "text_start", "target", "children")
+
+    def __init__(self, name: str, text_start: int, target: Optional[Tuple[List, int]], children: Optional[List]):
+        """Open element on the stack of the collector.
+
+        :param name: Tag name.
+        :type name: str
+        :param text_start: Index of the first text segment inside the element.
+        :type text_start: int
+        :param target: Headers or paragraphs list and the index of this element in it, None if the text isn't collected.
+        :type target: Optional[Tuple[List, int]]
+        :param children: Children of an element inside the title, used to resolve the string of the title.
+        :type children: Optional[List]
+        """
+        self.name = name
+        self.text_start = text_start
+        self.target = target
+        self.children = children
+
+
+class _TextCollector(HTMLParser):
+    def __init__(self):
+        """Single pass HTML parser collecting the title, h1-h6, and p text without building a tree.
+        The same events as BeautifulSoup's html.parser builder are handled with the same rules: end tags close up to
+        the most recent open tag of that name, void elements close immediately, whitespace only text collapses to one
+        space or newline, and text inside script, style, template, rt, and rp or in comments isn't text of the tag.
+        """
+        super().__init__(convert_charrefs=False)
+        self.segments = []
+        self.headers = []
+        self.paragraphs = []
+        self._title_children = None
+        self._stack = []
+        self._open_counts = {}
+        self._containers = 0
+        self._preserve_whitespace = 0
+        self._data = []
+        self._already_closed_empty_element = []
+
+    def _end_data(self, string_type: str = "text"):
+        """Finish the current text segment, like BeautifulSoup.endData().
+
+        :param string_type: text for text, which isn't tag text inside script, style, template, rt, and rp, cdata for
+        CDATA sections, which are always tag text, or other for comments, declarations, and processing instructions,
+        which are never tag text.
+        :type string_type: str
+        """
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data = []
+        if self._preserve_whitespace == 0 and data.strip(_ASCII_SPACES) == "":
+            data = "\n" if "\n" in data else " "
+
+        if self._stack and self._stack[-1].children is not None:
+            self._stack[-1].children.append(data)
+        if string_type == "cdata" or (string_type == "text" and self._containers == 0):
+            self.segments.append(data)
+
+    def _push(self, name: str):
+        """Open an element.
+
+        :param name: Tag name.
+        :type name: str
+        """
+        target = None
+        if name in _HEADER_TAGS or name == "p":
+            texts = self.headers if name != "p" else self.paragraphs
+            texts.append(None)
+            target = (texts, len(texts) - 1)
+
+        children = None
+        if self._stack and self._stack[-1].children is not None:
+            # Inside the title, the element is a child of its parent.
+            children = []
+            self._stack[-1].children.append(children)
+        elif name == "title" and self._title_children is None:
+            children = []
+            self._title_children = children
+
+        self._stack.append(_Element(name, len(self.segments), target, children))
+        self._open_counts[name] = self._open_counts.get(name, 0) + 1
+        if name in _STRING_CONTAINER_TAGS:
+            self._containers += 1
+        if name in _PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace += 1
+
+    def _pop(self):
+        """Close the most recently opened element and store its text if it is collected."""
+        element = self._stack.pop()
+        self._open_counts[element.name] -= 1
+        if element.name in _STRING_CONTAINER_TAGS:
+            self._containers -= 1
+        if element.name in _PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace -= 1
+        if element.target is not None:
+            target, index = element.target
+            target[index] = "".join(self.segments[element.text_start:])
+
+    def _pop_to_tag(self, name: str):
+        """Close the elements up to and including the most recent open element with the name, like
+        BeautifulSoup._popToTag(). Nothing is closed if no element with the name is open.
+
+        :param name: Tag name.
+        :type name: str
+        """
+        if not self._open_counts.get(name):
+            return
+        while self._stack[-1].name != name:
+            self._pop()
+        self._pop()
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]], handle_empty_element: bool = True):
+        self._end_data()
+        self._push(tag)
+        if tag in _EMPTY_ELEMENT_TAGS and handle_empty_element:
+            self._end_data()
+            self._pop_to_tag(tag)
+            self._already_closed_empty_element.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str):
+        if tag in self._already_closed_empty_element:
+            self._already_closed_empty_element.remove(tag)
+        else:
+            self._end_data()
+            self._pop_to_tag(tag)
+
+    def handle_data(self, data: str):
+        self._data.append(data)
+
+    def handle_charref(self, name: str):
+        if name.startswith("x") or name.startswith("X"):
+            code_point = int(name.lstrip("xX"), 16)
+        else:
+            code_point = int(name)
+
+        data = None
+        if code_point < 256:
+            try:
+                data = bytearray([code_point]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(code_point)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name: str):
+        self.handle_data(_ENTITIES.get(name, f"&{name}"))
+
+    def _handle_special(self, data: str, string_type: str = "other"):
+        """Store comments, declarations, CDATA sections, and processing instructions as separate segments.
+
+        :param data: Content of the comment, declaration, section, or instruction.
+        :type data: str
+        :param string_type: cdata for CDATA sections, other otherwise.
+        :type string_type: str
+        """
+        self._end_data()
+        self._data.append(data)
+        self._end_data(string_type)
+
+    def handle_comment(self, data: str):
+        self._handle_special(data)
+
+    def handle_decl(self, decl: str):
+        self._handle_special(decl[len("DOCTYPE "):])
+
+    def unknown_decl(self, data: str):
+        if data.upper().startswith("CDATA["):
+            self._handle_special(data[len("CDATA["):], "cdata")
+        else:
+            self._handle_special(data)
+
+    def handle_pi(self, data: str):
+        self._handle_special(data)
+
+    def close(self):
+        super().close()
+        self._end_data()
+        while self._stack:
+            self._pop()
+
+
+def _string(children: List) -> Optional[str]:
+    """Resolve the string of an element like BeautifulSoup's Tag.string.
+
+    :param children: Children of the element, strings or lists of children of child elements.
+    :type children: List
+    :return: The string if the element has a single child that is a string or has a string, None otherwise.
+    :rtype: Optional[str]
+    """
+    if len(children) != 1:
+        return None
+    if isinstance(children[0], str):
+        return children[0]
+    return _string(children[0])
+
+
+def extract_text(html: str) -> Tuple[str, List[str], List[str]]:
+    """Collect the title, header, and paragraph text of an HTML document in a single pass.
+    Gives the same text as html_soup.title.string and [tag.text for tag in html_soup.find_all(...)] on a
+    BeautifulSoup(html, "html.parser") object.
+
+    :param html: Decoded HTML document.
+    :type html: str
+    :return: Title text, empty if there is no title string, text per h1-h6 tag, and text per p tag in document order.
+    :rtype: Tuple[str, List[str], List[str]]
+    """
+    collector = _TextCollector()
+    collector.feed(html)
+    collector.close()
+
+    title = None
+    if collector._title_children is not None:
+        title = _string(collector._title_children)
+    return title or "", collector.headers, collector.paragraphs
+
+
+if __name__ == "__main__":
+    import argparse
+    import gzip
+    import sys
+    import time
+    from collections import Counter
+
+    from sentences import configure as configure_sentences
+    from warc import html_records, process_payload, split_records
+
+    parser = argparse.ArgumentParser("html_stream")
+    parser.add_argument(
+        "--warc",
+        dest="warc",
+        required=False,
+        default="data/warcs/sample.warc.gz",
+        help="Path to the warc zip of which the rows of both engines are compared.",
+        type=str
+    )
+    args = parser.parse_args()
+
+    # Load the punkt model once, downloading it only if it is missing.
+    configure_sentences()
+
+    # Compare the rows of both engines on every HTML record and time them in a single process.
+    seconds = Counter()
+    records = 0
+    different = []
+    with gzip.open(args.warc, "rb") as warc_file:
+        for key_html in html_records(split_records(warc_file), Counter()):
+            rows = {}
+            for engine in ("bs4", "stream"):
+                start = time.perf_counter()
+                rows[engine] = process_payload(key_html, engine)
+                seconds[engine] += time.perf_counter() - start
+            records += 1
+            if rows["bs4"] != rows["stream"]:
+                different.append(key_html[0])
+
+    print(f"{records} HTML records, {records - len(different)} identical rows.")
+    for key in different[:10]:
+        print(f"Different row: {key}")
+    for engine in ("bs4", "stream"):
+        print(f"{engine}: {seconds[engine]:.2f}s")
+    if seconds["stream"] > 0:
+        print(f"Speedup: {seconds['bs4'] / seconds['stream']:.2f}x")
+    sys.exit(1 if different else 0)
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import dbpedia_utils
+
+BACKENDS = ("sparql", "async", "local", "replay", "stub")
+
+# Recorded candidates per mention-group pair by path of the recordings, loaded once per process. Pool tasks receive a
+# pickled copy of ReplayBackend, a forked worker reuses the recordings loaded by its parent.
+_recordings: Dict[str, Dict[Tuple[str, str], object]] = {}
+
+
+class LinkingBackend:
+    def generate_candidates(self, mention_groups: List[Tuple[str, str]]) -> Dict[Tuple[str, str], object]:
+        """Generate the candidates of many mentions. Every backend gives back the candidates in the format of
+        dbpedia_utils.generate_candidates(), so the ranking doesn't depend on the backend.
+        Backends are pickled into the pool workers, so connections have to be opened lazily per process.
+
+        :param mention_groups: Pairs of the original mention and the group to which the mention belongs.
+        :type mention_groups: List[Tuple[str, str]]
+        :return: Candidates per mention-group pair. None for mentions of which the lookup failed.
+        :rtype: Dict[Tuple[str, str], object]
+        """
+        raise NotImplementedError
+
+    def source(self) -> str:
+        """Describe where the candidates come from, stored with the links in the persistent entity link cache.
+
+        :return: Name of the backend and its endpoint or file.
+        :rtype: str
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources of the backend in this process."""
+        pass
+
+
+class SparqlBackend(LinkingBackend):
+    endpoint = None
+    batch_size = None
+
+    def __init__(self, endpoint: str = "http://dbpedia.org/sparql", batch_size: int = 20):
+        """Remote backend sending batched SPARQL queries using dbpedia_utils.generate_candidates_batch().
+
+        :param endpoint: URL of the SPARQL endpoint.
+        :type endpoint: str
+        :param batch_size: Maximum amount of mentions per query, 1 sends one query per mention.
+        :type batch_size: int
+        """
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+
+    def generate_candidates(self, mention_groups: List[Tuple[str, str]]) -> Dict[Tuple[str, str], object]:
+        # Point the module wide wrapper of this process to the endpoint of the backend.
+        if dbpedia_utils.sparql.endpoint != self.endpoint:
+            dbpedia_utils.set_endpoint(self.endpoint)
+        return dbpedia_utils.generate_candidates_batch(mention_groups, self.batch_size)
+
+    def source(self) -> str:
+        return f"sparql {self.endpoint}"
+
+
+class RecordingBackend(LinkingBackend):
+    backend = None
+    path = None
+
+    def __init__(self, backend: LinkingBackend, path: str):
+        """Wraps a backend and appends every lookup with its candidates to a JSON lines file for ReplayBackend.
+        Every lookup is written with a single append, so the pool workers can record into the same file.
+
+        :param backend: Backend that performs the lookups.
+        :type backend: LinkingBackend
+        :param path: JSON lines file the lookups are appended to.
+        :type path: str
+        """
+        self.backend = backend
+        self.path = path
+
+    def generate_candidates(self, mention_groups: List[Tuple[str, str]]) -> Dict[Tuple[str, str], object]:
+        candidates = self.backend.generate_candidates(mention_groups)
+        lines = "".join(
+            json.dumps({"mention": mention, "group": group, "candidates": mention_candidates}) + "\n"
+            for (mention, group), mention_candidates in candidates.items()
+            # Failed lookups are not recorded, the replay would otherwise never link the mention.
+            if mention_candidates is not None
+        )
+        if len(lines) > 0:
+            file = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(file, lines.encode("UTF-8"))
+            finally:
+                os.close(file)
+        return candidates
+
+    def source(self) -> str:
+        return self.backend.source()
+
+    def close(self):
+        self.backend.close()
+
+
+class ReplayBackend(LinkingBackend):
+    path = None
+    latency = None
+    latency_per_mention = None
+
+    def __init__(self, path: str, latency: float = 0.0, latency_per_mention: float = 0.0):
+        """Replays lookups recorded by RecordingBackend, with configurable synthetic latency.
+        Mentions that weren't recorded get no candidates. The recordings are loaded once per process.
+
+        :param path: JSON lines file written by RecordingBackend.
+        :type path: str
+        :param latency: Seconds every call to generate_candidates() takes, simulating a round trip.
+        :type latency: float
+        :param latency_per_mention: Additional seconds per looked up mention.
+        :type latency_per_mention: float
+        """
+        self.path = path
+        self.latency = latency
+        self.latency_per_mention = latency_per_mention
+
+    def _load(self) -> Dict[Tuple[str, str], object]:
+        """Load the recordings if this process hasn't done that yet, later recordings of a mention win.
+
+        :return: Recorded candidates per mention-group pair.
+        :rtype: Dict[Tuple[str, str], object]
+        """
+        recordings = _recordings.get(self.path)
+        if recordings is None:
+            recordings = {}
+            with open(self.path, encoding="UTF-8") as file:
+                for line in file:
+                    if line.strip():
+                        recording = json.loads(line)
+                        recordings[(recording["mention"], recording["group"])] = recording["candidates"]
+            _recordings[self.path] = recordings
+        return recordings
+
+    def generate_candidates(self, mention_groups: List[Tuple[str, str]]) -> Dict[Tuple[str, str], object]:
+        recordings = self._load()
+        unique_mention_groups = list(dict.fromkeys(mention_groups))
+        if len(unique_mention_groups) > 0:
+            delay = self.latency + self.latency_per_mention * len(unique_mention_groups)
+            if delay > 0:
+                time.sleep(delay)
+        return {
+            mention_group: recordings.get(mention_group, {"results": {"bindings": []}})
+            for mention_group in unique_mention_groups
+        }
+
+    def source(self) -> str:
+        return f"replay {os.path.abspath(self.path)}"
+
+
+class StubBackend(LinkingBackend):
+    candidates_per_mention = None
+    latency = None
+    link_ratio = None
+
+    def __init__(self, candidates_per_mention: int = 5, latency: float = 0.0, link_ratio: float = 0.8):
+        """Deterministic backend generating synthetic candidates from a hash of the mention, for benchmarks.
+        The same mention always gets the same candidates, independent of process, run, or order.
+
+        :param candidates_per_mention: Amount of candidates of a mention that gets linked.
+        :type candidates_per_mention: int
+        :param latency: Seconds every call to generate_candidates() takes, simulating a round trip.
+        :type latency: float
+        :param link_ratio: Fraction of the mentions that get candidates.
+        :type link_ratio: float
+        """
+        self.candidates_per_mention = candidates_per_mention
+        self.latency = latency
+        self.link_ratio = link_ratio
+
+    def candidates(self, mention: str, group: str) -> object:
+        """Generate the synthetic candidates of a mention.
+
+        :param mention: Original mention.
+        :type mention: str
+        :param group: Group to which the mention belongs.
+        :type group: str
+        :return: Candidates in the same format as generate_candidates().
+        :rtype: object
+        """
+        digest = hashlib.blake2b(f"{group}\t{mention}".encode("UTF-8"), digest_size=16).digest()
+        if digest[0] / 256 >= self.link_ratio:
+            return {"results": {"bindings": []}}
+
+        name = dbpedia_utils.dbpedia_format(mention)[2]
+        bindings = []
+        for index in range(self.candidates_per_mention):
+            candidate_name = name if index == 0 else f"{name} ({index})"
+            resource = candidate_name.replace(" ", "_")
+            bindings.append({
+                "item": {"type": "uri", "value": f"http://dbpedia.org/resource/{resource}"},
+                "name": {"type": "literal", "xml:lang": "en", "value": candidate_name},
+                "page": {"type": "uri", "value": f"http://en.wikipedia.org/wiki/{resource}"},
+                "count": {"type": "typed-literal", "value": str(digest[1 + index % 15] * (index + 1))}
+            })
+        return {"results": {"bindings": bindings}}
+
+    def generate_candidates(self, mention_groups: List[Tuple[str, str]]) -> Dict[Tuple[str, str], object]:
+        unique_mention_groups = list(dict.fromkeys(mention_groups))
+        if len(unique_mention_groups) > 0 and self.latency > 0:
+            time.sleep(self.latency)
+        return {(mention, group): self.candidates(mention, group) for mention, group in unique_mention_groups}
+
+    def source(self) -> str:
+        return f"stub {self.candidates_per_mention} {self.link_ratio}"
+
+
+def create_backend(
+        name: str,
+        endpoint: str = "http://dbpedia.org/sparql",
+        batch_size: int = 20,
+        max_in_flight: int = 16,
+        requests_per_second: float = 10,
+        local_index: Optional[str] = None,
+        replay_path: Optional[str] = None,
+        latency: float = 0.0,
+        record_path: Optional[str] = None
+) -> LinkingBackend:
+    """Create the linking backend selected on the command line.
+
+    :param name: One of BACKENDS.
+    :type name: str
+    :param endpoint: URL of the SPARQL endpoint of the sparql and async backends.
+    :type endpoint: str
+    :param batch_size: Maximum amount of mentions per query of the sparql backend.
+    :type batch_size: int
+    :param max_in_flight: Maximum amount of concurrent requests of the async backend.
+    :type max_in_flight: int
+    :param requests_per_second: Maximum amount of requests per second of the async backend.
+    :type requests_per_second: float
+    :param local_index: Path to the index of the local backend.
+    :type local_index: Optional[str]
+    :param replay_path: Recordings replayed by the replay backend.
+    :type replay_path: Optional[str]
+    :param latency: Synthetic seconds per lookup call of the replay and stub backends.
+    :type latency: float
+    :param record_path: If given, every lookup of the backend is recorded to this file for the replay backend.
+    :type record_path: Optional[str]
+    :return: The backend.
+    :rtype: LinkingBackend
+    """
+    if name == "sparql":
+        backend = SparqlBackend(endpoint, batch_size)
+    elif name == "async":
+        # Imported here so aiohttp is only required when the async backend is used.
+        from async_linking import AsyncSparqlClient
+        backend = AsyncSparqlClient(endpoint, max_in_flight, requests_per_second)
+    elif name == "local":
+        if local_index is None:
+            raise ValueError("The local linking backend requires the path to a local index.")
+        from local_index import LocalIndex
+        backend = LocalIndex(local_index)
+    elif name == "replay":
+        if replay_path is None:
+            raise ValueError("The replay linking backend requires the path to recorded lookups.")
+        backend = ReplayBackend(replay_path, latency)
+    elif name == "stub":
+        backend = StubBackend(latency=latency)
+    else:
+        raise ValueError(f"Unknown linking backend {name}, choose from {', '.join(BACKENDS)}.")
+
+    if record_path is not None:
+        backend = RecordingBackend(backend, record_path)
+    return backend
@@ -0,0 +1,476 @@
+import argparse
+import bz2
+import gzip
+import itertools
+import os
+import re
+import sqlite3
+import sys
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dbpedia_utils import dbpedia_format
+from linking_backends import LinkingBackend
+
+RESOURCE_PREFIX = "http://dbpedia.org/resource/"
+WIKIPEDIA_PREFIX = "http://en.wikipedia.org/wiki/"
+
+# Namespaces of the types, stored in the prefixed form used by the groups of pruned_groups_dict.
+TYPE_PREFIXES = {
+    "http://dbpedia.org/ontology/": "dbo:",
+    "http://www.w3.org/2002/07/owl#": "owl:",
+    "http://www.w3.org/2003/01/geo/wgs84_pos#": "geo:",
+    "http://xmlns.com/foaf/0.1/": "foaf:",
+    "http://schema.org/": "schema:",
+}
+
+LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+REDIRECT = "http://dbpedia.org/ontology/wikiPageRedirects"
+DISAMBIGUATES = "http://dbpedia.org/ontology/wikiPageDisambiguates"
+TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+WIKILINK = "http://dbpedia.org/ontology/wikiPageWikiLink"
+PRIMARY_TOPIC = "http://xmlns.com/foaf/0.1/isPrimaryTopicOf"
+
+_TRIPLE_RE = re.compile(r'^<([^>]*)> <([^>]*)> (?:<([^>]*)>|"((?:[^"\\]|\\.)*)"(?:@([\w-]+)|\^\^<[^>]*>)?) \.')
+_ESCAPE_RE = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+# Amount of triples inserted into a staging table at once while building the index.
+_BATCH_SIZE = 100_000
+_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+def _unescape_literal(literal: str) -> str:
+    """Undo the escaping of an N-Triples string literal.
+
+    :param literal: Escaped literal without quotes.
+    :type literal: str
+    :return: Unescaped literal.
+    :rtype: str
+    """
+    if "\\" not in literal:
+        return literal
+
+    def replace(match: re.Match) -> str:
+        """Replace a single escape sequence."""
+        escape = match.group(1)
+        if escape[0] in "uU":
+            return chr(int(escape[1:], 16))
+        return _ESCAPES.get(escape, "")
+
+    return _ESCAPE_RE.sub(replace, literal)
+
+
+def read_triples(path: str) -> Iterator[Tuple[str, str, str, Optional[str]]]:
+    """Read the triples of a DBpedia N-Triples/Turtle dump, which may be compressed with bz2 or gzip.
+
+    :param path: Path to the dump.
+    :type path: str
+    :return: Yields the subject, predicate, object, and the language for literal objects (empty if there is none).
+    Resource objects have None as language.
+    :rtype: Iterator[Tuple[str, str, str, Optional[str]]]
+    """
+    if path.endswith(".bz2"):
+        file = bz2.open(path, "rt", encoding="UTF-8", errors="ignore")
+    elif path.endswith(".gz"):
+        file = gzip.open(path, "rt", encoding="UTF-8", errors="ignore")
+    else:
+        file = open(path, encoding="UTF-8", errors="ignore")
+
+    with file:
+        for line in file:
+            match = _TRIPLE_RE.match(line)
+            if match is None:
+                continue
+            subject, predicate, resource, literal, language = match.groups()
+            # IRIs may contain the same unicode escapes as literals.
+            subject = _unescape_literal(subject)
+            if resource is not None:
+                yield subject, predicate, _unescape_literal(resource), None
+            else:
+                yield subject, predicate, _unescape_literal(literal), language or ""
+
+
+def _prefixed_type(type_iri: str) -> str:
+    """Shorten a type IRI to the prefixed form used in the queries, e.g. dbo:Person.
+
+    :param type_iri: Full IRI of the type.
+    :type type_iri: str
+    :return: Prefixed type, or the full IRI if the namespace is unknown.
+    :rtype: str
+    """
+    for namespace, prefix in TYPE_PREFIXES.items():
+        if type_iri.startswith(namespace):
+            return prefix + type_iri[len(namespace):]
+    return type_iri
+
+
+def _insert_batches(
+        connection: sqlite3.Connection,
+        statement: str,
+        rows: Iterable[Tuple],
+        name_columns: Tuple[int, ...],
+        batch_size: int = _BATCH_SIZE
+):
+    """Insert rows into a staging table in batches, and register the resource names in the rows.
+
+    :param connection: Connection to the index that is built.
+    :type connection: sqlite3.Connection
+    :param statement: INSERT statement of the staging table.
+    :type statement: str
+    :param rows: Rows to insert.
+    :type rows: Iterable[Tuple]
+    :param name_columns: Columns of a row containing resource names, which get an id in the order they are first seen.
+    :type name_columns: Tuple[int, ...]
+    :param batch_size: Amount of rows inserted at once.
+    :type batch_size: int
+    """
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        connection.executemany(
+            "INSERT OR IGNORE INTO build_names (name) VALUES (?)",
+            ((row[column],) for row in batch for column in name_columns)
+        )
+        connection.executemany(statement, batch)
+
+
+def _resource_name(iri: str) -> Optional[str]:
+    """Get the name of a dbpedia resource without the resource namespace.
+
+    :param iri: IRI of the resource.
+    :type iri: str
+    :return: The name, None if the IRI isn't a dbpedia resource.
+    :rtype: Optional[str]
+    """
+    return iri[len(RESOURCE_PREFIX):] if iri.startswith(RESOURCE_PREFIX) else None
+
+
+def build_index(
+        out_path: str,
+        labels: List[str],
+        redirects: List[str],
+        disambiguations: List[str],
+        types: List[str],
+        wikilinks: List[str],
+        primary_topics: List[str]
+):
+    """Build the local index from DBpedia dumps. Resources are stored by id without the resource namespace and all
+    tables are sorted on their lookup key, so every question of build_query() is a single index lookup.
+    The triples are streamed into staging tables in batches and aggregated with SQL, so the full dumps never have to
+    fit in memory.
+
+    :param out_path: Path of the SQLite index to create, an existing index is replaced.
+    :type out_path: str
+    :param labels: Dumps containing rdfs:label triples, only English labels are stored.
+    :type labels: List[str]
+    :param redirects: Dumps containing dbo:wikiPageRedirects triples.
+    :type redirects: List[str]
+    :param disambiguations: Dumps containing dbo:wikiPageDisambiguates triples.
+    :type disambiguations: List[str]
+    :param types: Dumps containing rdf:type triples, preferably the transitive instance types.
+    :type types: List[str]
+    :param wikilinks: Dumps containing dbo:wikiPageWikiLink triples, used to count the links to every resource.
+    :type wikilinks: List[str]
+    :param primary_topics: Dumps containing foaf:isPrimaryTopicOf triples. Pages of resources without one are derived
+    from the resource name.
+    :type primary_topics: List[str]
+    """
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    connection = sqlite3.connect(out_path)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute("PRAGMA temp_store=FILE")
+    connection.executescript("""
+        CREATE TABLE labels (label TEXT NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (label, id)) WITHOUT ROWID;
+        CREATE TABLE redirects (source INTEGER NOT NULL, target INTEGER NOT NULL, PRIMARY KEY (source, target))
+            WITHOUT ROWID;
+        CREATE TABLE disambiguations (page INTEGER NOT NULL, target INTEGER NOT NULL, PRIMARY KEY (page, target))
+            WITHOUT ROWID;
+        CREATE TABLE types (id INTEGER NOT NULL, type TEXT NOT NULL, PRIMARY KEY (id, type)) WITHOUT ROWID;
+        CREATE TABLE resources (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            label TEXT,
+            links INTEGER NOT NULL,
+            page TEXT
+        );
+
+        -- Staging tables holding the triples by resource name, dropped when the index is built.
+        CREATE TABLE build_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE build_labels (label TEXT NOT NULL, name TEXT NOT NULL);
+        CREATE TABLE build_redirects (source TEXT NOT NULL, target TEXT NOT NULL);
+        CREATE TABLE build_disambiguations (page TEXT NOT NULL, target TEXT NOT NULL);
+        CREATE TABLE build_types (name TEXT NOT NULL, type TEXT NOT NULL);
+        CREATE TABLE build_links (name TEXT PRIMARY KEY, links INTEGER NOT NULL) WITHOUT ROWID;
+        CREATE TABLE build_pages (name TEXT NOT NULL, page TEXT NOT NULL);
+    """)
+
+    for path in labels:
+        _insert_batches(connection, "INSERT INTO build_labels VALUES (?, ?)", (
+            (label, name)
+            for name, label in (
+                (_resource_name(subject), label)
+                for subject, predicate, label, language in read_triples(path)
+                if predicate == LABEL and language is not None and language.lower().startswith("en")
+            )
+            if name is not None
+        ), (1,))
+
+    for table, predicate_iri, paths in (
+            ("build_redirects", REDIRECT, redirects),
+            ("build_disambiguations", DISAMBIGUATES, disambiguations)
+    ):
+        for path in paths:
+            _insert_batches(connection, f"INSERT INTO {table} VALUES (?, ?)", (
+                names
+                for names in (
+                    (_resource_name(subject), _resource_name(target))
+                    for subject, predicate, target, language in read_triples(path)
+                    if predicate == predicate_iri and language is None
+                )
+                if names[0] is not None and names[1] is not None
+            ), (0, 1))
+
+    for path in types:
+        _insert_batches(connection, "INSERT INTO build_types VALUES (?, ?)", (
+            (name, _prefixed_type(type_iri))
+            for name, type_iri in (
+                (_resource_name(subject), type_iri)
+                for subject, predicate, type_iri, language in read_triples(path)
+                if predicate == TYPE and language is None
+            )
+            if name is not None
+        ), (0,))
+
+    for path in wikilinks:
+        _insert_batches(connection, """
+            INSERT INTO build_links (name, links) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET links = links + 1
+        """, (
+            (name,)
+            for name in (
+                _resource_name(target)
+                for _, predicate, target, language in read_triples(path)
+                if predicate == WIKILINK and language is None
+            )
+            if name is not None
+        ), (0,))
+
+    for path in primary_topics:
+        _insert_batches(connection, "INSERT INTO build_pages VALUES (?, ?)", (
+            (name, page)
+            for name, page in (
+                (_resource_name(subject), page)
+                for subject, predicate, page, language in read_triples(path)
+                if predicate == PRIMARY_TOPIC and language is None
+            )
+            if name is not None
+        ), (0,))
+
+    connection.executescript("""
+        INSERT OR IGNORE INTO labels
+            SELECT build_labels.label, build_names.id FROM build_labels JOIN build_names USING (name) ORDER BY 1, 2;
+        INSERT OR IGNORE INTO redirects
+            SELECT source.id, target.id FROM build_redirects
+            JOIN build_names AS source ON source.name = build_redirects.source
+            JOIN build_names AS target ON target.name = build_redirects.target
+            ORDER BY 1, 2;
+        INSERT OR IGNORE INTO disambiguations
+            SELECT page.id, target.id FROM build_disambiguations
+            JOIN build_names AS page ON page.name = build_disambiguations.page
+            JOIN build_names AS target ON target.name = build_disambiguations.target
+            ORDER BY 1, 2;
+        INSERT OR IGNORE INTO types
+            SELECT build_names.id, build_types.type FROM build_types JOIN build_names USING (name) ORDER BY 1, 2;
+
+        -- The first English label of a resource is its name, the last primary topic its page.
+        CREATE TABLE build_first_labels (name TEXT PRIMARY KEY, label TEXT NOT NULL) WITHOUT ROWID;
+        INSERT OR IGNORE INTO build_first_labels SELECT name, label FROM build_labels ORDER BY rowid;
+        CREATE TABLE build_last_pages (name TEXT PRIMARY KEY, page TEXT NOT NULL) WITHOUT ROWID;
+        INSERT OR REPLACE INTO build_last_pages SELECT name, page FROM build_pages ORDER BY rowid;
+
+        INSERT INTO resources
+            SELECT build_names.id, build_names.name, build_first_labels.label, COALESCE(build_links.links, 0),
+                build_last_pages.page
+            FROM build_names
+            LEFT JOIN build_first_labels USING (name)
+            LEFT JOIN build_links USING (name)
+            LEFT JOIN build_last_pages USING (name)
+            ORDER BY build_names.id;
+        CREATE UNIQUE INDEX resources_name ON resources (name);
+
+        DROP TABLE build_names;
+        DROP TABLE build_labels;
+        DROP TABLE build_redirects;
+        DROP TABLE build_disambiguations;
+        DROP TABLE build_types;
+        DROP TABLE build_links;
+        DROP TABLE build_pages;
+        DROP TABLE build_first_labels;
+        DROP TABLE build_last_pages;
+    """)
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+
+
+# Read-only connections by pid and index path. Pool tasks receive a pickled copy of the index, the connection of a
+# process is kept here so all tasks of a worker share it. A forked child ignores the connections of its parent.
+_connections: Dict[Tuple[int, str], sqlite3.Connection] = {}
+
+
+class LocalIndex(LinkingBackend):
+    path = None
+
+    def __init__(self, path: str, mmap_size: int = 1 << 34):
+        """Read-only linking backend on a local index built by build_index(). Answers the same questions as
+        build_query() without any remote endpoint. The index is opened and memory-mapped once per process and the
+        connection is kept outside the object, so the object can be pickled into every pool task.
+
+        :param path: Path to the SQLite index.
+        :type path: str
+        :param mmap_size: Maximum amount of bytes of the index that are memory-mapped.
+        :type mmap_size: int
+        """
+        self.path = path
+        self.mmap_size = mmap_size
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the index for the current process if that hasn't been done yet.
+
+        :return: Read-only connection to the index.
+        :rtype: sqlite3.Connection
+        """
+        key = (os.getpid(), self.path)
+        connection = _connections.get(key)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            _connections[key] = connection
+        return connection
+
+    def _resource_id(self, name: str) -> Optional[int]:
+        """Get the id of a resource by its name.
+
+        :param name: Resource name without namespace, e.g. Michael_Jordan.
+        :type name: str
+        :return: Id of the resource, None if it is unknown.
+        :rtype: Optional[int]
+        """
+        row = self._connect().execute("SELECT id FROM resources WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def candidates(self, mention: str, group: str) -> object:
+        """Generate the candidates of a mention from the index, mirroring the query of generate_candidates().
+        Items are matched on their label, on the label of a redirect to them, and on the (disambiguation) page of the
+        mention. Like the COUNT of the SPARQL query, the link count of an item is multiplied by the amount of cases
+        that matched it. The owl:Thing group accepts every resource.
+
+        :param mention: Original mention.
+        :type mention: str
+        :param group: Group to which the mention belongs.
+        :type group: str
+        :return: Candidates in the same format as generate_candidates().
+        :rtype: object
+        """
+        connection = self._connect()
+        mention_0, mention_1, mention_2, mention_3 = dbpedia_format(mention)
+        formats = [(mention_2, mention_3)]
+        if mention_0 != mention_2:
+            formats.append((mention_0, mention_1))
+
+        matches = Counter()
+        for label, name in formats:
+            label_ids = [row[0] for row in connection.execute("SELECT id FROM labels WHERE label = ?", (label,))]
+            matches.update(label_ids)
+            for label_id in label_ids:
+                matches.update(row[0] for row in connection.execute(
+                    "SELECT target FROM redirects WHERE source = ?", (label_id,)
+                ))
+            for page_name in (name + "_(disambiguation)", name):
+                page_id = self._resource_id(page_name)
+                if page_id is not None:
+                    matches.update(row[0] for row in connection.execute(
+                        "SELECT target FROM disambiguations WHERE page = ?", (page_id,)
+                    ))
+
+        bindings = []
+        for item_id, multiplicity in matches.items():
+            if group != "owl:Thing" and connection.execute(
+                    "SELECT 1 FROM types WHERE id = ? AND type = ?", (item_id, group)
+            ).fetchone() is None:
+                continue
+            name, label, links, page = connection.execute(
+                "SELECT name, label, links, page FROM resources WHERE id = ?", (item_id,)
+            ).fetchone()
+            # The query joins on the linking sources and the English label, so both are required.
+            if links == 0 or label is None:
+                continue
+            bindings.append({
+                "item": {"type": "uri", "value": RESOURCE_PREFIX + name},
+                "name": {"type": "literal", "xml:lang": "en", "value": label},
+                "page": {"type": "uri", "value": page if page is not None else WIKIPEDIA_PREFIX + name},
+                "count": {"type": "typed-literal", "value": str(links * multiplicity)}
+            })
+        return {"results": {"bindings": bindings}}
+
+    def generate_candidates(self, mention_groups: List[Tuple[str, str]]) -> Dict[Tuple[str, str], object]:
+        """Generate the candidates of many mentions, same interface as generate_candidates_batch().
+
+        :param mention_groups: Pairs of the original mention and the group to which the mention belongs.
+        :type mention_groups: List[Tuple[str, str]]
+        :return: Candidates per mention-group pair.
+        :rtype: Dict[Tuple[str, str], object]
+        """
+        return {(mention, group): self.candidates(mention, group) for mention, group in dict.fromkeys(mention_groups)}
+
+    def source(self) -> str:
+        return f"local {os.path.abspath(self.path)}"
+
+    def close(self):
+        """Close the connection of this process."""
+        connection = _connections.pop((os.getpid(), self.path), None)
+        if connection is not None:
+            connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("wdp-local-index")
+    parser.add_argument(
+        "--out",
+        dest="out",
+        required=False,
+        default="data/dbpedia_index.sqlite",
+        help="Path of the local index to build.",
+        type=str
+    )
+    for dump, description in (
+            ("labels", "rdfs:label"),
+            ("redirects", "dbo:wikiPageRedirects"),
+            ("disambiguations", "dbo:wikiPageDisambiguates"),
+            ("types", "rdf:type"),
+            ("wikilinks", "dbo:wikiPageWikiLink"),
+            ("primary_topics", "foaf:isPrimaryTopicOf")
+    ):
+        parser.add_argument(
+            f"--{dump}",
+            dest=dump,
+            required=False,
+            default=[],
+            nargs="+",
+            help=f"DBpedia dumps (.ttl/.nt, optionally .bz2 or .gz) containing {description} triples.",
+            type=str
+        )
+    args = parser.parse_args()
+
+    build_index(
+        args.out,
+        args.labels,
+        args.redirects,
+        args.disambiguations,
+        args.types,
+        args.wikilinks,
+        args.primary_topics
+    )
+    print(f"Built local index {args.out}", file=sys.stderr)
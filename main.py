@@ -1,17 +1,32 @@
 import argparse
+import contextlib
 import csv
 import datetime
+import itertools
 import os
+import sys
+import threading
 import multiprocessing as mp
-from typing import List, Tuple
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
 
 import spacy
 import spacy_transformers
 import logging
 
-from warc import process_warc_zip, save_pre_proc
+from warc import HTML_ENGINES, WARC_READERS, format_skipped, process_warc_zip, stream_pre_proc
+from sentences import SENTENCE_SPLITTERS, configure as configure_sentences
+from pipeline import bounded_imap_unordered, chunked
 from relation_extraction import ReverbNoNlp
-from dbpedia_with_EL import link_entity
+from dbpedia_with_EL import link_entities
+from entity_cache import DAY, EntityLinkCache
+from mention_cache import MENTION_CACHES, SharedMentionCache, cache_stats
+from popularity import PopularityTable
+from checkpoint import Checkpoint, truncate_partial_line
+from preproc_store import PRE_PROC_FORMATS, PreProcReader
+from linking_backends import BACKENDS, LinkingBackend, SparqlBackend, create_backend
+from ner import TierRouter, TierStats, load_model, pipe_docs, tiered_pipe_docs
+import profiling
 
 # Disable spaCy warnings.
 logger = logging.getLogger("spacy")
@@ -31,62 +46,214 @@ def create_dirs(*dirs: List[str]):
             os.makedirs(directory)
 
 
-def pre_proc_stage(pre_proc_dir: str, filename: str) -> List[Tuple[str, str, str, str]]:
-    """Perform pre-processing on the warc zip, store the rows, and return the rows.
+def pre_proc_stage(
+        pre_proc_dir: str,
+        filename: str,
+        skipped: Counter,
+        checkpoint: Optional[Checkpoint] = None,
+        warc_path: str = "data/warcs/sample.warc.gz",
+        html_engine: str = "bs4",
+        sentence_splitter: str = "punkt",
+        offline: bool = False,
+        pre_proc_format: str = "csv",
+        warc_reader: str = "stream",
+        sample_records: int = 0,
+        sample_seed: Optional[int] = None
+) -> Iterator[Tuple[str, str, str, str]]:
+    """Perform pre-processing on the warc zip, store the rows, and pass the rows on as soon as they are stored.
+    If the checkpoint was resumed, the rows stored by the previous run are reused and only the records without a
+    stored row are pre-processed, their rows are appended to the same file in the format of the previous run.
 
     :param pre_proc_dir: Relative directory to store the pre-processed files in.
     :type pre_proc_dir: str
     :param filename: File name of the pre-processed files.
     :type filename: str
+    :param skipped: Counter receiving the amount of skipped warc records per reason.
+    :type skipped: Counter
+    :param checkpoint: Opened checkpoint storing the location of the pre-processed file and whether it is complete.
+    :type checkpoint: Optional[Checkpoint]
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :param html_engine: One of warc.HTML_ENGINES, used to extract the text from the HTML.
+    :type html_engine: str
+    :param sentence_splitter: One of sentences.SENTENCE_SPLITTERS, used to split the text into sentences.
+    :type sentence_splitter: str
+    :param offline: Never download the punkt model, fail if it isn't installed.
+    :type offline: bool
+    :param pre_proc_format: One of preproc_store.PRE_PROC_FORMATS, the format of the pre-processed file.
+    :type pre_proc_format: str
+    :param warc_reader: One of warc.WARC_READERS, how the warc zip is decompressed.
+    :type warc_reader: str
+    :param sample_records: Only pre-process a random sample of this amount of records, 0 processes all.
+    :type sample_records: int
+    :param sample_seed: Seed of the sample.
+    :type sample_seed: Optional[int]
     :return: Rows of processed warc files. A row contains the key, title, headers, and processed text.
-    :rtype: List[Tuple[str, str, str, str]
+    :rtype: Iterator[Tuple[str, str, str, str]]
     """
-    if filename is None:
+    state = {} if checkpoint is None else checkpoint.state
+    stored_rows = []
+    stored_keys = set()
+    stored_format = state.get("pre_proc_format", "csv")
+    if "pre_proc_filename" in state and os.path.exists(
+            f"{state['pre_proc_dir']}/{state['pre_proc_filename']}.{stored_format}"
+    ):
+        pre_proc_dir = state["pre_proc_dir"]
+        warc_filename = state["pre_proc_filename"]
+        pre_proc_format = stored_format
+        pre_proc_path = f"{pre_proc_dir}/{warc_filename}.{pre_proc_format}"
+
+        if pre_proc_format == "bin":
+            # Rows are read from the memory-mapped file when they are consumed, a partially written row is ignored.
+            reader = PreProcReader(pre_proc_path)
+            stored_rows = iter(reader)
+            stored_keys = set(reader.keys())
+        else:
+            # The previous run may have stopped while writing a row.
+            truncate_partial_line(pre_proc_path)
+            stored_rows = _load_proc_files_from_csv(pre_proc_path)
+            stored_keys = {row[0] for row in stored_rows}
+        if state.get("pre_proc_done", False):
+            return iter(stored_rows)
+    elif filename is None:
         # Use current date and time as unique identifier.
         warc_filename = f'warcs-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}'
     else:
-        warc_filename = args.filename
+        warc_filename = filename
+
+    if checkpoint is not None:
+        checkpoint.update_state(
+            pre_proc_dir=pre_proc_dir,
+            pre_proc_filename=warc_filename,
+            pre_proc_format=pre_proc_format,
+            pre_proc_done=False
+        )
 
     # Pre-process warc zip into rows containing key, title, headers, and processed text.
-    pre_proc = process_warc_zip()
+    pre_proc = process_warc_zip(
+        skipped,
+        warc_path,
+        skip_keys=stored_keys,
+        html_engine=html_engine,
+        sentence_splitter=sentence_splitter,
+        offline=offline,
+        warc_reader=warc_reader,
+        sample=sample_records,
+        sample_seed=sample_seed
+    )
 
-    # Save the rows.
-    save_pre_proc(pre_proc_dir, pre_proc, warc_filename)
+    # Save the rows while passing them on.
+    rows = stream_pre_proc(
+        pre_proc_dir,
+        pre_proc,
+        warc_filename,
+        append=len(stored_keys) > 0,
+        pre_proc_format=pre_proc_format
+    )
+    return itertools.chain(stored_rows, _mark_pre_proc_done(rows, checkpoint))
 
-    return pre_proc
+
+def _mark_pre_proc_done(
+        rows: Iterable[Tuple[str, str, str, str]],
+        checkpoint: Optional[Checkpoint]
+) -> Iterator[Tuple[str, str, str, str]]:
+    """Pass the rows through and record in the checkpoint that the pre-processed file is complete after the last row.
+
+    :param rows: Rows of processed warc files.
+    :type rows: Iterable[Tuple[str, str, str, str]]
+    :param checkpoint: Opened checkpoint, nothing is recorded if it is None.
+    :type checkpoint: Optional[Checkpoint]
+    :return: The rows.
+    :rtype: Iterator[Tuple[str, str, str, str]]
+    """
+    yield from rows
+    if checkpoint is not None:
+        checkpoint.update_state(pre_proc_done=True)
 
 
 class Extraction:
     rev = None
     process_entity_dict = None
+    link_cache = None
+    backend = None
+    popularity = None
 
-    def __init__(self, vocab: List):
+    def __init__(
+            self,
+            vocab: List,
+            link_cache: Optional[EntityLinkCache] = None,
+            backend: Optional[LinkingBackend] = None,
+            mention_cache: Optional[MutableMapping[str, Optional[str]]] = None,
+            popularity: Optional[PopularityTable] = None
+    ):
         """Initializes ReVerb and the dict that prevents unnecessary querying by storing performed query results.
 
         :param vocab: The vocabulary used during the NER.
         :type vocab: List
+        :param link_cache: Persistent entity link cache shared across runs and processes.
+        :type link_cache: Optional[EntityLinkCache]
+        :param backend: Linking backend generating the candidates, defaults to batched SPARQL queries on dbpedia.
+        :type backend: Optional[LinkingBackend]
+        :param mention_cache: Dictionary of the queried mentions, for example a SharedMentionCache shared by the pool
+        workers. Defaults to a dict of this object.
+        :type mention_cache: Optional[MutableMapping[str, Optional[str]]]
+        :param popularity: Popularity table to rank the candidates on instead of their dbpedia referrals.
+        :type popularity: Optional[PopularityTable]
         """
         self.rev = ReverbNoNlp(vocab)
-        self.process_entity_dict = {}
+        self.process_entity_dict = {} if mention_cache is None else mention_cache
+        self.link_cache = link_cache
+        self.backend = SparqlBackend() if backend is None else backend
+        self.popularity = popularity
 
-    def process_row(self, text_key: Tuple[str, str]) -> List[str]:
+    def process_row(self, text_key: Tuple[str, str]) -> Tuple[str, List[str]]:
         """Process one row, which is one warc file that contained HTML.
 
         :param text_key: Text-key pair containing the processed spaCy doc object and the warc file key.
         :type text_key: Tuple[str, str]
-        :return: List of formatted assignment strings containing the entities and relations.
-        :rtype: List[str]
+        :return: The warc file key and the list of formatted assignment strings containing the entities and relations.
+        :rtype: Tuple[str, List[str]]
         """
-        text, key = text_key
-        linked_entity_dict = link_entity(text, self.process_entity_dict)
-        relations = self.rev.extract_spacy_relations(text, linked_entity_dict)
+        return self.process_rows([text_key])[0]
 
-        res = []
-        for mention, link in linked_entity_dict.items():
-            res.append(Extraction.entity_to_str(key, mention, link))
-        for wiki1, relation, wiki2 in relations:
-            res.append(Extraction.relation_to_str(key, linked_entity_dict[wiki1], linked_entity_dict[wiki2], relation))
-        return res
+    def process_rows(self, text_keys: List[Tuple[str, str]]) -> List[Tuple[str, List[str]]]:
+        """Process a batch of rows. The mentions of all rows are linked together, so a mention occurring in several
+        rows is only looked up once.
+
+        :param text_keys: Text-key pairs containing the processed spaCy doc object and the warc file key.
+        :type text_keys: List[Tuple[str, str]]
+        :return: The warc file key and the list of formatted assignment strings per row, in the order of the rows.
+        :rtype: List[Tuple[str, List[str]]]
+        """
+        with profiling.stage("linking"):
+            linked_entity_dicts = link_entities(
+                [text for text, _ in text_keys],
+                self.process_entity_dict,
+                self.link_cache,
+                self.backend.generate_candidates,
+                self.popularity
+            )
+            if self.link_cache is not None:
+                # Pool workers may be terminated after any batch, so the access times and statistics are written now.
+                self.link_cache.flush()
+
+        results = []
+        for (text, key), linked_entity_dict in zip(text_keys, linked_entity_dicts):
+            with profiling.stage("reverb"):
+                relations = self.rev.extract_spacy_relations(text, linked_entity_dict)
+            profiling.count("entities", len(text.ents))
+            profiling.count("linked_entities", len(linked_entity_dict))
+            profiling.count("relations", len(relations))
+
+            res = []
+            for mention, link in linked_entity_dict.items():
+                res.append(Extraction.entity_to_str(key, mention, link))
+            for wiki1, relation, wiki2 in relations:
+                res.append(
+                    Extraction.relation_to_str(key, linked_entity_dict[wiki1], linked_entity_dict[wiki2], relation)
+                )
+            results.append((key, res))
+        return results
 
     @staticmethod
     def entity_to_str(key: str, mention: str, link: str) -> str:
@@ -119,60 +286,231 @@ class Extraction:
         return f"RELATION: {key}\t{wiki1}\t{wiki2}\t{relation}"
 
 
-def find_linked_relations(pre_proc_files: List[Tuple[str, str, str, str]], model_name: str, pool_size: int):
+# Model and extraction of a sharded worker process, set once by _init_sharded_worker().
+_worker_nlp = None
+_worker_extraction = None
+
+
+def _init_sharded_worker(
+        model_name: str,
+        link_cache: Optional[EntityLinkCache],
+        backend: Optional[LinkingBackend],
+        torch_threads: int,
+        mention_cache: Optional[MutableMapping[str, Optional[str]]] = None,
+        popularity: Optional[PopularityTable] = None
+):
+    """Pool initializer of the sharded mode. Loads the model once per worker.
+
+    :param model_name: Name of the used spaCy model.
+    :type model_name: str
+    :param link_cache: Persistent entity link cache consulted before querying.
+    :type link_cache: Optional[EntityLinkCache]
+    :param backend: Linking backend generating the candidates.
+    :type backend: Optional[LinkingBackend]
+    :param torch_threads: Amount of threads torch may use in this worker, prevents oversubscribing the cores with
+    transformer models.
+    :type torch_threads: int
+    :param mention_cache: Dictionary of the queried mentions shared by the workers, a dict per worker if None.
+    :type mention_cache: Optional[MutableMapping[str, Optional[str]]]
+    :param popularity: Popularity table to rank the candidates on.
+    :type popularity: Optional[PopularityTable]
+    """
+    global _worker_nlp, _worker_extraction
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+
+    _worker_nlp = load_model(model_name)
+    _worker_extraction = Extraction(_worker_nlp.vocab, link_cache, backend, mention_cache, popularity)
+
+
+def _process_text_rows(text_keys: List[Tuple[str, str]]) -> List[Tuple[str, List[str]]]:
+    """Run NER, entity linking, and relation extraction on a batch of plain texts inside a sharded worker.
+
+    :param text_keys: Text-key pairs containing the processed text and the warc file key.
+    :type text_keys: List[Tuple[str, str]]
+    :return: The warc file key and the list of formatted assignment strings containing the entities and relations per
+    row.
+    :rtype: List[Tuple[str, List[str]]]
+    """
+    with profiling.stage("ner"):
+        doc_keys = [(_worker_nlp(text), key) for text, key in text_keys]
+    return _worker_extraction.process_rows(doc_keys)
+
+
+def find_linked_relations(
+        pre_proc_files: Iterable[Tuple[str, str, str, str]],
+        model_name: str,
+        pool_size: int,
+        max_pending: Optional[int] = None,
+        out_path: str = "data/out",
+        link_cache: Optional[EntityLinkCache] = None,
+        backend: Optional[LinkingBackend] = None,
+        sharded: bool = False,
+        ner_options: Optional[Dict] = None,
+        fast_model_name: Optional[str] = None,
+        tier_options: Optional[Dict] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        link_batch_size: int = 1,
+        mention_cache: Optional[MutableMapping[str, Optional[str]]] = None,
+        popularity: Optional[PopularityTable] = None
+):
     """Performs entity linking and relation extraction. Both only output linked entities.
+    All stages are streamed, results are written as soon as a row has been processed.
+    In sharded mode every worker loads the model itself and receives only the text and key of a row, otherwise NER is
+    performed in this process and the docs are sent to the workers.
 
     :param pre_proc_files: 1 row per HTML warc. Row contains key, title, headers, and combined text.
-    :type pre_proc_files: List[Tuple[str, str, str, str]]
+    :type pre_proc_files: Iterable[Tuple[str, str, str, str]]
     :param model_name: Name of the used spaCy model.
     :type model_name: str
     :param pool_size: Amount of processes to spawn in the parallel pool.
     :type pool_size: int
+    :param max_pending: Maximum amount of chunks of docs in flight in the pool, defaults to 4 per process.
+    :type max_pending: Optional[int]
+    :param out_path: File the results get written to.
+    :type out_path: str
+    :param link_cache: Persistent entity link cache consulted before querying.
+    :type link_cache: Optional[EntityLinkCache]
+    :param backend: Linking backend generating the candidates.
+    :type backend: Optional[LinkingBackend]
+    :param sharded: If True run NER, linking, and relation extraction together in every worker.
+    :type sharded: bool
+    :param ner_options: Keyword arguments of ner.pipe_docs(): batch_size, n_process, bucket_window, and
+    max_chunk_chars. Not used in sharded mode.
+    :type ner_options: Optional[Dict]
+    :param fast_model_name: If given, NER is tiered: this model processes all pages and model_name only the pages
+    selected by the router. Not used in sharded mode.
+    :type fast_model_name: Optional[str]
+    :param tier_options: Keyword arguments of ner.tiered_pipe_docs(): router, stats, and audit_every. The router
+    defaults to TierRouter().
+    :type tier_options: Optional[Dict]
+    :param checkpoint: Opened checkpoint receiving the results instead of out_path, records the completed keys.
+    :type checkpoint: Optional[Checkpoint]
+    :param link_batch_size: Amount of rows of which the mentions are linked together, every unknown mention of the
+    batch is looked up once. Also the amount of rows sent to a worker at once.
+    :type link_batch_size: int
+    :param mention_cache: Dictionary of the queried mentions, a SharedMentionCache lets the workers use each other's
+    lookups. Every worker keeps its own dict if None.
+    :type mention_cache: Optional[MutableMapping[str, Optional[str]]]
+    :param popularity: Popularity table to rank the candidates on instead of their dbpedia referrals.
+    :type popularity: Optional[PopularityTable]
     :return: No output, everything is written to console and the data/out file.
     :rtype: None
     """
+    if max_pending is None:
+        max_pending = 4 * pool_size
+
+    # Pack all text together with the key as context, lazily so rows are consumed as they are produced.
+    text_context = ((pre_proc_file[3], pre_proc_file[0]) for pre_proc_file in pre_proc_files)
+
+    if sharded and pool_size > 1:
+        # Only plain text and keys are sent to the workers, the results are compact strings.
+        with mp.Pool(
+                processes=pool_size,
+                initializer=_init_sharded_worker,
+                initargs=(
+                    model_name, link_cache, backend, max(1, mp.cpu_count() // pool_size), mention_cache, popularity
+                )
+        ) as pool:
+            # The workers send their stage timings and counters along with the results.
+            results = bounded_imap_unordered(
+                pool,
+                profiling.Profiled(_process_text_rows),
+                chunked(text_context, link_batch_size),
+                max_pending
+            )
+            write_results(itertools.chain.from_iterable(profiling.collect(results)), out_path, checkpoint)
+            # Let the workers exit normally, so they close the sessions of their linking backend.
+            pool.close()
+            pool.join()
+        return
+
     # Processing of entire warc file using nlp.pipe with sm model takes 38s and with trf 2197s (about 36.6 minutes)
     # These timings are just the time in nlp.pipe, nothing is performed on the results.
-    nlp = spacy.load(model_name, disable=[
-        "textcat",
-        "tok2vec",
-        "parser",
-        "lemmatizer"
-    ])
-    nlp.add_pipe("sentencizer")
+    nlp = load_model(model_name)
 
     # Retrieve the used spaCy vocab. Later used by ReVerb.
     vocab = nlp.vocab
 
-    # Pack all text together with the key as context.
-    text_context = [(pre_proc_file[3], pre_proc_file[0]) for pre_proc_file in pre_proc_files]
-    # Processes all text in parallel, does nothing with the context except for passing it through.
-    doc_tuples = nlp.pipe(text_context, as_tuples=True)
+    # Processes all text in batches of similar length, does nothing with the context except for passing it through.
+    ner_options = ner_options or {}
+    if fast_model_name is None:
+        doc_tuples = pipe_docs(nlp, text_context, **ner_options)
+    else:
+        # The sm model processes everything, the trf model only the pages selected by the router.
+        tier_options = dict(tier_options or {})
+        router = tier_options.pop("router", None) or TierRouter()
+        doc_tuples = tiered_pipe_docs(
+            # Both tiers share one vocab, so ReVerb's matcher on that vocab matches the docs of either tier.
+            load_model(fast_model_name, vocab),
+            nlp,
+            text_context,
+            router,
+            window_size=ner_options.get("bucket_window") or 256,
+            **tier_options,
+            **ner_options
+        )
+
+    # Time the NER as a stage, the pre-processing of the rows it pulls is timed separately.
+    doc_tuples = profiling.timed_iter(doc_tuples, "ner")
 
     # Perform sequentially if only 1 process is used. Outside of multiprocessing Pool abstraction.
     if pool_size == 1:
-        results = []
         # Class keeping with 1 ReVerb instance, storing global dict to prevent duplicate queries.
-        extraction = Extraction(vocab)
-        for text_key in doc_tuples:
-            results.append(extraction.process_row(text_key))
+        extraction = Extraction(vocab, link_cache, backend, popularity=popularity)
+        results = (extraction.process_rows(batch) for batch in chunked(doc_tuples, link_batch_size))
+        write_results(itertools.chain.from_iterable(results), out_path, checkpoint)
     else:
         with mp.Pool(processes=pool_size) as pool:
             # Class keeping with 1 ReVerb instance, storing process wide dict to prevent duplicate queries.
-            extraction = Extraction(vocab)
-            results = pool.map(extraction.process_row, doc_tuples)
+            extraction = Extraction(vocab, link_cache, backend, mention_cache, popularity)
+            results = bounded_imap_unordered(
+                pool,
+                profiling.Profiled(extraction.process_rows),
+                chunked(doc_tuples, link_batch_size),
+                max_pending
+            )
+            write_results(itertools.chain.from_iterable(profiling.collect(results)), out_path, checkpoint)
+            pool.close()
+            pool.join()
 
-    # Print the results to the console.
-    for result in results:
-        for entry in result:
-            print(entry)
 
-    # Store the results in data/out.
-    with open("data/out", "w", encoding='UTF-8') as out_file:
-        for result in results:
-            for entry in result:
-                out_file.write(entry)
-                out_file.write("\n")
+def write_results(results: Iterable[Tuple[str, List[str]]], out_path: str, checkpoint: Optional[Checkpoint] = None):
+    """Print the results to the console and store them in the out file as soon as they arrive.
+
+    :param results: Key and formatted assignment strings per processed row.
+    :type results: Iterable[Tuple[str, List[str]]]
+    :param out_path: File the results get written to.
+    :type out_path: str
+    :param checkpoint: Opened checkpoint that appends the results to its out file and records the completed keys,
+    out_path is not used if it is given.
+    :type checkpoint: Optional[Checkpoint]
+    :return: No output, everything is written to console and the out file.
+    :rtype: None
+    """
+    if checkpoint is not None:
+        for key, result in results:
+            with profiling.stage("write"):
+                for entry in result:
+                    print(entry)
+                checkpoint.write(key, result)
+            profiling.count("docs")
+            profiling.progress()
+        return
+
+    with open(out_path, "w", encoding='UTF-8') as out_file:
+        for _, result in results:
+            with profiling.stage("write"):
+                for entry in result:
+                    print(entry)
+                    out_file.write(entry)
+                    out_file.write("\n")
+                out_file.flush()
+            profiling.count("docs")
+            profiling.progress()
 
 
 def _load_proc_files_from_csv(file_path: str) -> List:
@@ -188,7 +526,12 @@ def _load_proc_files_from_csv(file_path: str) -> List:
         return [row for row in csv_reader]
 
 
-if __name__ == "__main__":
+def build_parser() -> argparse.ArgumentParser:
+    """Create the parser of the command line arguments of the pipeline, also used by driver.py.
+
+    :return: The parser.
+    :rtype: argparse.ArgumentParser
+    """
     parser = argparse.ArgumentParser("wdp")
     parser.add_argument(
         "--warc_pre_proc_out",
@@ -205,6 +548,13 @@ if __name__ == "__main__":
         help="Directory the preprocessed file gets stored.",
         type=str
     )
+    parser.add_argument(
+        "--pre_proc_format",
+        dest="pre_proc_format",
+        choices=PRE_PROC_FORMATS,
+        default="csv",
+        help="Store the preprocessed rows as escaped CSV or as compressed binary records with an index by WARC-TREC-ID."
+    )
     parser.add_argument(
         "--relations_dir",
         dest="relations_dir",
@@ -213,14 +563,538 @@ if __name__ == "__main__":
         help="Directory the relations file gets stored.",
         type=str
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--max_pending",
+        dest="max_pending",
+        required=False,
+        help="Maximum amount of chunks in flight per process pool, bounds the memory use of the streaming pipeline.",
+        type=int
+    )
+    parser.add_argument(
+        "--link_cache",
+        dest="link_cache",
+        required=False,
+        default=None,
+        help="SQLite file caching entity links across runs, for example data/link_cache.sqlite. The file may only be "
+             "reused with the same linking backend, endpoint or file, and ranking.",
+        type=str
+    )
+    parser.add_argument(
+        "--link_cache_ttl",
+        dest="link_cache_ttl",
+        required=False,
+        default=30,
+        help="Days a cached entity link stays valid.",
+        type=float
+    )
+    parser.add_argument(
+        "--link_cache_negative_ttl",
+        dest="link_cache_negative_ttl",
+        required=False,
+        default=7,
+        help="Days a cached mention without entity link stays valid.",
+        type=float
+    )
+    parser.add_argument(
+        "--link_cache_size",
+        dest="link_cache_size",
+        required=False,
+        default=1_000_000,
+        help="Maximum amount of mentions in the entity link cache.",
+        type=int
+    )
+    parser.add_argument(
+        "--sparql_endpoint",
+        dest="sparql_endpoint",
+        required=False,
+        default="http://dbpedia.org/sparql",
+        help="SPARQL endpoint used for entity linking, for example a local stand-in of dbpedia.",
+        type=str
+    )
+    parser.add_argument(
+        "--sparql_batch_size",
+        dest="sparql_batch_size",
+        required=False,
+        default=20,
+        help="Maximum amount of mentions resolved per SPARQL query. 1 sends one query per mention.",
+        type=int
+    )
+    parser.add_argument(
+        "--link_batch_size",
+        dest="link_batch_size",
+        required=False,
+        default=32,
+        help="Amount of rows of which the mentions are linked together, so a mention occurring in several rows is "
+             "looked up once, the most frequent mentions first.",
+        type=int
+    )
+    parser.add_argument(
+        "--popularity_table",
+        dest="popularity_table",
+        required=False,
+        default=None,
+        help="Popularity table built by popularity.py. The candidates are ranked on the popularity of their page "
+             "instead of their dbpedia referrals.",
+        type=str
+    )
+    parser.add_argument(
+        "--mention_cache",
+        dest="mention_cache",
+        choices=MENTION_CACHES,
+        default="process",
+        help="Share the queried mentions between the pool workers through a manager process, or keep them per process."
+    )
+    parser.add_argument(
+        "--mention_cache_size",
+        dest="mention_cache_size",
+        required=False,
+        default=100_000,
+        help="Maximum amount of shared mentions every process keeps in its own LRU dictionary.",
+        type=int
+    )
+    parser.add_argument(
+        "--linking_backend",
+        dest="linking_backend",
+        required=False,
+        default="sparql",
+        choices=BACKENDS,
+        help="Backend generating the entity candidates: batched SPARQL queries, concurrent SPARQL queries using "
+             "asyncio, a local index, recorded lookups, or deterministic synthetic candidates.",
+        type=str
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        dest="max_in_flight",
+        required=False,
+        default=16,
+        help="Maximum amount of concurrent requests per process of the async linking backend.",
+        type=int
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        dest="requests_per_second",
+        required=False,
+        default=10,
+        help="Maximum amount of requests per second on the endpoint of the async linking backend, divided over the "
+             "linking processes of this machine.",
+        type=float
+    )
+    parser.add_argument(
+        "--local_index",
+        dest="local_index",
+        required=False,
+        default="data/dbpedia_index.sqlite",
+        help="Local DBpedia index built by local_index.py, used by the local linking backend.",
+        type=str
+    )
+    parser.add_argument(
+        "--record_lookups",
+        dest="record_lookups",
+        required=False,
+        help="Record every lookup of the linking backend to this JSON lines file, for the replay backend. The entity "
+             "link cache is not used while recording.",
+        type=str
+    )
+    parser.add_argument(
+        "--replay_lookups",
+        dest="replay_lookups",
+        required=False,
+        help="JSON lines file with recorded lookups, used by the replay linking backend.",
+        type=str
+    )
+    parser.add_argument(
+        "--replay_latency",
+        dest="replay_latency",
+        required=False,
+        default=0.0,
+        help="Synthetic seconds per lookup call of the replay and stub linking backends.",
+        type=float
+    )
+    parser.add_argument(
+        "--processes",
+        dest="processes",
+        required=False,
+        default=mp.cpu_count(),
+        help="Amount of processes of the entity linking and relation extraction pool.",
+        type=int
+    )
+    parser.add_argument(
+        "--sharded_ner",
+        dest="sharded_ner",
+        action="store_true",
+        help="Load the spaCy model once in every worker and run NER, linking, and relation extraction there, "
+             "instead of NER in the main process. Every worker holds its own copy of the model."
+    )
+    parser.add_argument(
+        "--ner_batch_size",
+        dest="ner_batch_size",
+        required=False,
+        help="Batch size of nlp.pipe, defaults to the batch size of the model.",
+        type=int
+    )
+    parser.add_argument(
+        "--ner_n_process",
+        dest="ner_n_process",
+        required=False,
+        default=1,
+        help="Amount of processes of nlp.pipe.",
+        type=int
+    )
+    parser.add_argument(
+        "--bucket_window",
+        dest="bucket_window",
+        required=False,
+        default=256,
+        help="Amount of pages sorted on length before batching them for NER, 0 disables length bucketing.",
+        type=int
+    )
+    parser.add_argument(
+        "--max_chunk_chars",
+        dest="max_chunk_chars",
+        required=False,
+        default=0,
+        help="Split pages longer than this amount of characters at sentence boundaries for NER, 0 disables it.",
+        type=int
+    )
+    parser.add_argument(
+        "--ner_model",
+        dest="ner_model",
+        required=False,
+        default="en_core_web_trf",
+        help="spaCy model used for NER, in tiered mode only on the routed pages.",
+        type=str
+    )
+    parser.add_argument(
+        "--tier_model",
+        dest="tier_model",
+        required=False,
+        help="Enables tiered NER: this fast spaCy model, for example en_core_web_sm, processes all pages and only the "
+             "pages meeting the --tier_* criteria are processed again by --ner_model.",
+        type=str
+    )
+    parser.add_argument(
+        "--tier_min_entities",
+        dest="tier_min_entities",
+        required=False,
+        default=3,
+        help="Minimum amount of entities the fast model has to find in a page to route it to --ner_model.",
+        type=int
+    )
+    parser.add_argument(
+        "--tier_min_density",
+        dest="tier_min_density",
+        required=False,
+        default=0.0,
+        help="Minimum amount of entities per 100 tokens the fast model has to find to route a page to --ner_model.",
+        type=float
+    )
+    parser.add_argument(
+        "--tier_min_chars",
+        dest="tier_min_chars",
+        required=False,
+        default=0,
+        help="Minimum amount of characters of a page routed to --ner_model.",
+        type=int
+    )
+    parser.add_argument(
+        "--tier_max_chars",
+        dest="tier_max_chars",
+        required=False,
+        default=0,
+        help="Maximum amount of characters of a page routed to --ner_model, 0 disables the maximum.",
+        type=int
+    )
+    parser.add_argument(
+        "--tier_audit_every",
+        dest="tier_audit_every",
+        required=False,
+        default=0,
+        help="Also run --ner_model on every n-th page that isn't routed, only to report the entity difference.",
+        type=int
+    )
+    parser.add_argument(
+        "--html_engine",
+        dest="html_engine",
+        choices=HTML_ENGINES,
+        default="bs4",
+        help="Extract the text with a BeautifulSoup tree or in a single pass with the stream engine."
+    )
+    parser.add_argument(
+        "--warc_reader",
+        dest="warc_reader",
+        choices=WARC_READERS,
+        default="stream",
+        help="Decompress the warc zip in the main process, or let the workers decompress the records themselves using "
+             "an index of the gzip members that is stored next to the warc zip."
+    )
+    parser.add_argument(
+        "--sample_records",
+        dest="sample_records",
+        required=False,
+        default=0,
+        help="Only pre-process a random sample of this amount of warc records, requires --warc_reader indexed.",
+        type=int
+    )
+    parser.add_argument(
+        "--sample_seed",
+        dest="sample_seed",
+        required=False,
+        default=None,
+        help="Seed of --sample_records.",
+        type=int
+    )
+    parser.add_argument(
+        "--sentence_splitter",
+        dest="sentence_splitter",
+        choices=SENTENCE_SPLITTERS,
+        default="punkt",
+        help="Split sentences with the punkt model of NLTK or with a lightweight rule based splitter."
+    )
+    parser.add_argument(
+        "--offline",
+        dest="offline",
+        action="store_true",
+        help="Never download the punkt model, fail if it isn't installed."
+    )
+    parser.add_argument(
+        "--warc",
+        dest="warc",
+        required=False,
+        default="data/warcs/sample.warc.gz",
+        help="Path to the warc zip to process.",
+        type=str
+    )
+    parser.add_argument(
+        "--out",
+        dest="out",
+        required=False,
+        default="data/out",
+        help="File the results get written to.",
+        type=str
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help="Continue the previous run: reuse its pre-processed rows and skip the keys that are in the manifest of --out."
+    )
+    parser.add_argument(
+        "--metrics_out",
+        dest="metrics_out",
+        required=False,
+        default=None,
+        help="Write a JSON report of the time per stage, throughput, SPARQL latency, cache hit rates, and peak memory "
+             "per process to this file. driver.py writes a report per shard next to its out file instead.",
+        type=str
+    )
+    parser.add_argument(
+        "--progress_interval",
+        dest="progress_interval",
+        required=False,
+        default=0,
+        help="Print a progress line with the throughput and the slowest stages every this many seconds, 0 disables it.",
+        type=float
+    )
+    parser.add_argument(
+        "--checkpoint_sync_interval",
+        dest="checkpoint_sync_interval",
+        required=False,
+        default=100,
+        help="Amount of completed keys after which --out and its manifest are synced to disk.",
+        type=int
+    )
+    return parser
+
+
+def validate_args(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """Exit with an error message if the parsed arguments can't be combined.
+
+    :param parser: Parser created by build_parser().
+    :type parser: argparse.ArgumentParser
+    :param args: Parsed arguments.
+    :type args: argparse.Namespace
+    """
+    if args.tier_model is not None and args.sharded_ner:
+        parser.error("--tier_model can't be combined with --sharded_ner.")
+    if args.link_batch_size < 1:
+        parser.error("--link_batch_size must be at least 1.")
+
+
+def run(
+        args: argparse.Namespace,
+        warc_path: str = "data/warcs/sample.warc.gz",
+        out_path: str = "data/out",
+        pre_proc_filename: Optional[str] = None,
+        resume: bool = False,
+        metrics_path: Optional[str] = None,
+        abort: Optional[threading.Event] = None
+):
+    """Run all stages on one warc zip with the parsed command line arguments.
+
+    :param args: Arguments parsed by the parser of build_parser().
+    :type args: argparse.Namespace
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :param out_path: File the results get written to, with the checkpoint next to it.
+    :type out_path: str
+    :param pre_proc_filename: File name of the pre-processed rows, defaults to the current date and time.
+    :type pre_proc_filename: Optional[str]
+    :param resume: Continue the previous run that wrote to out_path.
+    :type resume: bool
+    :param metrics_path: If given, the JSON report of the stage timings, throughput, and caches is written to it.
+    :type metrics_path: Optional[str]
+    :param abort: Once set, the next write to the checkpoint raises CheckpointAborted and the run stops.
+    :type abort: Optional[threading.Event]
+    :return: No output, everything is written to console and the out file.
+    :rtype: None
+    """
+    # Collect the stage timings of this run, the workers send theirs along with their results.
+    profiling.reset(args.progress_interval)
 
     # Default dir is pre-proc and relations_dir, both can be adjusted via the given args.
     create_dirs(args.pre_proc_dir, args.relations_dir)
 
+    # Resolve the sentence splitter before any work is done, so a missing punkt model fails the run immediately.
+    configure_sentences(args.sentence_splitter, args.offline)
+
     # Default dir is pre-proc and no default filename is given, both values can be set by given args.
-    # Performs the pre-processing stage.
-    pre_proc_files = pre_proc_stage(args.pre_proc_dir, args.pre_proc_filename)
+    # Performs the pre-processing stage, rows are streamed into the next stages.
+    # Results are appended to out_path per key, completed keys are recorded in its manifest.
+    checkpoint = Checkpoint(out_path, sync_interval=args.checkpoint_sync_interval, abort=abort)
+    completed_keys = checkpoint.open(resume=resume)
+    with contextlib.ExitStack() as resources:
+        # Also closed when a stage raises, so the manifest of a resumed run is flushed and consistent.
+        resources.callback(checkpoint.close)
+        if resume:
+            print(f"Resuming, {len(completed_keys)} keys already completed.", file=sys.stderr)
+
+        skipped_records = Counter()
+        pre_proc_files = pre_proc_stage(
+            args.pre_proc_dir,
+            pre_proc_filename,
+            skipped_records,
+            checkpoint,
+            warc_path,
+            args.html_engine,
+            args.sentence_splitter,
+            args.offline,
+            args.pre_proc_format,
+            args.warc_reader,
+            args.sample_records,
+            args.sample_seed
+        )
+        pre_proc_files = profiling.timed_iter(pre_proc_files, "pre_proc")
+        pre_proc_files = (row for row in pre_proc_files if row[0] not in completed_keys)
+
+        linking_backend = create_backend(
+            args.linking_backend,
+            endpoint=args.sparql_endpoint,
+            batch_size=args.sparql_batch_size,
+            max_in_flight=args.max_in_flight,
+            # Every linking process has its own rate limiter, together they stay within the budget.
+            requests_per_second=args.requests_per_second / max(1, args.processes),
+            local_index=args.local_index,
+            replay_path=args.replay_lookups,
+            latency=args.replay_latency,
+            record_path=args.record_lookups
+        )
+        # Closed in reverse order when the run ends or raises, a driver worker continues with its next shard.
+        resources.callback(linking_backend.close)
+
+        # A mention linked by one pool worker is known to the others through the dict of a manager process.
+        mention_manager = None
+        shared_mention_cache = None
+        if args.mention_cache == "shared" and args.processes > 1:
+            mention_manager = mp.Manager()
+            resources.callback(mention_manager.shutdown)
+            shared_mention_cache = SharedMentionCache(mention_manager.dict(), args.mention_cache_size)
+
+        popularity_table = None
+        if args.popularity_table:
+            popularity_table = PopularityTable(args.popularity_table)
+            resources.callback(popularity_table.close)
+
+        entity_link_cache = None
+        if args.link_cache and args.record_lookups is not None:
+            # Mentions served by the cache would be missing from the recording, and get no candidates in the replay.
+            print("The entity link cache is not used while recording lookups.", file=sys.stderr)
+        elif args.link_cache:
+            entity_link_cache = EntityLinkCache(
+                args.link_cache,
+                ttl=args.link_cache_ttl * DAY,
+                negative_ttl=args.link_cache_negative_ttl * DAY,
+                max_entries=args.link_cache_size,
+                # The cached links are only valid for the candidates and the ranking that produced them.
+                settings={
+                    "backend": linking_backend.source(),
+                    "ranking": f"popularity {os.path.abspath(args.popularity_table)}" if args.popularity_table
+                    else "referrals"
+                }
+            )
+            resources.callback(entity_link_cache.close)
+            # Refuse a cache filled with other settings before any work is done.
+            entity_link_cache.check()
 
-    # Performs entity linking and relation extraction using spaCy NER on the en_core_web_trf model.
-    find_linked_relations(pre_proc_files, "en_core_web_trf", mp.cpu_count())
+        tier_stats = TierStats()
+        tier_router = TierRouter(
+            min_entities=args.tier_min_entities,
+            min_entity_density=args.tier_min_density,
+            min_chars=args.tier_min_chars,
+            max_chars=args.tier_max_chars
+        )
+
+        # Performs entity linking and relation extraction using spaCy NER on the en_core_web_trf model by default.
+        find_linked_relations(
+            pre_proc_files,
+            args.ner_model,
+            args.processes,
+            args.max_pending,
+            link_cache=entity_link_cache,
+            backend=linking_backend,
+            sharded=args.sharded_ner,
+            ner_options={
+                "batch_size": args.ner_batch_size,
+                "n_process": args.ner_n_process,
+                "bucket_window": args.bucket_window,
+                "max_chunk_chars": args.max_chunk_chars
+            },
+            fast_model_name=args.tier_model,
+            tier_options={"router": tier_router, "stats": tier_stats, "audit_every": args.tier_audit_every},
+            checkpoint=checkpoint,
+            link_batch_size=args.link_batch_size,
+            mention_cache=shared_mention_cache,
+            popularity=popularity_table
+        )
+        if mention_manager is not None:
+            print(f"Shared mention cache: {cache_stats(profiling.get_metrics().counters)}", file=sys.stderr)
+        print(format_skipped(skipped_records), file=sys.stderr)
+        if args.tier_model is not None:
+            print(tier_stats.format_report(), file=sys.stderr)
+
+        if entity_link_cache is not None:
+            print(f"Entity link cache: {entity_link_cache.stats()}", file=sys.stderr)
+
+        if metrics_path is not None:
+            report = profiling.write_report(metrics_path, {
+                "skipped_records": dict(skipped_records),
+                "tiers": tier_stats.report() if args.tier_model is not None else None,
+                "link_cache": entity_link_cache.stats() if entity_link_cache is not None else None,
+                "mention_cache": cache_stats(profiling.get_metrics().counters) if mention_manager is not None else None
+            })
+            print(
+                f"Metrics of {report['docs']} docs in {report['elapsed_seconds']:.1f}s written to {metrics_path}.",
+                file=sys.stderr
+            )
+
+if __name__ == "__main__":
+    arg_parser = build_parser()
+    parsed_args = arg_parser.parse_args()
+    validate_args(arg_parser, parsed_args)
+    run(
+        parsed_args,
+        parsed_args.warc,
+        parsed_args.out,
+        parsed_args.pre_proc_filename,
+        parsed_args.resume,
+        parsed_args.metrics_out
+    )
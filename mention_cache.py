@@ -0,0 +1,128 @@
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, MutableMapping, Optional, Tuple
+
+from profiling import count
+
+MENTION_CACHES = ("process", "shared")
+
+# Local LRUs of this process by cache name, kept outside the cache objects so they survive the pickling of the cache
+# into every task of a pool.
+_local_caches: Dict[str, OrderedDict] = {}
+_MISSING = object()
+
+
+class SharedMentionCache:
+    name = None
+    local_size = None
+
+    def __init__(self, shared: MutableMapping[str, Tuple[Optional[str], int]], local_size: int = 100_000):
+        """Mention dictionary shared by all processes of a run, a drop-in replacement for the dict of
+        Extraction.process_entity_dict. A mention linked by one pool worker is known to all other workers.
+        The shared dictionary is a multiprocessing.Manager().dict(), every access is a call to the manager process, so
+        the mentions are also kept in a least recently used dictionary per process in front of it.
+
+        :param shared: Dictionary of the manager mapping a normalized mention to its link and the pid of the process
+        that stored it.
+        :type shared: MutableMapping[str, Tuple[Optional[str], int]]
+        :param local_size: Maximum amount of mentions in the dictionary of a process.
+        :type local_size: int
+        """
+        self.name = uuid.uuid4().hex
+        self.shared = shared
+        self.local_size = local_size
+
+    def _local(self) -> OrderedDict:
+        """Get the dictionary of this process.
+
+        :return: Mentions in least recently used order.
+        :rtype: OrderedDict
+        """
+        local = _local_caches.get(self.name)
+        if local is None:
+            local = _local_caches[self.name] = OrderedDict()
+        return local
+
+    def _remember(self, local: OrderedDict, mention_key: str, link: Optional[str]):
+        """Add a mention to the dictionary of this process, evicting the least recently used mention if it is full.
+
+        :param local: Dictionary of this process.
+        :type local: OrderedDict
+        :param mention_key: Normalized mention.
+        :type mention_key: str
+        :param link: Link of the mention, None if it couldn't be linked.
+        :type link: Optional[str]
+        """
+        local[mention_key] = link
+        local.move_to_end(mention_key)
+        if len(local) > self.local_size:
+            local.popitem(last=False)
+
+    def get(self, mention_key: str, default: Optional[str] = None) -> Optional[str]:
+        """Get the link of a mention from the dictionary of this process, or else from the shared dictionary.
+
+        :param mention_key: Normalized mention.
+        :type mention_key: str
+        :param default: Returned if no process stored the mention.
+        :type default: Optional[str]
+        :return: The link, None if the mention couldn't be linked.
+        :rtype: Optional[str]
+        """
+        local = self._local()
+        link = local.get(mention_key, _MISSING)
+        if link is not _MISSING:
+            local.move_to_end(mention_key)
+            count("mention_local_hits")
+            return link
+
+        value = self.shared.get(mention_key)
+        if value is None:
+            count("mention_shared_misses")
+            return default
+        link, pid = value
+        count("mention_shared_hits")
+        if pid != os.getpid():
+            count("mention_cross_process_hits")
+        self._remember(local, mention_key, link)
+        return link
+
+    def __contains__(self, mention_key: str) -> bool:
+        return self.get(mention_key, _MISSING) is not _MISSING
+
+    def __getitem__(self, mention_key: str) -> Optional[str]:
+        link = self.get(mention_key, _MISSING)
+        if link is _MISSING:
+            raise KeyError(mention_key)
+        return link
+
+    def __setitem__(self, mention_key: str, link: Optional[str]):
+        self._remember(self._local(), mention_key, link)
+        self.shared[mention_key] = (link, os.getpid())
+
+    def __len__(self) -> int:
+        return len(self.shared)
+
+
+def cache_stats(counters: MutableMapping[str, int]) -> Dict[str, float]:
+    """Summarize the counters of a SharedMentionCache collected by profiling.
+
+    :param counters: Counters of the profiling report.
+    :type counters: MutableMapping[str, int]
+    :return: Hits in the dictionary of the process, hits in the shared dictionary, of which stored by another process,
+    misses, and the hit rate and cross-process hit rate.
+    :rtype: Dict[str, float]
+    """
+    local_hits = counters.get("mention_local_hits", 0)
+    shared_hits = counters.get("mention_shared_hits", 0)
+    cross_hits = counters.get("mention_cross_process_hits", 0)
+    misses = counters.get("mention_shared_misses", 0)
+    lookups = local_hits + shared_hits + misses
+    return {
+        "local_hits": local_hits,
+        "shared_hits": shared_hits,
+        "cross_process_hits": cross_hits,
+        "misses": misses,
+        "hit_rate": round((local_hits + shared_hits) / lookups, 4) if lookups > 0 else 0.0,
+        "cross_process_hit_rate": round(cross_hits / lookups, 4) if lookups > 0 else 0.0
+    }
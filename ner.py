@@ -0,0 +1,319 @@
+import functools
+import itertools
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import spacy
+from spacy.tokens import Doc
+from spacy.vocab import Vocab
+
+
+@functools.lru_cache(maxsize=None)
+def load_model(model_name: str, vocab: Optional[Vocab] = None) -> spacy.language.Language:
+    """Load the spaCy model used for NER, with the unused components disabled and a sentencizer added.
+    Models are loaded once per process, so processing many shards doesn't load the model for every shard.
+
+    :param model_name: Name of the used spaCy model.
+    :type model_name: str
+    :param vocab: Vocab of another loaded model to share, so the docs of both models have the same vocab. A model with
+    static vectors would replace the vectors of the shared vocab.
+    :type vocab: Optional[Vocab]
+    :return: The loaded spaCy pipeline.
+    :rtype: spacy.language.Language
+    """
+    nlp = spacy.load(model_name, vocab=True if vocab is None else vocab, disable=[
+        "textcat",
+        "tok2vec",
+        "parser",
+        "lemmatizer"
+    ])
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """Split a long text into chunks of at most max_chars characters at sentence boundaries.
+    The pre-processed text joins its sentences with ". ", so the chunks are split after those. A single sentence that is
+    longer than max_chars becomes its own chunk. Joining the chunks gives back the original text.
+
+    :param text: Pre-processed text.
+    :type text: str
+    :param max_chars: Maximum amount of characters per chunk, 0 or less disables splitting.
+    :type max_chars: int
+    :return: Chunks of the text.
+    :rtype: List[str]
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    start = 0
+    while len(text) - start > max_chars:
+        # Split after the last sentence end that still fits, or after the first one if no sentence fits.
+        end = text.rfind(". ", start, start + max_chars - 1)
+        if end == -1:
+            end = text.find(". ", start + max_chars - 1)
+            if end == -1:
+                break
+        chunks.append(text[start:end + 2])
+        start = end + 2
+    chunks.append(text[start:])
+    return chunks
+
+
+def pipe_docs(
+        nlp: spacy.language.Language,
+        text_context: Iterable[Tuple[str, Any]],
+        batch_size: Optional[int] = None,
+        n_process: int = 1,
+        bucket_window: int = 0,
+        max_chunk_chars: int = 0
+) -> Iterator[Tuple[Doc, Any]]:
+    """Run nlp.pipe over text-context pairs with length bucketing and chunking of long texts.
+    The input is read in windows of bucket_window texts. Within a window the texts are split into chunks at sentence
+    boundaries and sorted on their length, so the batches of the transformer contain texts of similar length and
+    little padding. The chunks of a text are merged back into one Doc and the docs are yielded in the original order.
+
+    :param nlp: The loaded spaCy pipeline.
+    :type nlp: spacy.language.Language
+    :param text_context: Text-context pairs, the context is passed through.
+    :type text_context: Iterable[Tuple[str, Any]]
+    :param batch_size: Batch size of nlp.pipe, None uses the default of the model.
+    :type batch_size: Optional[int]
+    :param n_process: Amount of processes of nlp.pipe.
+    :type n_process: int
+    :param bucket_window: Amount of texts sorted on length together, 0 or less disables bucketing.
+    :type bucket_window: int
+    :param max_chunk_chars: Maximum amount of characters per chunk, 0 or less disables chunking.
+    :type max_chunk_chars: int
+    :return: Yields doc-context pairs in the order of text_context.
+    :rtype: Iterator[Tuple[Doc, Any]]
+    """
+    if bucket_window <= 0 and max_chunk_chars <= 0:
+        yield from nlp.pipe(text_context, as_tuples=True, batch_size=batch_size, n_process=n_process)
+        return
+
+    iterator = iter(text_context)
+    window_size = max(1, bucket_window)
+    while True:
+        window = list(itertools.islice(iterator, window_size))
+        if len(window) == 0:
+            return
+
+        # Chunks are tagged with the index of their text and their position in the text.
+        chunks = [
+            (chunk, (text_index, chunk_index))
+            for text_index, (text, _) in enumerate(window)
+            for chunk_index, chunk in enumerate(split_text(text, max_chunk_chars))
+        ]
+        chunk_counts = [0] * len(window)
+        for _, (text_index, _) in chunks:
+            chunk_counts[text_index] += 1
+        if bucket_window > 0:
+            chunks.sort(key=lambda chunk: len(chunk[0]))
+
+        chunk_docs = [[None] * count for count in chunk_counts]
+        for doc, (text_index, chunk_index) in nlp.pipe(
+                chunks,
+                as_tuples=True,
+                batch_size=batch_size,
+                n_process=n_process
+        ):
+            chunk_docs[text_index][chunk_index] = doc
+
+        for (_, context), docs in zip(window, chunk_docs):
+            # Chunks end with the whitespace after the sentence, so the merged doc has the original text.
+            yield (docs[0] if len(docs) == 1 else Doc.from_docs(docs, ensure_whitespace=False)), context
+
+
+class TierRouter:
+    min_entities = None
+    min_entity_density = None
+    min_chars = None
+    max_chars = None
+
+    def __init__(self, min_entities: int = 3, min_entity_density: float = 0.0, min_chars: int = 0, max_chars: int = 0):
+        """Decides from the doc of the fast model whether a page is processed again by the accurate model.
+        A page is routed when all criteria hold. The NER of the spaCy models is greedy and exposes no confidence per
+        entity, so the criteria are based on the entities found by the fast model and the length of the page.
+
+        :param min_entities: Minimum amount of entities found by the fast model.
+        :type min_entities: int
+        :param min_entity_density: Minimum amount of entities per 100 tokens found by the fast model.
+        :type min_entity_density: float
+        :param min_chars: Minimum amount of characters of the page.
+        :type min_chars: int
+        :param max_chars: Maximum amount of characters of the page, 0 or less disables the maximum.
+        :type max_chars: int
+        """
+        self.min_entities = min_entities
+        self.min_entity_density = min_entity_density
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+
+    def route(self, doc: Doc) -> bool:
+        """Decide whether a page is processed by the accurate model.
+
+        :param doc: Doc of the page produced by the fast model.
+        :type doc: Doc
+        :return: True if the page is processed by the accurate model.
+        :rtype: bool
+        """
+        chars = len(doc.text)
+        if chars < self.min_chars or (self.max_chars > 0 and chars > self.max_chars):
+            return False
+        entities = len(doc.ents)
+        return entities >= self.min_entities and 100 * entities >= self.min_entity_density * max(1, len(doc))
+
+
+class TierStats:
+    def __init__(self):
+        """Statistics of a tiered NER run: pages, characters, and seconds per tier, and the difference between the
+        entities of the fast and the accurate model on the pages processed by both.
+        """
+        self.pages = Counter()
+        self.chars = Counter()
+        self.seconds = Counter()
+        self.entities = Counter()
+
+    def add_time(self, tier: str, pages: List[Tuple[str, Any]], seconds: float):
+        """Add the pages processed by a tier and the time it took.
+
+        :param tier: Name of the tier, fast or accurate.
+        :type tier: str
+        :param pages: Text-context pairs processed by the tier.
+        :type pages: List[Tuple[str, Any]]
+        :param seconds: Seconds spent in the model.
+        :type seconds: float
+        """
+        self.pages[tier] += len(pages)
+        self.chars[tier] += sum(len(text) for text, _ in pages)
+        self.seconds[tier] += seconds
+
+    def add_diff(self, fast_doc: Doc, accurate_doc: Doc):
+        """Compare the entities of the fast and the accurate model on the same page.
+
+        :param fast_doc: Doc produced by the fast model.
+        :type fast_doc: Doc
+        :param accurate_doc: Doc produced by the accurate model.
+        :type accurate_doc: Doc
+        """
+        fast = {(ent.start_char, ent.end_char): ent.label_ for ent in fast_doc.ents}
+        accurate = {(ent.start_char, ent.end_char): ent.label_ for ent in accurate_doc.ents}
+        same_span = fast.keys() & accurate.keys()
+        same_label = sum(1 for span in same_span if fast[span] == accurate[span])
+        self.entities["compared_pages"] += 1
+        self.entities["fast"] += len(fast)
+        self.entities["accurate"] += len(accurate)
+        self.entities["same"] += same_label
+        self.entities["other_label"] += len(same_span) - same_label
+        self.entities["only_fast"] += len(fast) - len(same_span)
+        self.entities["only_accurate"] += len(accurate) - len(same_span)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Get the statistics per tier and the entity difference.
+
+        :return: Routed pages, pages, characters, seconds, and pages per second per tier, and the entity counts. The agreement is the
+        fraction of the entities of either model that both models found with the same label.
+        :rtype: Dict[str, Dict[str, float]]
+        """
+        report = {"routed_pages": self.pages["routed"]}
+        for tier in ("fast", "accurate"):
+            seconds = self.seconds[tier]
+            report[tier] = {
+                "pages": self.pages[tier],
+                "chars": self.chars[tier],
+                "seconds": round(seconds, 3),
+                "pages_per_second": round(self.pages[tier] / seconds, 3) if seconds > 0 else 0.0
+            }
+        entities = dict(self.entities)
+        union = self.entities["fast"] + self.entities["accurate"] - self.entities["same"] - self.entities["other_label"]
+        entities["agreement"] = round(self.entities["same"] / union, 4) if union > 0 else 1.0
+        report["entities"] = entities
+        return report
+
+    def format_report(self) -> str:
+        """Format the statistics as a single line.
+
+        :return: Line with the statistics per tier and the entity difference.
+        :rtype: str
+        """
+        report = self.report()
+        tiers = ", ".join(
+            f"{tier}: {report[tier]['pages']} pages in {report[tier]['seconds']:.1f}s" for tier in ("fast", "accurate")
+        )
+        entities = ", ".join(f"{name} {value}" for name, value in report["entities"].items())
+        return f"Tiered NER routed {report['routed_pages']} pages, {tiers}; entities {entities}"
+
+
+def tiered_pipe_docs(
+        fast_nlp: spacy.language.Language,
+        accurate_nlp: spacy.language.Language,
+        text_context: Iterable[Tuple[str, Any]],
+        router: TierRouter,
+        stats: Optional[TierStats] = None,
+        audit_every: int = 0,
+        window_size: int = 256,
+        **pipe_options
+) -> Iterator[Tuple[Doc, Any]]:
+    """Run the fast model over all pages and the accurate model only over the pages selected by the router.
+    The pages are processed in windows: the fast model processes the entire window, after which the routed pages of
+    the window are processed by the accurate model as one stream, so its batches stay full.
+
+    :param fast_nlp: The loaded fast spaCy pipeline, for example en_core_web_sm.
+    :type fast_nlp: spacy.language.Language
+    :param accurate_nlp: The loaded accurate spaCy pipeline, for example en_core_web_trf.
+    :type accurate_nlp: spacy.language.Language
+    :param text_context: Text-context pairs, the context is passed through.
+    :type text_context: Iterable[Tuple[str, Any]]
+    :param router: Decides which pages are processed by the accurate model.
+    :type router: TierRouter
+    :param stats: Receives the timing per tier and the entity difference of the pages processed by both models.
+    :type stats: Optional[TierStats]
+    :param audit_every: Additionally process every n-th page that isn't routed by the accurate model, only to compare
+    the entities. The doc of the fast model is still used. 0 or less disables auditing.
+    :type audit_every: int
+    :param window_size: Amount of pages per window.
+    :type window_size: int
+    :param pipe_options: Keyword arguments of pipe_docs().
+    :return: Yields doc-context pairs in the order of text_context.
+    :rtype: Iterator[Tuple[Doc, Any]]
+    """
+    if stats is None:
+        stats = TierStats()
+
+    iterator = iter(text_context)
+    not_routed = 0
+    while True:
+        window = list(itertools.islice(iterator, max(1, window_size)))
+        if len(window) == 0:
+            return
+
+        start = time.perf_counter()
+        docs = [doc for doc, _ in pipe_docs(fast_nlp, window, **pipe_options)]
+        stats.add_time("fast", window, time.perf_counter() - start)
+
+        # Pages processed by the accurate model, mapped to whether its doc replaces the doc of the fast model.
+        selected = {}
+        for index, doc in enumerate(docs):
+            if router.route(doc):
+                selected[index] = True
+            else:
+                not_routed += 1
+                if audit_every > 0 and not_routed % audit_every == 0:
+                    selected[index] = False
+
+        stats.pages["routed"] += sum(selected.values())
+        if len(selected) > 0:
+            pages = [(window[index][0], index) for index in selected]
+            start = time.perf_counter()
+            accurate_docs = list(pipe_docs(accurate_nlp, pages, **pipe_options))
+            stats.add_time("accurate", pages, time.perf_counter() - start)
+            for accurate_doc, index in accurate_docs:
+                stats.add_diff(docs[index], accurate_doc)
+                if selected[index]:
+                    docs[index] = accurate_doc
+
+        for doc, (_, context) in zip(docs, window):
+            yield doc, context
@@ -0,0 +1,102 @@
+import queue
+from multiprocessing.pool import Pool
+from typing import Callable, Iterable, Iterator, List
+
+
+class _TaskError:
+    error = None
+
+    def __init__(self, error: BaseException):
+        """Wraps an exception raised in a worker so it can be passed through the result queue.
+
+        :param error: Exception raised by the task.
+        :type error: BaseException
+        """
+        self.error = error
+
+
+def _call_chunk(func: Callable, chunk: List) -> List:
+    """Apply the function to every item of the chunk. Runs inside a pool worker.
+
+    :param func: Picklable function to apply.
+    :type func: Callable
+    :param chunk: Items to apply the function to.
+    :type chunk: List
+    :return: Results in the order of the chunk.
+    :rtype: List
+    """
+    return [func(item) for item in chunk]
+
+
+def chunked(iterable: Iterable, chunk_size: int) -> Iterator[List]:
+    """Group the items of the iterable into lists of at most chunk_size items.
+
+    :param iterable: Items to group.
+    :type iterable: Iterable
+    :param chunk_size: Maximum amount of items per chunk.
+    :type chunk_size: int
+    :return: Yields the chunks.
+    :rtype: Iterator[List]
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def bounded_imap_unordered(
+        pool: Pool,
+        func: Callable,
+        iterable: Iterable,
+        max_pending: int,
+        chunk_size: int = 1
+) -> Iterator:
+    """Lazy replacement of pool.imap_unordered that never has more than max_pending chunks in flight.
+    pool.imap_unordered consumes the entire input iterator in a background thread, which materializes every item in
+    memory when the consumer is slower than the producer. Here the input is only pulled when a chunk finished.
+
+    :param pool: Pool to run the tasks in.
+    :type pool: Pool
+    :param func: Picklable function to apply to every item.
+    :type func: Callable
+    :param iterable: Items to process, consumed lazily.
+    :type iterable: Iterable
+    :param max_pending: Maximum amount of chunks submitted to the pool that haven't been yielded yet.
+    :type max_pending: int
+    :param chunk_size: Amount of items sent to a worker at once.
+    :type chunk_size: int
+    :return: Yields the results in completion order.
+    :rtype: Iterator
+    """
+    results = queue.Queue()
+    chunks = chunked(iterable, chunk_size)
+    pending = 0
+    exhausted = False
+
+    while True:
+        # Top up the pool until the bound is reached or the input ran out.
+        while not exhausted and pending < max(1, max_pending):
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                break
+            pool.apply_async(
+                _call_chunk,
+                (func, chunk),
+                callback=results.put,
+                error_callback=lambda error: results.put(_TaskError(error))
+            )
+            pending += 1
+
+        if pending == 0:
+            return
+
+        chunk_results = results.get()
+        pending -= 1
+        if isinstance(chunk_results, _TaskError):
+            raise chunk_results.error
+        yield from chunk_results
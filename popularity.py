@@ -0,0 +1,320 @@
+import bisect
+import bz2
+import gzip
+import mmap
+import os
+import struct
+from collections import Counter
+from typing import Dict, IO, Iterable, Iterator, Tuple
+from urllib.parse import unquote
+
+DUMP_FORMATS = ("tsv", "pageviews")
+_MAGIC = b"WDPSPOP1"
+# Amount of titles.
+_HEADER = struct.Struct("<Q")
+# Offset of a title in the titles block, and the count of a title.
+_VALUE = struct.Struct("<Q")
+
+
+class _Mapping:
+    def __init__(self, file: IO, data: mmap.mmap):
+        """Memory-mapped table file shared by the PopularityTable objects of a process.
+
+        :param file: Open table file.
+        :type file: IO
+        :param data: Mapping of the file.
+        :type data: mmap.mmap
+        """
+        self.file = file
+        self.data = data
+        # Amount of tables using the mapping, it is unmapped when the last one is closed.
+        self.references = 0
+
+
+# Memory-mapped tables of this process by path, so unpickled copies of a table don't map the file again.
+_mapped_tables: Dict[str, _Mapping] = {}
+
+
+def normalize_title(title: str) -> str:
+    """Normalize a Wikipedia title to the key of the table, the form used in the page URLs.
+
+    :param title: Title with spaces or underscores, optionally percent-encoded.
+    :type title: str
+    :return: Decoded title with underscores and a capital first character.
+    :rtype: str
+    """
+    title = unquote(title).strip().replace(" ", "_")
+    return title[:1].upper() + title[1:]
+
+
+def page_title(page: str) -> str:
+    """Get the normalized title of a Wikipedia page URL.
+
+    :param page: URL of the page, for example http://en.wikipedia.org/wiki/Amsterdam.
+    :type page: str
+    :return: The normalized title.
+    :rtype: str
+    """
+    return normalize_title(page.rsplit("/", 1)[-1])
+
+
+def _open_dump(path: str) -> IO[str]:
+    """Open a dump as text, decompressing .gz and .bz2 files.
+
+    :param path: Path to the dump.
+    :type path: str
+    :return: Text stream of the dump.
+    :rtype: IO[str]
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="UTF-8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="UTF-8", errors="replace")
+    return open(path, encoding="UTF-8", errors="replace")
+
+
+def read_dump(path: str, dump_format: str = "tsv", wiki: str = "en") -> Iterator[Tuple[str, int]]:
+    """Read the title-count pairs of a dump.
+
+    :param path: Path to the dump, optionally compressed with gzip or bzip2.
+    :type path: str
+    :param dump_format: One of DUMP_FORMATS. tsv has a title and a count per line, for example the amount of incoming
+    links per page. pageviews is the format of the Wikimedia pageview dumps: a domain code, title, amount of views, and
+    response size per line, only the lines of the wiki and its mobile site are read.
+    :type dump_format: str
+    :param wiki: Domain code of the wiki in a pageviews dump.
+    :type wiki: str
+    :return: Yields the title and count of every line, lines that can't be parsed are skipped.
+    :rtype: Iterator[Tuple[str, int]]
+    """
+    if dump_format not in DUMP_FORMATS:
+        raise ValueError(f"Unknown dump format {dump_format}, expected one of {', '.join(DUMP_FORMATS)}.")
+    domains = {wiki, f"{wiki}.m"}
+    with _open_dump(path) as dump:
+        for line in dump:
+            if dump_format == "tsv":
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 2:
+                    continue
+                title, value = fields[0], fields[1]
+            else:
+                fields = line.split(" ")
+                if len(fields) < 3 or fields[0] not in domains:
+                    continue
+                title, value = fields[1], fields[2]
+            try:
+                yield title, int(value)
+            except ValueError:
+                continue
+
+
+def build_table(counts: Iterable[Tuple[str, int]], path: str) -> int:
+    """Write a popularity table, summing the counts of titles that occur more than once.
+    The file contains the amount of titles, the offset of every title, the count of every title, and the titles sorted
+    on their UTF-8 bytes, so a title is found with a binary search on the memory-mapped file.
+
+    :param counts: Title-count pairs.
+    :type counts: Iterable[Tuple[str, int]]
+    :param path: Path of the table.
+    :type path: str
+    :return: Amount of titles in the table.
+    :rtype: int
+    """
+    totals = Counter()
+    for title, amount in counts:
+        totals[normalize_title(title).encode("UTF-8")] += amount
+    keys = sorted(key for key in totals if key)
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    # Written to a temporary file first, so a reader never maps a partial table.
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(_MAGIC)
+        file.write(_HEADER.pack(len(keys)))
+        offset = 0
+        for key in keys:
+            file.write(_VALUE.pack(offset))
+            offset += len(key)
+        file.write(_VALUE.pack(offset))
+        for key in keys:
+            file.write(_VALUE.pack(totals[key]))
+        for key in keys:
+            file.write(key)
+    os.replace(temp_path, path)
+    return len(keys)
+
+
+class _Titles:
+    def __init__(self, data: mmap.mmap, size: int):
+        """Sequence view of the sorted titles of a mapped table, for bisect.
+
+        :param data: Memory-mapped table.
+        :type data: mmap.mmap
+        :param size: Amount of titles.
+        :type size: int
+        """
+        self.data = data
+        self.size = size
+        self.offsets = len(_MAGIC) + _HEADER.size
+        self.titles = self.offsets + (2 * size + 1) * _VALUE.size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: int) -> bytes:
+        start, end = struct.unpack_from("<2Q", self.data, self.offsets + index * _VALUE.size)
+        return self.data[self.titles + start:self.titles + end]
+
+
+class PopularityTable:
+    path = None
+
+    def __init__(self, path: str):
+        """Read-only table of the popularity of Wikipedia pages, built by build_table() from a link count or pageview
+        dump. The file is memory-mapped when the first title is looked up, once per process. Only the path is pickled,
+        so the table can be passed to pool workers.
+
+        :param path: Path of the table.
+        :type path: str
+        """
+        self.path = path
+        self._titles = None
+
+    def __getstate__(self) -> Dict:
+        return {"path": self.path}
+
+    def __setstate__(self, state: Dict):
+        self.path = state["path"]
+        self._titles = None
+
+    def _mapped(self) -> _Titles:
+        """Map the table if this process hasn't done that yet, or use the mapping of another table of the same file.
+
+        :return: Sequence view of the titles.
+        :rtype: _Titles
+        """
+        if self._titles is None:
+            if self.path not in _mapped_tables:
+                file = open(self.path, "rb")
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                if data[:len(_MAGIC)] != _MAGIC:
+                    data.close()
+                    file.close()
+                    raise ValueError(f"{self.path} is not a popularity table.")
+                _mapped_tables[self.path] = _Mapping(file, data)
+            mapping = _mapped_tables[self.path]
+            mapping.references += 1
+            self._titles = _Titles(mapping.data, _HEADER.unpack_from(mapping.data, len(_MAGIC))[0])
+        return self._titles
+
+    def get(self, title: str, default: int = 0) -> int:
+        """Get the count of a title.
+
+        :param title: Wikipedia title, normalized with normalize_title(). It isn't normalized again, a title with a
+        literal '%' would be decoded twice.
+        :type title: str
+        :param default: Returned if the title isn't in the table.
+        :type default: int
+        :return: The count of the title.
+        :rtype: int
+        """
+        titles = self._mapped()
+        key = title.encode("UTF-8")
+        index = bisect.bisect_left(titles, key)
+        if index == len(titles) or titles[index] != key:
+            return default
+        return _VALUE.unpack_from(titles.data, titles.offsets + (titles.size + 1 + index) * _VALUE.size)[0]
+
+    def page_count(self, page: str) -> int:
+        """Get the count of a Wikipedia page URL.
+
+        :param page: URL of the page.
+        :type page: str
+        :return: The count of the page, 0 if it isn't in the table.
+        :rtype: int
+        """
+        return self.get(page_title(page))
+
+    def __contains__(self, title: str) -> bool:
+        return self.get(title, -1) != -1
+
+    def __len__(self) -> int:
+        return len(self._mapped())
+
+    def close(self):
+        """Release the mapping of this table, the file is unmapped when no other table of this process uses it."""
+        if self._titles is None:
+            return
+        self._titles = None
+        mapping = _mapped_tables[self.path]
+        mapping.references -= 1
+        if mapping.references == 0:
+            del _mapped_tables[self.path]
+            mapping.data.close()
+            mapping.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("popularity")
+    parser.add_argument(
+        "--dump",
+        dest="dumps",
+        required=False,
+        action="append",
+        default=[],
+        help="Dump to build the table from, can be given more than once. The counts of all dumps are summed.",
+        type=str
+    )
+    parser.add_argument(
+        "--format",
+        dest="dump_format",
+        choices=DUMP_FORMATS,
+        default="tsv",
+        help="Format of the dumps: title and count per line, or Wikimedia pageviews."
+    )
+    parser.add_argument(
+        "--wiki",
+        dest="wiki",
+        required=False,
+        default="en",
+        help="Domain code of the wiki in pageviews dumps.",
+        type=str
+    )
+    parser.add_argument(
+        "--table",
+        dest="table",
+        required=False,
+        default="data/popularity.bin",
+        help="Popularity table to build, or to read with --get.",
+        type=str
+    )
+    parser.add_argument(
+        "--get",
+        dest="get",
+        required=False,
+        action="append",
+        default=[],
+        help="Print the count of this title, can be given more than once.",
+        type=str
+    )
+    args = parser.parse_args()
+
+    if args.dumps:
+        amount = build_table(
+            (pair for dump_path in args.dumps for pair in read_dump(dump_path, args.dump_format, args.wiki)),
+            args.table
+        )
+        print(f"{amount} titles written to {args.table}.")
+    with PopularityTable(args.table) as table:
+        for get_title in args.get:
+            print(f"{get_title}\t{table.get(normalize_title(get_title))}")
@@ -0,0 +1,290 @@
+import mmap
+import os
+import random
+import struct
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+PRE_PROC_FORMATS = ("csv", "bin")
+_MAGIC = b"WDPSPP01"
+_INDEX_MAGIC = b"WDPSIDX1"
+# Compressed size of a record.
+_RECORD_HEADER = struct.Struct("<I")
+# Byte lengths of the key, title, headers, and text of a record.
+_FIELD_LENGTHS = struct.Struct("<4I")
+# Offset of a record and byte length of its key in the index.
+_INDEX_ENTRY = struct.Struct("<QI")
+# Offset and compressed size of the index, followed by _INDEX_MAGIC.
+_TRAILER = struct.Struct("<QI8s")
+
+
+def _encode_row(row: Tuple[str, str, str, str], level: int) -> bytes:
+    """Encode a row as a compressed record.
+
+    :param row: Key, title, headers, and text.
+    :type row: Tuple[str, str, str, str]
+    :param level: zlib compression level.
+    :type level: int
+    :return: Length prefixed compressed record.
+    :rtype: bytes
+    """
+    fields = [field.encode("UTF-8") for field in row]
+    data = zlib.compress(_FIELD_LENGTHS.pack(*(len(field) for field in fields)) + b"".join(fields), level)
+    return _RECORD_HEADER.pack(len(data)) + data
+
+
+def _decode_row(data: bytes) -> Tuple[str, str, str, str]:
+    """Decode the decompressed data of a record.
+
+    :param data: Decompressed record without its length prefix.
+    :type data: bytes
+    :return: Key, title, headers, and text.
+    :rtype: Tuple[str, str, str, str]
+    """
+    row = []
+    start = _FIELD_LENGTHS.size
+    for length in _FIELD_LENGTHS.unpack_from(data):
+        row.append(data[start:start + length].decode("UTF-8"))
+        start += length
+    return tuple(row)
+
+
+def _read_index(data: mmap.mmap) -> Tuple[List[Tuple[str, int]], int]:
+    """Read the index of a pre-processed file, or rebuild it from the records if the file has no index because the
+    writer didn't finish. A record that was only partially written ends the records.
+
+    :param data: Memory-mapped file.
+    :type data: mmap.mmap
+    :return: Key and offset of every record in file order, and the offset after the last record.
+    :rtype: Tuple[List[Tuple[str, int]], int]
+    """
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise ValueError("Not a pre-processed file, the file doesn't start with the expected header.")
+
+    size = len(data)
+    if size >= len(_MAGIC) + _TRAILER.size:
+        index_offset, index_size, magic = _TRAILER.unpack_from(data, size - _TRAILER.size)
+        if magic == _INDEX_MAGIC and index_offset + index_size + _TRAILER.size == size:
+            index = zlib.decompress(data[index_offset:index_offset + index_size])
+            entries = []
+            position = 0
+            while position < len(index):
+                offset, key_length = _INDEX_ENTRY.unpack_from(index, position)
+                position += _INDEX_ENTRY.size
+                entries.append((index[position:position + key_length].decode("UTF-8"), offset))
+                position += key_length
+            return entries, index_offset
+
+    entries = []
+    offset = len(_MAGIC)
+    while offset + _RECORD_HEADER.size <= size:
+        (length,) = _RECORD_HEADER.unpack_from(data, offset)
+        end = offset + _RECORD_HEADER.size + length
+        if end > size:
+            break
+        try:
+            key = _decode_row(zlib.decompress(data[offset + _RECORD_HEADER.size:end]))[0]
+        except zlib.error:
+            break
+        entries.append((key, offset))
+        offset = end
+    return entries, offset
+
+
+class PreProcWriter:
+    path = None
+    level = None
+
+    def __init__(self, path: str, append: bool = False, level: int = 6):
+        """Writes pre-processed rows to a binary file of length prefixed, zlib compressed records.
+        The file starts with a magic header, followed by the records and, after close(), an index mapping every
+        WARC-TREC-ID to the offset of its record. The records are flushed after every row, so a reader can rebuild the
+        index of a file that was not closed because the program stopped.
+
+        :param path: Path to the file.
+        :type path: str
+        :param append: Continue an existing file, removing its index and a partially written last record.
+        :type append: bool
+        :param level: zlib compression level of the records.
+        :type level: int
+        """
+        self.path = path
+        self.level = level
+        self._entries = []
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self._entries, records_end = _read_index(data)
+            self._file = open(path, "r+b")
+            self._file.truncate(records_end)
+            self._file.seek(records_end)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(_MAGIC)
+            self._file.flush()
+
+    def write(self, row: Iterable[str]):
+        """Append a row and flush it.
+
+        :param row: Key, title, headers, and text.
+        :type row: Iterable[str]
+        """
+        row = tuple(row)
+        self._entries.append((row[0], self._file.tell()))
+        self._file.write(_encode_row(row, self.level))
+        self._file.flush()
+
+    def close(self):
+        """Write the index and close the file."""
+        if self._file is None:
+            return
+        index = b"".join(
+            _INDEX_ENTRY.pack(offset, len(key)) + key
+            for key, offset in ((key.encode("UTF-8"), offset) for key, offset in self._entries)
+        )
+        index = zlib.compress(index, self.level)
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(_TRAILER.pack(index_offset, len(index), _INDEX_MAGIC))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PreProcReader:
+    path = None
+
+    def __init__(self, path: str):
+        """Memory-mapped random access to a file written by PreProcWriter.
+        Only the index is read when the file is opened, a record is decompressed when it is accessed.
+
+        :param path: Path to the file.
+        :type path: str
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        entries, _ = _read_index(self._data)
+        self._keys = [key for key, _ in entries]
+        self._offsets: Dict[str, int] = dict(entries)
+
+    def _read(self, offset: int) -> Tuple[str, str, str, str]:
+        """Decompress the record at an offset.
+
+        :param offset: Offset of the record.
+        :type offset: int
+        :return: Key, title, headers, and text.
+        :rtype: Tuple[str, str, str, str]
+        """
+        (length,) = _RECORD_HEADER.unpack_from(self._data, offset)
+        start = offset + _RECORD_HEADER.size
+        return _decode_row(zlib.decompress(self._data[start:start + length]))
+
+    def keys(self) -> List[str]:
+        """Get the WARC-TREC-IDs in file order.
+
+        :return: Keys of all rows.
+        :rtype: List[str]
+        """
+        return list(self._keys)
+
+    def get(self, key: str) -> Optional[Tuple[str, str, str, str]]:
+        """Get the row of a WARC-TREC-ID.
+
+        :param key: WARC-TREC-ID.
+        :type key: str
+        :return: Key, title, headers, and text, None if the key isn't in the file.
+        :rtype: Optional[Tuple[str, str, str, str]]
+        """
+        offset = self._offsets.get(key)
+        return None if offset is None else self._read(offset)
+
+    def sample(self, amount: int, seed: Optional[int] = None) -> Iterator[Tuple[str, str, str, str]]:
+        """Read a random sample of rows in file order, without decompressing the other rows.
+
+        :param amount: Amount of rows, all rows if it exceeds the amount in the file.
+        :type amount: int
+        :param seed: Seed of the sample.
+        :type seed: Optional[int]
+        :return: Yields the sampled rows.
+        :rtype: Iterator[Tuple[str, str, str, str]]
+        """
+        keys = random.Random(seed).sample(self._keys, min(amount, len(self._keys)))
+        for offset in sorted(self._offsets[key] for key in keys):
+            yield self._read(offset)
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str, str]]:
+        for key in self._keys:
+            yield self._read(self._offsets[key])
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._offsets
+
+    def close(self):
+        """Unmap and close the file."""
+        self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+    import sys
+
+    parser = argparse.ArgumentParser("preproc_store")
+    parser.add_argument(
+        "--csv",
+        dest="csv",
+        required=False,
+        help="Pre-processed CSV file to convert to --bin.",
+        type=str
+    )
+    parser.add_argument(
+        "--bin",
+        dest="bin",
+        required=True,
+        help="Binary pre-processed file to write, or to read with --get or --sample.",
+        type=str
+    )
+    parser.add_argument(
+        "--get",
+        dest="get",
+        required=False,
+        help="Print the row of this WARC-TREC-ID.",
+        type=str
+    )
+    parser.add_argument(
+        "--sample",
+        dest="sample",
+        required=False,
+        default=0,
+        help="Print the keys and titles of a random sample of this amount of rows.",
+        type=int
+    )
+    args = parser.parse_args()
+
+    if args.csv is not None:
+        csv.field_size_limit(sys.maxsize)
+        with open(args.csv, newline='', encoding='UTF-8') as csv_file, PreProcWriter(args.bin) as writer:
+            for csv_row in csv.reader(csv_file, quoting=csv.QUOTE_NONE, escapechar='\\'):
+                writer.write(csv_row)
+        print(f"{os.path.getsize(args.csv)} bytes of CSV, {os.path.getsize(args.bin)} bytes of {args.bin}.")
+
+    with PreProcReader(args.bin) as reader:
+        if args.get is not None:
+            print(reader.get(args.get))
+        for sampled_row in reader.sample(args.sample):
+            print(f"{sampled_row[0]}\t{sampled_row[1]}")
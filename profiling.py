@@ -0,0 +1,353 @@
+import bisect
+import contextlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Upper bounds in seconds of the buckets of the latency histograms, the last bucket has no upper bound.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 150.0)
+
+
+def _peak_rss_mb() -> float:
+    """Get the peak resident set size of this process.
+
+    :return: Peak RSS in MB, 0 if it can't be measured on this platform.
+    :rtype: float
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes.
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+class Metrics:
+    def __init__(self):
+        """Stage timings, counters, and latency histograms of one process.
+        Stages nest: the time of a stage excludes the time of the stages started inside it, for example the NER stage
+        excludes the pre-processing of the rows it pulls, so the stages of a process add up to its wall time.
+        Pool workers send the changes since their previous result to the main process with take_delta(), which adds
+        them with merge().
+        """
+        self.pid = os.getpid()
+        self.started = time.perf_counter()
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.histograms = {}
+        self.peak_rss = {}
+        self._stack = []
+        self._last_progress = self.started
+
+    def start(self, name: str):
+        """Start timing a stage, stop() has to be called when it ends.
+
+        :param name: Name of the stage.
+        :type name: str
+        """
+        self._stack.append([name, time.perf_counter(), time.process_time(), 0.0, 0.0])
+
+    def stop(self):
+        """Stop timing the most recently started stage."""
+        name, wall_start, cpu_start, child_wall, child_cpu = self._stack.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        self.wall[name] += wall - child_wall
+        self.cpu[name] += cpu - child_cpu
+        self.calls[name] += 1
+        if self._stack:
+            self._stack[-1][3] += wall
+            self._stack[-1][4] += cpu
+
+    def count(self, name: str, amount: int = 1):
+        """Increment a counter.
+
+        :param name: Name of the counter.
+        :type name: str
+        :param amount: Amount to add.
+        :type amount: int
+        """
+        self.counters[name] += amount
+
+    def observe(self, name: str, seconds: float):
+        """Add a latency to a histogram.
+
+        :param name: Name of the histogram.
+        :type name: str
+        :param seconds: Observed latency.
+        :type seconds: float
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "max": 0.0}
+        histogram["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram["sum"] += seconds
+        histogram["max"] = max(histogram["max"], seconds)
+
+    def take_delta(self) -> Dict[str, Any]:
+        """Take the timings, counters, and histograms collected since the previous call and reset them.
+
+        :return: Picklable changes including the peak RSS of this process, to be passed to merge().
+        :rtype: Dict[str, Any]
+        """
+        delta = {
+            "pid": self.pid,
+            "peak_rss_mb": _peak_rss_mb(),
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "calls": self.calls,
+            "counters": self.counters,
+            "histograms": self.histograms
+        }
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.histograms = {}
+        return delta
+
+    def merge(self, delta: Dict[str, Any]):
+        """Add the changes taken by take_delta() in another process.
+
+        :param delta: Changes of the other process.
+        :type delta: Dict[str, Any]
+        """
+        self.peak_rss[delta["pid"]] = max(self.peak_rss.get(delta["pid"], 0.0), delta["peak_rss_mb"])
+        self.wall.update(delta["wall"])
+        self.cpu.update(delta["cpu"])
+        self.calls.update(delta["calls"])
+        self.counters.update(delta["counters"])
+        for name, other in delta["histograms"].items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                self.histograms[name] = other
+                continue
+            histogram["buckets"] = [
+                count + other_count for count, other_count in zip(histogram["buckets"], other["buckets"])
+            ]
+            histogram["sum"] += other["sum"]
+            histogram["max"] = max(histogram["max"], other["max"])
+
+    def report(self) -> Dict[str, Any]:
+        """Get the statistics of the run so far, including the merged changes of the workers.
+
+        :return: Elapsed seconds, docs and entities per second, wall and CPU seconds per stage summed over all
+        processes, counters, hit rates of the mention caches, latency histograms, and the peak RSS per process.
+        :rtype: Dict[str, Any]
+        """
+        elapsed = time.perf_counter() - self.started
+        peak_rss = dict(self.peak_rss)
+        peak_rss[self.pid] = _peak_rss_mb()
+
+        histograms = {}
+        for name, histogram in self.histograms.items():
+            total = sum(histogram["buckets"])
+            bounds = [f"<={bound:g}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]:g}s"]
+            histograms[name] = {
+                "count": total,
+                "mean_seconds": round(histogram["sum"] / total, 4) if total > 0 else 0.0,
+                "max_seconds": round(histogram["max"], 4),
+                "buckets": {bound: count for bound, count in zip(bounds, histogram["buckets"]) if count > 0}
+            }
+
+        caches = {}
+        for cache in ("mention_dict", "link_cache"):
+            hits = self.counters[f"{cache}_hits"]
+            lookups = hits + self.counters[f"{cache}_misses"]
+            caches[cache] = {
+                "hits": hits,
+                "lookups": lookups,
+                "hit_rate": round(hits / lookups, 4) if lookups > 0 else 0.0
+            }
+
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "docs": self.counters["docs"],
+            "docs_per_second": round(self.counters["docs"] / elapsed, 3) if elapsed > 0 else 0.0,
+            "entities": self.counters["entities"],
+            "entities_per_second": round(self.counters["entities"] / elapsed, 3) if elapsed > 0 else 0.0,
+            "stages": {
+                name: {
+                    "wall_seconds": round(self.wall[name], 3),
+                    "cpu_seconds": round(self.cpu[name], 3),
+                    "calls": self.calls[name]
+                }
+                for name in sorted(self.wall, key=self.wall.get, reverse=True)
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "caches": caches,
+            "histograms": histograms,
+            "peak_rss_mb": {str(pid): round(peak, 1) for pid, peak in sorted(peak_rss.items())}
+        }
+
+    def format_progress(self) -> str:
+        """Format the throughput and the busiest stages as a single line.
+
+        :return: Progress line.
+        :rtype: str
+        """
+        report = self.report()
+        stages = ", ".join(
+            f"{name} {stage['wall_seconds']:.1f}s" for name, stage in list(report["stages"].items())[:4]
+        )
+        return (
+            f"Progress {report['elapsed_seconds']:.0f}s: {report['docs']} docs ({report['docs_per_second']:.2f}/s), "
+            f"{report['entities']} entities ({report['entities_per_second']:.2f}/s), "
+            f"peak RSS {max(report['peak_rss_mb'].values()):.0f} MB; {stages}"
+        )
+
+
+# Metrics of this process, replaced by get_metrics() in a forked child so it doesn't count the parent's values.
+_metrics = Metrics()
+_progress_interval = 0.0
+
+
+def get_metrics() -> Metrics:
+    """Get the metrics of this process.
+
+    :return: The metrics.
+    :rtype: Metrics
+    """
+    global _metrics
+    if _metrics.pid != os.getpid():
+        _metrics = Metrics()
+    return _metrics
+
+
+def reset(progress_interval: float = 0.0):
+    """Start collecting the metrics of a new run in this process.
+
+    :param progress_interval: Seconds between the progress lines printed by progress(), 0 or less disables them.
+    :type progress_interval: float
+    """
+    global _metrics, _progress_interval
+    _metrics = Metrics()
+    _progress_interval = progress_interval
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time the code inside the with block as a stage.
+
+    :param name: Name of the stage.
+    :type name: str
+    """
+    metrics = get_metrics()
+    metrics.start(name)
+    try:
+        yield
+    finally:
+        metrics.stop()
+
+
+def timed_iter(iterable: Iterable, name: str) -> Iterator:
+    """Time the production of every item of an iterable as a stage, for stages that are generators.
+
+    :param iterable: Iterable to pass through.
+    :type iterable: Iterable
+    :param name: Name of the stage.
+    :type name: str
+    :return: Yields the items of the iterable.
+    :rtype: Iterator
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(name: str, amount: int = 1):
+    """Increment a counter of this process.
+
+    :param name: Name of the counter.
+    :type name: str
+    :param amount: Amount to add.
+    :type amount: int
+    """
+    get_metrics().count(name, amount)
+
+
+def observe(name: str, seconds: float):
+    """Add a latency to a histogram of this process.
+
+    :param name: Name of the histogram.
+    :type name: str
+    :param seconds: Observed latency.
+    :type seconds: float
+    """
+    get_metrics().observe(name, seconds)
+
+
+class Profiled:
+    func = None
+
+    def __init__(self, func: Callable):
+        """Wraps a function executed by pool workers, so every result carries the metrics the worker collected since
+        its previous result. Pass the results through collect() in the main process.
+
+        :param func: Picklable function to wrap.
+        :type func: Callable
+        """
+        self.func = func
+
+    def __call__(self, *args) -> Tuple[Any, Dict[str, Any]]:
+        result = self.func(*args)
+        return result, get_metrics().take_delta()
+
+
+def collect(results: Iterable[Tuple[Any, Dict[str, Any]]]) -> Iterator:
+    """Merge the metrics of results of a Profiled function into the metrics of this process.
+
+    :param results: Results of a Profiled function.
+    :type results: Iterable[Tuple[Any, Dict[str, Any]]]
+    :return: Yields the results without the metrics.
+    :rtype: Iterator
+    """
+    for result, delta in results:
+        get_metrics().merge(delta)
+        yield result
+
+
+def progress():
+    """Print a progress line to stderr if the progress interval passed since the previous line."""
+    metrics = get_metrics()
+    if _progress_interval <= 0:
+        return
+    now = time.perf_counter()
+    if now - metrics._last_progress >= _progress_interval:
+        metrics._last_progress = now
+        print(metrics.format_progress(), file=sys.stderr)
+
+
+def write_report(path: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Write the report of this process as JSON.
+
+    :param path: File the report is written to.
+    :type path: str
+    :param extra: Additional sections of the report, for example the statistics of the entity link cache.
+    :type extra: Optional[Dict[str, Any]]
+    :return: The written report.
+    :rtype: Dict[str, Any]
+    """
+    report = get_metrics().report()
+    if extra:
+        report.update(extra)
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "w", encoding="UTF-8") as file:
+        json.dump(report, file, indent=2)
+    return report
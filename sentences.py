@@ -0,0 +1,95 @@
+import re
+from typing import List
+
+import nltk
+
+SENTENCE_SPLITTERS = ("punkt", "rule")
+# A sentence ends after a word of at least two alphanumeric characters and a dot, followed by a capital or a digit.
+# Initials and dotted abbreviations like "J." and "U.S." end in a single character before the dot and aren't split.
+_RULE_SENTENCE_END_RE = re.compile(r"(?<=[A-Za-z\d]{2}\.) (?=[A-Z\d])")
+# Abbreviations of more than one character that are followed by a capitalized name.
+_RULE_ABBREVIATIONS = frozenset([
+    "mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "jr.", "sr.", "vs.", "no.", "co.", "inc.", "ltd.", "gen.", "gov.",
+    "sen.", "rep.", "rev.", "lt.", "col.", "sgt.", "capt.", "mt.", "ft.", "jan.", "feb.", "mar.", "apr.", "jun.",
+    "jul.", "aug.", "sep.", "sept.", "oct.", "nov.", "dec."
+])
+
+# Sentence splitter of this process, set by configure().
+_splitter = None
+_splitter_name = None
+
+
+def load_punkt(language: str = "english", offline: bool = False) -> nltk.tokenize.PunktSentenceTokenizer:
+    """Load the punkt model of NLTK, downloading it first if it isn't installed and offline is False.
+
+    :param language: Language of the punkt model.
+    :type language: str
+    :param offline: Never download the model, raise a LookupError if it isn't installed.
+    :type offline: bool
+    :return: The loaded punkt tokenizer.
+    :rtype: nltk.tokenize.PunktSentenceTokenizer
+    """
+    resource = f"tokenizers/punkt/{language}.pickle"
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        if offline:
+            raise LookupError(
+                "The NLTK punkt model isn't installed and --offline is set. Install it with nltk.download('punkt') or "
+                "use the rule sentence splitter."
+            )
+        nltk.download("punkt", quiet=True)
+    return nltk.data.load(resource)
+
+
+def rule_sent_tokenize(text: str) -> List[str]:
+    """Split filtered text into sentences with a regular expression, a lightweight alternative to punkt.
+    Splits after a dot that ends a word of at least two characters and is followed by a capital or a digit, unless the
+    word is a common abbreviation like "Mr.".
+
+    :param text: Words filtered by warc._filter_words().
+    :type text: str
+    :return: Sentences of the text.
+    :rtype: List[str]
+    """
+    sentences = []
+    for sentence in _RULE_SENTENCE_END_RE.split(text):
+        if sentences and sentences[-1][sentences[-1].rfind(" ") + 1:].lower() in _RULE_ABBREVIATIONS:
+            sentences[-1] += " " + sentence
+        elif len(sentence) > 0:
+            sentences.append(sentence)
+    return sentences
+
+
+def configure(splitter: str = "punkt", offline: bool = False):
+    """Set the sentence splitter of this process, the punkt model is loaded once and reused for every text.
+    Is also used as initializer of the pool workers, so they don't look up the model per text.
+
+    :param splitter: One of SENTENCE_SPLITTERS. punkt uses the punkt model of NLTK, rule uses rule_sent_tokenize().
+    :type splitter: str
+    :param offline: Never download the punkt model, raise a LookupError if it isn't installed.
+    :type offline: bool
+    """
+    global _splitter, _splitter_name
+    if splitter == _splitter_name:
+        return
+    if splitter == "punkt":
+        _splitter = load_punkt(offline=offline).tokenize
+    elif splitter == "rule":
+        _splitter = rule_sent_tokenize
+    else:
+        raise ValueError(f"Unknown sentence splitter {splitter}, expected one of {', '.join(SENTENCE_SPLITTERS)}.")
+    _splitter_name = splitter
+
+
+def sent_tokenize(text: str) -> List[str]:
+    """Split text into sentences with the splitter of this process, punkt if configure() wasn't called.
+
+    :param text: Text to split.
+    :type text: str
+    :return: Sentences of the text.
+    :rtype: List[str]
+    """
+    if _splitter is None:
+        configure()
+    return _splitter(text)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the pipeline are run as scripts from the repository root, make them importable for the tests.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
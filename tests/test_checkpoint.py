@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from checkpoint import Checkpoint, CheckpointAborted, truncate_partial_line
+
+
+def _write_keys(out_path: str, keys, resume: bool = False) -> Checkpoint:
+    checkpoint = Checkpoint(out_path, sync_interval=2)
+    completed = checkpoint.open(resume=resume)
+    for key in keys:
+        if key not in completed:
+            checkpoint.write(key, [f"{key}\tentry"])
+    return checkpoint
+
+
+def test_resume_continues_after_the_completed_keys(tmp_path):
+    out_path = str(tmp_path / "out")
+    _write_keys(out_path, ["a", "b", "c"]).close()
+
+    checkpoint = Checkpoint(out_path)
+    assert checkpoint.open(resume=True) == {"a", "b", "c"}
+    checkpoint.write("d", ["d\tentry"])
+    checkpoint.close()
+
+    with open(out_path, encoding="UTF-8") as file:
+        assert file.read() == "a\tentry\nb\tentry\nc\tentry\nd\tentry\n"
+
+
+def test_resume_removes_the_results_of_an_unrecorded_key(tmp_path):
+    out_path = str(tmp_path / "out")
+    _write_keys(out_path, ["a", "b"]).close()
+    # The run stopped after writing results of c, before its manifest line was complete.
+    with open(out_path, "a", encoding="UTF-8") as file:
+        file.write("c\tentry\nc\tpart")
+    with open(f"{out_path}.manifest", "a", encoding="UTF-8") as file:
+        file.write("c\t")
+
+    _write_keys(out_path, ["a", "b", "c"], resume=True).close()
+    with open(out_path, encoding="UTF-8") as file:
+        assert file.read() == "a\tentry\nb\tentry\nc\tentry\n"
+    with open(f"{out_path}.manifest", encoding="UTF-8") as file:
+        assert [line.split("\t")[0] for line in file] == ["a", "b", "c"]
+
+
+def test_resume_ignores_a_manifest_line_ahead_of_the_results(tmp_path):
+    out_path = str(tmp_path / "out")
+    _write_keys(out_path, ["a", "b"]).close()
+    # The manifest reached the disk, the results of b didn't.
+    with open(out_path, "r+b") as file:
+        file.truncate(len(b"a\tentry\n"))
+
+    checkpoint = Checkpoint(out_path)
+    assert checkpoint.open(resume=True) == {"a"}
+    checkpoint.close()
+
+
+def test_open_without_resume_starts_over(tmp_path):
+    out_path = str(tmp_path / "out")
+    checkpoint = _write_keys(out_path, ["a"])
+    checkpoint.update_state(pre_proc_path="rows.csv")
+    checkpoint.close()
+
+    checkpoint = Checkpoint(out_path)
+    assert checkpoint.open(resume=False) == set()
+    assert checkpoint.state == {}
+    checkpoint.close()
+
+
+def test_state_survives_a_resume(tmp_path):
+    out_path = str(tmp_path / "out")
+    checkpoint = _write_keys(out_path, ["a"])
+    checkpoint.update_state(pre_proc_path="rows.csv")
+    checkpoint.close()
+
+    checkpoint = Checkpoint(out_path)
+    checkpoint.open(resume=True)
+    assert checkpoint.state == {"pre_proc_path": "rows.csv"}
+    checkpoint.close()
+
+
+def test_aborted_checkpoint_refuses_writes(tmp_path):
+    abort = threading.Event()
+    checkpoint = Checkpoint(str(tmp_path / "out"), abort=abort)
+    checkpoint.open()
+    checkpoint.write("a", ["a\tentry"])
+    abort.set()
+    with pytest.raises(CheckpointAborted):
+        checkpoint.write("b", ["b\tentry"])
+    with pytest.raises(CheckpointAborted):
+        checkpoint.update_state(pre_proc_path="rows.csv")
+    checkpoint.close()
+    assert checkpoint.completed == {"a"}
+
+
+@pytest.mark.parametrize("content, expected", [
+    (b"", b""),
+    (b"one\ntwo\n", b"one\ntwo\n"),
+    (b"one\ntwo\nthr", b"one\ntwo\n"),
+    (b"partial", b""),
+    (b"one\n" + b"x" * 200_000, b"one\n"),
+])
+def test_truncate_partial_line(tmp_path, content, expected):
+    path = str(tmp_path / "rows.csv")
+    with open(path, "wb") as file:
+        file.write(content)
+    truncate_partial_line(path)
+    with open(path, "rb") as file:
+        assert file.read() == expected
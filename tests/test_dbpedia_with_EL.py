@@ -0,0 +1,46 @@
+import spacy
+from spacy.tokens import Span
+
+from dbpedia_with_EL import get_most_popular_pages, link_entity
+from popularity import PopularityTable, build_table
+
+PAGE = "http://en.wikipedia.org/wiki/"
+
+
+def _binding(title: str, referrals: int) -> dict:
+    return {
+        "name": {"value": title.replace("_", " ")},
+        "page": {"value": PAGE + title},
+        "item": {"value": f"http://dbpedia.org/resource/{title}"},
+        "count": {"value": str(referrals)}
+    }
+
+
+# The city is referred to most, the band is the most popular page.
+CANDIDATES = {"results": {"bindings": [_binding("Paris", 10), _binding("Paris_(band)", 2)]}}
+
+
+def _table(tmp_path) -> PopularityTable:
+    path = str(tmp_path / "popularity.bin")
+    build_table([("Paris", 5), ("Paris_(band)", 50)], path)
+    return PopularityTable(path)
+
+
+def test_most_popular_page(tmp_path):
+    with _table(tmp_path) as table:
+        assert get_most_popular_pages("Paris", CANDIDATES, table) == (
+            "Paris (band)", PAGE + "Paris_(band)", "http://dbpedia.org/resource/Paris_(band)", 50
+        )
+        assert get_most_popular_pages("Paris", {"results": {"bindings": []}}, table) is None
+
+
+def test_link_entity_ranks_on_the_popularity_table(tmp_path):
+    doc = spacy.blank("en")("Paris is nice.")
+    doc.ents = [Span(doc, 0, 1, label="GPE")]
+
+    def generate(mention_groups):
+        return {mention_group: CANDIDATES for mention_group in mention_groups}
+
+    assert link_entity(doc, {}, candidate_generator=generate) == {"Paris": PAGE + "Paris"}
+    with _table(tmp_path) as table:
+        assert link_entity(doc, {}, candidate_generator=generate, popularity=table) == {"Paris": PAGE + "Paris_(band)"}
@@ -0,0 +1,78 @@
+import types
+
+import pytest
+
+import entity_cache
+from entity_cache import DAY, EntityLinkCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the clock of the cache, advanced by setting clock.now."""
+    fake = types.SimpleNamespace(now=1_000_000.0)
+    fake.time = lambda: fake.now
+    monkeypatch.setattr(entity_cache, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    link_cache = EntityLinkCache(str(tmp_path / "links.sqlite"), ttl=10 * DAY, negative_ttl=DAY, max_entries=3)
+    yield link_cache
+    link_cache.close()
+
+
+def test_found_links_and_mentions_without_link(cache):
+    cache.put("amsterdam", "geo:SpatialThing", "http://en.wikipedia.org/wiki/Amsterdam")
+    cache.put("xyzzy", "owl:Thing", None)
+
+    assert cache.get("amsterdam", "geo:SpatialThing") == (True, "http://en.wikipedia.org/wiki/Amsterdam")
+    assert cache.get("amsterdam", "dbo:Person") == (False, None)
+    assert cache.get("xyzzy", "owl:Thing") == (True, None)
+    stats = cache.stats()
+    assert (stats["hits"], stats["negative_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_links_expire_after_their_ttl(cache, clock):
+    cache.put("amsterdam", "geo:SpatialThing", "http://en.wikipedia.org/wiki/Amsterdam")
+    cache.put("xyzzy", "owl:Thing", None)
+
+    # Mentions without link expire first, they may be linkable after the next dbpedia release.
+    clock.now += 2 * DAY
+    assert cache.get("amsterdam", "geo:SpatialThing")[0]
+    assert cache.get("xyzzy", "owl:Thing") == (False, None)
+
+    clock.now += 10 * DAY
+    assert cache.get("amsterdam", "geo:SpatialThing") == (False, None)
+    assert cache.stats()["expired"] == 2
+
+    # Linking the mention again stores a fresh entry.
+    cache.put("amsterdam", "geo:SpatialThing", "http://en.wikipedia.org/wiki/Amsterdam")
+    assert cache.get("amsterdam", "geo:SpatialThing")[0]
+
+
+def test_least_recently_used_mentions_are_evicted(cache, clock):
+    for mention in ("a", "b", "c"):
+        cache.put(mention, "owl:Thing", mention)
+        clock.now += 1
+    # Reading a makes b the least recently used mention.
+    assert cache.get("a", "owl:Thing") == (True, "a")
+    clock.now += 1
+    cache.put("d", "owl:Thing", "d")
+    cache.flush()
+    cache.evict()
+
+    assert cache.stats()["entries"] == 3
+    assert cache.get("b", "owl:Thing") == (False, None)
+    assert all(cache.get(mention, "owl:Thing")[0] for mention in ("a", "c", "d"))
+
+
+def test_cache_filled_with_other_settings_is_refused(tmp_path):
+    path = str(tmp_path / "links.sqlite")
+    stub = EntityLinkCache(path, settings={"backend": "stub 2 0.5", "ranking": "referrals"})
+    stub.put("amsterdam", "geo:SpatialThing", "http://en.wikipedia.org/wiki/Amsterdam_(2)")
+    stub.close()
+
+    EntityLinkCache(path, settings={"backend": "stub 2 0.5", "ranking": "referrals"}).check()
+    with pytest.raises(ValueError):
+        EntityLinkCache(path, settings={"backend": "sparql http://localhost:8890/sparql", "ranking": "referrals"}).check()
@@ -0,0 +1,32 @@
+import itertools
+import random
+
+import pytest
+
+from benchmarks.synthetic_warc import entity_pool, html_page
+from warc import _extract_text
+
+HTML = [
+    "<html><head><title>A &amp; B</title></head><body><h1>Head <b>bold</b></h1><p>One<p>Two</body></html>",
+    "<p>Text <script>var x = '<p>no</p>';</script> after</p><h2>x<!-- comment --></h2>",
+    "<title>T</title><title>U</title><h3>a<h4>b</h4></h3><p>&eacute;&#233;&#x41; &nbsp;x</p>",
+    "<p>unclosed <div>block</div> still<h1>h</h1></p>",
+    "<title><b>bold title</b></title><p></p><h6></h6>",
+    "<![CDATA[x]]><p>a<br/>b<img src=x>c</p>",
+]
+
+
+@pytest.mark.parametrize("html", HTML)
+def test_stream_engine_matches_bs4(html):
+    assert _extract_text(html, "stream") == _extract_text(html, "bs4")
+
+
+def test_stream_engine_matches_bs4_on_synthetic_pages():
+    rng = random.Random(0)
+    names = entity_pool(50, rng)
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(names) + 1)))
+    for _ in range(20):
+        html = html_page(rng, names, weights, 6, 0.1)
+        title_text, headers, paragraphs = _extract_text(html, "bs4")
+        assert title_text and paragraphs
+        assert _extract_text(html, "stream") == (title_text, headers, paragraphs)
@@ -0,0 +1,53 @@
+import spacy
+
+from ner import TierRouter, load_model, tiered_pipe_docs
+from relation_extraction import ReverbNoNlp
+
+TEXTS = [
+    "Alice visited Paris. Bob met Alice in London.",
+    "Carol works for Acme in Berlin.",
+]
+POS = {
+    "alice": "PROPN", "bob": "PROPN", "carol": "PROPN", "paris": "PROPN", "london": "PROPN", "berlin": "PROPN",
+    "acme": "PROPN", "visited": "VERB", "met": "VERB", "works": "VERB", "for": "ADP", "in": "ADP", ".": "PUNCT"
+}
+ENTITIES = {"Alice": "PERSON", "Bob": "PERSON", "Carol": "PERSON", "Paris": "GPE", "London": "GPE", "Berlin": "GPE",
+            "Acme": "ORG"}
+LINKS = {mention: f"http://en.wikipedia.org/wiki/{mention}" for mention in ENTITIES}
+
+
+def _save_model(path: str) -> str:
+    """Save a small rule based pipeline that tags parts of speech and entities like a trained model."""
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("attribute_ruler")
+    for word, pos in POS.items():
+        ruler.add(patterns=[[{"LOWER": word}]], attrs={"POS": pos})
+    nlp.add_pipe("entity_ruler").add_patterns([{"label": label, "pattern": text} for text, label in ENTITIES.items()])
+    nlp.to_disk(path)
+    return str(path)
+
+
+def _relations(docs, vocab):
+    reverb = ReverbNoNlp(vocab)
+    return [reverb.extract_spacy_relations(doc, LINKS) for doc in docs]
+
+
+def test_tiers_share_the_vocab(tmp_path):
+    accurate = load_model(_save_model(tmp_path / "accurate"))
+    fast = load_model(_save_model(tmp_path / "fast"), accurate.vocab)
+    assert fast.vocab is accurate.vocab
+
+
+def test_both_tiers_give_the_same_relations(tmp_path):
+    accurate = load_model(_save_model(tmp_path / "accurate"))
+    fast = load_model(_save_model(tmp_path / "fast"), accurate.vocab)
+    text_context = [(text, index) for index, text in enumerate(TEXTS)]
+
+    # Every page stays with the fast model, or every page is routed to the accurate model.
+    fast_docs = [doc for doc, _ in tiered_pipe_docs(fast, accurate, text_context, TierRouter(min_entities=100))]
+    accurate_docs = [doc for doc, _ in tiered_pipe_docs(fast, accurate, text_context, TierRouter(min_entities=0))]
+
+    assert all(doc.vocab is accurate.vocab for doc in fast_docs + accurate_docs)
+    relations = _relations(accurate_docs, accurate.vocab)
+    assert relations == _relations(fast_docs, accurate.vocab)
+    assert ("Alice", "visited", "Paris") in relations[0]
@@ -0,0 +1,39 @@
+import pickle
+
+from popularity import PopularityTable, build_table, normalize_title
+
+
+def _build(tmp_path) -> str:
+    path = str(tmp_path / "popularity.bin")
+    build_table([("Amsterdam", 3), ("amsterdam", 2), ("Percent_%2541", 7), ("AC/DC", 4)], path)
+    return path
+
+
+def test_counts_of_normalized_titles(tmp_path):
+    with PopularityTable(_build(tmp_path)) as table:
+        assert len(table) == 3
+        assert table.get(normalize_title("amsterdam")) == 5
+        assert table.page_count("http://en.wikipedia.org/wiki/Amsterdam") == 5
+        assert table.page_count("http://en.wikipedia.org/wiki/Rotterdam") == 0
+        assert "Amsterdam" in table and "Rotterdam" not in table
+
+
+def test_titles_with_a_literal_percent_are_decoded_once(tmp_path):
+    with PopularityTable(_build(tmp_path)) as table:
+        # The title is Percent_%41, decoding it twice gives Percent_A.
+        assert table.page_count("http://en.wikipedia.org/wiki/Percent_%2541") == 7
+        assert table.get("Percent_%41") == 7
+
+
+def test_closing_a_table_keeps_the_mapping_of_the_others(tmp_path):
+    path = _build(tmp_path)
+    first = PopularityTable(path)
+    second = pickle.loads(pickle.dumps(first))
+    assert first.get("Amsterdam") == second.get("Amsterdam") == 5
+
+    first.close()
+    assert second.get("AC/DC") == 4
+    # A closed table maps the file again when it is used.
+    assert first.get("Amsterdam") == 5
+    first.close()
+    second.close()
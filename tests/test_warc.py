@@ -0,0 +1,48 @@
+import gzip
+import io
+
+import pytest
+
+from benchmarks.synthetic_warc import generate_warc
+from warc import split_records
+
+
+def _reference_split_records(stream):
+    """The line based splitter that split_records() replaced, yields the text after every "WARC/1.0" line."""
+    payload = ''
+    for line in stream:
+        if line.strip() == "WARC/1.0":
+            yield payload
+            payload = ''
+        else:
+            payload += line
+    yield payload
+
+
+@pytest.mark.parametrize("per_record", [True, False])
+@pytest.mark.parametrize("read_size", [7, 1 << 20])
+def test_split_records_matches_the_line_splitter(tmp_path, per_record, read_size):
+    path = str(tmp_path / "synthetic.warc.gz")
+    generate_warc(path, records=40, paragraphs=4, entities=50, per_record=per_record)
+
+    with gzip.open(path, "rb") as stream:
+        records = list(split_records(stream, read_size))
+    # Latin-1 maps every byte to one character, so the text splitter sees exactly the same bytes.
+    with io.TextIOWrapper(gzip.open(path, "rb"), encoding="latin-1", newline="") as stream:
+        payloads = list(_reference_split_records(stream))
+
+    # The line splitter yields the text before the first record, and keeps the blank lines after every block.
+    assert payloads[0] == ""
+    assert len(records) == len(payloads) - 1 == 41
+    for record, payload in zip(records, payloads[1:]):
+        version, rest = record.decode("latin-1").split("\r\n", 1)
+        assert version == "WARC/1.0"
+        assert rest + "\r\n\r\n" == payload
+
+
+def test_split_records_needs_a_line_start_across_chunks():
+    record = b"WARC/1.0\r\nContent-Length: 5\r\n\r\nhello\r\n\r\n"
+    # A version that is not at the start of a line, split over every possible pair of chunks.
+    data = record + b"junk WARC/1.0 junk\r\n" + record
+    for read_size in range(1, len(data) + 1):
+        assert list(split_records(io.BytesIO(data), read_size)) == [record[:-4], record[:-4]]
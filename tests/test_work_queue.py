@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import time
+
+from work_queue import WorkQueue, keep_alive
+
+SHARDS = ["a", "b"]
+
+
+def _expire(queue: WorkQueue, shard: str):
+    """Make the lease of a shard look like it wasn't renewed for longer than the lease timeout."""
+    expired = time.time() - 2 * queue.lease_timeout
+    os.utime(os.path.join(queue.queue_dir, f"{shard}.lease"), (expired, expired))
+
+
+def test_a_shard_is_claimed_by_one_worker(tmp_path):
+    first = WorkQueue(str(tmp_path), "first")
+    second = WorkQueue(str(tmp_path), "second")
+
+    assert first.claim(SHARDS) == "a"
+    assert second.claim(SHARDS) == "b"
+    assert first.claim(SHARDS) is None
+    assert first.owns("a") and not first.owns("b")
+    assert first.heartbeat("a") and not second.heartbeat("a")
+
+
+def test_an_expired_lease_is_taken_over(tmp_path):
+    first = WorkQueue(str(tmp_path), "first", lease_timeout=60)
+    second = WorkQueue(str(tmp_path), "second", lease_timeout=60)
+    assert first.claim(["a"]) == "a"
+    assert second.claim(["a"]) is None
+
+    _expire(first, "a")
+    assert second.claim(["a"]) == "a"
+    assert second.owns("a") and not first.owns("a")
+    assert not first.heartbeat("a")
+
+
+def test_completed_shards_are_not_claimed_again(tmp_path):
+    queue = WorkQueue(str(tmp_path), "first")
+    assert queue.claim(SHARDS) == "a"
+    assert queue.complete("a", 1.5)
+
+    assert queue.is_done("a")
+    assert not os.path.exists(tmp_path / "a.lease")
+    with open(tmp_path / "a.done", encoding="UTF-8") as file:
+        assert json.load(file) == {"worker": "first", "seconds": 1.5}
+    assert queue.claim(SHARDS) == "b"
+    assert queue.fail("b", "Traceback")
+    assert queue.is_failed("b")
+    assert queue.claim(SHARDS) is None
+
+
+def test_a_taken_over_shard_is_left_to_its_new_owner(tmp_path):
+    first = WorkQueue(str(tmp_path), "first", lease_timeout=60)
+    second = WorkQueue(str(tmp_path), "second", lease_timeout=60)
+    first.claim(["a"])
+    _expire(first, "a")
+    second.claim(["a"])
+
+    assert not first.complete("a", 1.0)
+    assert not first.fail("a", "Traceback")
+    assert not first.is_done("a") and not first.is_failed("a")
+    assert second.owns("a")
+
+
+def test_a_lost_lease_is_reported(tmp_path):
+    first = WorkQueue(str(tmp_path), "first", lease_timeout=0.2)
+    second = WorkQueue(str(tmp_path), "second", lease_timeout=0.2)
+    first.claim(["a"])
+    stop = threading.Event()
+    lost = threading.Event()
+    heartbeat = threading.Thread(target=keep_alive, args=(first, "a", stop, lost, 2, 0.01), daemon=True)
+    heartbeat.start()
+
+    # Renewed leases aren't taken over.
+    time.sleep(0.3)
+    assert second.claim(["a"]) is None
+    assert not lost.is_set()
+
+    with open(tmp_path / "a.lease", "w", encoding="UTF-8") as file:
+        json.dump({"worker": "second"}, file)
+    assert lost.wait(5)
+    stop.set()
+    heartbeat.join()
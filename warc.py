@@ -1,4 +1,7 @@
+import functools
 import gzip
+import io
+import random
 import unicodedata
 import argparse
 import multiprocessing as mp
@@ -7,77 +10,188 @@ import datetime
 from html import unescape
 import os
 import re
-from io import TextIOWrapper
-from typing import Iterator, List, Tuple, Union
+import sys
+from collections import Counter
+from typing import BinaryIO, Container, Iterable, Iterator, List, Optional, Tuple, Union
 
-import nltk
 from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning
 import warnings
 
-warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning, module='bs4')
+from html_stream import extract_text
+from pipeline import bounded_imap_unordered
+from preproc_store import PRE_PROC_FORMATS, PreProcWriter
+from profiling import Profiled, collect, stage, timed_iter
+from sentences import SENTENCE_SPLITTERS, configure as configure_sentences, sent_tokenize
+from warc_index import load_index, read_member
 
+warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning, module='bs4')
 
-def _find_html(payload: str) -> Union[Tuple[str, List[str]], Tuple[None, None]]:
-    """Finds the WARC-TREC-ID and HTML content in a warc file.
-    Gives back None, None if the key or HTML wasn't found.
 
-    :param payload: The payload is an entire warc file. It contains information on the WARC file followed by file header
-    information like the file type and lastly contains the body of the file.
-    :type payload: str.
-    :return: Pair of the WARC-TREC-ID and HTML body. Returns None, None if no key or no html was found.
-    :rtype: Union[Tuple[str, List[str]], Tuple[None, None]]
+HTML_ENGINES = ("bs4", "stream")
+WARC_READERS = ("stream", "indexed")
+# Amount of gzip members a worker of the indexed reader decompresses and processes per task.
+_MEMBERS_PER_TASK = 8
+# A valid word starts with an alphanumeric character, or with '$', '€', ':', '.', ',', or '-' and is longer than that.
+_WORD_RE = re.compile(r"(?<![^ ])(?:[a-zA-Z\d]|[$€:.,-][^ ])[^ ]*")
+# A word ending with a dot loses the non-alphanumeric character before it, other words their last non-alphanumeric one.
+_SANITIZE_RE = re.compile(r"(?:[^\w ]|_)(\.)(?= |\Z)|(?:[^\w. ]|_)(?= |\Z)")
+_READ_SIZE = 1 << 20
+# Line boundaries of str.splitlines(), the ASCII ones are replaced in the undecoded HTML.
+_LINE_BREAKS = bytes.maketrans(b"\n\r\x0b\x0c\x1c\x1d\x1e", b"       ")
+_UNICODE_LINE_BREAK_RE = re.compile("[\x85\u2028\u2029]")
+_CONTENT_LENGTH_RE = re.compile(rb"^content-length:[ \t]*(\d+)", re.IGNORECASE | re.MULTILINE)
+_TREC_ID_RE = re.compile(rb"^WARC-TREC-ID:[ \t]*([^\r\n]+)", re.MULTILINE)
+_WARC_TYPE_RE = re.compile(rb"^WARC-Type:[ \t]*([^\r\n]+)", re.IGNORECASE | re.MULTILINE)
+_HTML_CONTENT_TYPE_RE = re.compile(rb"^content-type:[^\r\n]*html", re.IGNORECASE | re.MULTILINE)
+
+
+def _header_end(data: Union[bytes, bytearray], start: int) -> Tuple[int, int]:
+    """Finds the blank line that ends the header block starting at start. Handles both CRLF and LF line endings.
+
+    :param data: Buffer containing (part of) a WARC record.
+    :type data: Union[bytes, bytearray]
+    :param start: Index at which the header block starts.
+    :type start: int
+    :return: Pair of the index where the header ends and the index where the content after the blank line starts.
+    Gives back -1, -1 if the header is not complete yet.
+    :rtype: Tuple[int, int]
     """
-    if payload == '':
-        return None, None
+    crlf = data.find(b"\n\r\n", start)
+    lf = data.find(b"\n\n", start)
+    if crlf == -1 and lf == -1:
+        return -1, -1
+    if lf == -1 or -1 < crlf < lf:
+        return crlf + 1, crlf + 3
+    return lf + 1, lf + 2
 
-    key = None
-    html_type = False
 
-    lines = payload.splitlines()
+def _find_html(record: bytes) -> Union[Tuple[str, bytes, None], Tuple[None, None, str]]:
+    """Finds the WARC-TREC-ID and HTML body in a warc record by only inspecting the headers as bytes.
+    Gives back the reason the record is skipped instead if the key or HTML wasn't found.
+    Possible reasons are "empty", "malformed", "no_key", "not_response", and "not_html".
 
-    # WARC line always at index 2 in test input. TODO check if this assumption holds
-    warc_trec_line = lines[2]
-    if warc_trec_line.startswith("WARC-TREC-ID"):
-        key = warc_trec_line.split(': ')[1]
+    :param record: The record is an entire warc file. It contains the WARC header followed by the HTTP header
+    information like the file type and lastly contains the body of the file.
+    :type record: bytes
+    :return: Triple of the WARC-TREC-ID, the undecoded HTML body, and None. Returns None, None, and the skip reason if
+    no key or no html was found.
+    :rtype: Union[Tuple[str, bytes, None], Tuple[None, None, str]]
+    """
+    if len(record) == 0:
+        return None, None, "empty"
 
-    if key is None:
-        return None, None
+    warc_header_end, block_start = _header_end(record, 0)
+    if warc_header_end == -1:
+        return None, None, "malformed"
 
-    max_i = len(lines)
-    i = 10
+    key_match = _TREC_ID_RE.search(record, 0, warc_header_end)
+    if key_match is None:
+        return None, None, "no_key"
 
-    while i < max_i:
-        line = lines[i].lower()
-        i += 1
-        if line.startswith("content-type") and "html" in line:
-            html_type = True
-        if line == "":  # Always newline after HTTP request.
-            break
+    # Only response records contain the HTML of a page, requests and metadata records are skipped.
+    type_match = _WARC_TYPE_RE.search(record, 0, warc_header_end)
+    if type_match is not None and type_match.group(1).strip().lower() != b"response":
+        return None, None, "not_response"
 
-    if html_type is False:
-        return None, None
+    http_header_end, body_start = _header_end(record, block_start)
+    if http_header_end == -1 or _HTML_CONTENT_TYPE_RE.search(record, block_start, http_header_end) is None:
+        return None, None, "not_html"
 
-    # lines[i:] contains the entire body.
-    return key, lines[i:]
+    key = key_match.group(1).strip().decode("utf-8", errors="ignore")
+    return key, record[body_start:], None
 
 
-def split_records(stream: TextIOWrapper) -> Iterator[str]:
-    """Splits the stream of warc files into separate warc files using the "WARC/1.0" flag.
-    Gives back an iterator to step over the warc files.
+def html_records(records: Iterable[bytes], skipped: Counter) -> Iterator[Tuple[str, bytes]]:
+    """Filters the warc records on their headers so only HTML responses are passed on.
+    Runs in the reading process, so the skipped records are never sent to the worker pool.
 
-    :param stream: Text from the entire warc zip given as an IO stream.
-    :type stream: TextIOWrapper
-    :return: Yields the payload of a single warc file.
-    :rtype: Iterator[str]
+    :param records: Iterator over the bytes of the warc records.
+    :type records: Iterable[bytes]
+    :param skipped: Counter that is incremented with the reason for every skipped record.
+    :type skipped: Counter
+    :return: Yields pairs of the WARC-TREC-ID and the undecoded HTML body.
+    :rtype: Iterator[Tuple[str, bytes]]
     """
-    payload = ''
-    for line in stream:
-        if line.strip() == "WARC/1.0":
-            yield payload
-            payload = ''
+    for record in records:
+        key, html_body, reason = _find_html(record)
+        if key is None:
+            skipped[reason] += 1
+            continue
+        yield key, html_body
+
+
+def split_records(stream: BinaryIO, read_size: int = _READ_SIZE) -> Iterator[bytes]:
+    """Splits the binary stream of warc files into separate warc records.
+    Record boundaries are found using the Content-Length of the WARC header, so the content is never scanned line by
+    line. Gives back an iterator to step over the warc records.
+
+    :param stream: Binary stream of the entire (decompressed) warc zip.
+    :type stream: BinaryIO
+    :param read_size: Amount of bytes read from the stream at once.
+    :type read_size: int
+    :return: Yields the bytes of a single warc record, starting at the "WARC/1.0" version line.
+    :rtype: Iterator[bytes]
+    """
+    buffer = bytearray()
+    start = 0
+    # Whether the first byte of the buffer starts a line, the dropped bytes are no longer there to check.
+    line_start = True
+
+    def fill() -> bool:
+        """Append the next chunk of the stream to the buffer. Gives back False if the stream is exhausted."""
+        chunk = stream.read(read_size)
+        buffer.extend(chunk)
+        return len(chunk) > 0
+
+    def drop(amount: int):
+        """Remove the first bytes of the buffer, remembering whether the remaining bytes start a line."""
+        nonlocal line_start
+        if amount > 0:
+            line_start = buffer[amount - 1] == 0x0A
+            del buffer[:amount]
+
+    while True:
+        # Drop the records that were already yielded, the buffer only holds the current record.
+        drop(start)
+        start = 0
+
+        # Find the version line of the next record, skipping the blank lines between records.
+        version = buffer.find(b"WARC/")
+        while version == -1 or not (buffer[version - 1] == 0x0A if version > 0 else line_start):
+            if version != -1:
+                # "WARC/" occurred in the middle of a line, keep searching after it.
+                drop(version + 1)
+            else:
+                # Keep the last bytes in case the version line is split over two chunks.
+                drop(len(buffer) - 4)
+                if not fill():
+                    return
+            version = buffer.find(b"WARC/")
+        start = version
+
+        # Make sure the entire WARC header is in the buffer.
+        header_end, block_start = _header_end(buffer, start)
+        while header_end == -1:
+            if not fill():
+                return
+            header_end, block_start = _header_end(buffer, start)
+
+        length_match = _CONTENT_LENGTH_RE.search(buffer, start, header_end)
+        if length_match is not None:
+            record_end = block_start + int(length_match.group(1))
+            while len(buffer) < record_end and fill():
+                pass
+            record_end = min(record_end, len(buffer))
         else:
-            payload += line
-    yield payload
+            # Without Content-Length fall back to searching the next version line.
+            record_end = buffer.find(b"\nWARC/", block_start)
+            while record_end == -1 and fill():
+                record_end = buffer.find(b"\nWARC/", block_start)
+            if record_end == -1:
+                record_end = len(buffer)
+
+        yield bytes(buffer[start:record_end])
+        start = record_end
 
 
 def _join_sentences(sentences: List[str]) -> str:
@@ -96,45 +210,29 @@ def _join_sentences(sentences: List[str]) -> str:
     ])
 
 
-def _valid_word(word: str) -> bool:
-    """Filters invalid words that cannot be processed in later stages.
-    Invalid words include:
-    - Empty words: len of 0.
-    - Words only containing one symbol: len of 0 and contains symbol.
-    - Words containing invalid symbols: valid symbols include alphanumerical, '$', '€', ':', '.', ',', and '-'.
+def _filter_words(text: str) -> str:
+    """Keep the valid words of a text and sanitize them in two passes over the entire string.
+    Gives the same result as filtering and sanitizing the words of text.split(' ') one by one, see
+    benchmarks/word_filter.py.
 
-    :param word: A single word directly taken from the HTML file.
-    :type word: str
-    :return: True if the word is valid, False otherwise.
-    :rtype: bool
+    :param text: All unprocessed text found within a tag.
+    :type text: str
+    :return: Valid sanitized words separated by single spaces.
+    :rtype: str
     """
-    # TODO might want to adjust regex so that it actually processes proper money format, dates, proper punctuation.
-    return len(word) > 0 and \
-           not (re.match(r'[^a-zA-Z\d$€:.,-]', word) or (len(word) == 1 and re.match(r'[^a-zA-Z\d]', word)))
+    return _SANITIZE_RE.sub(r"\1", " ".join(_WORD_RE.findall(text)))
 
 
-def _sanitize_word(word: str) -> str:
-    """Sanitizes a words. Removes potential double punctuation or other invalid symbols at the end of the word.
+def _split_sentences(filtered_text: str) -> str:
+    """Tokenize filtered words to find sentences and give them back as a combined body of text.
 
-    :param word: A potentially dirty, but valid word. Could include additional punctuation due to joining of sentence.
-    :type word: str
-    :return: Word with double punctuation or invalid symbols at end of word removed.
+    :param filtered_text: Words filtered by _filter_words().
+    :type filtered_text: str
+    :return: Processed body of text as combined sentences.
     :rtype: str
     """
-    # TODO double punctuation problem might have been solved by new join sentences approach.
-    if len(word) == 0:
-        return word
-    # Check if last character is dot.
-    if word[-1] == '.':
-        # Check if second last character is not alpha numerical.
-        if not word[-2].isalnum():
-            # Prune invalid characters and add dot.
-            return word[:-2] + '.'
-    # Check if last character is not alpha numerical.
-    elif not word[-1].isalnum():
-        # Prune invalid character at end of word
-        return word[:-1]
-    return word
+    # Find sentences in the combined bag of words (bag of words still contain original dots.
+    return _join_sentences(sent_tokenize(filtered_text))
 
 
 def _process_text(text: str) -> str:
@@ -146,123 +244,423 @@ def _process_text(text: str) -> str:
     :return: Processed body of text as combined sentences.
     :rtype: str
     """
-    # Create list of valid sanitized words out of the text.
-    filtered_words = [_sanitize_word(word) for word in text.split(' ') if _valid_word(word)]
-
-    # Find sentences in the combined bag of words (bag of words still contain original dots.
-    tokenized_sentences = nltk.tokenize.sent_tokenize(" ".join(filtered_words))
+    return _split_sentences(_filter_words(text))
 
-    return _join_sentences(tokenized_sentences)
 
-
-def _get_soup_text(html_soup: BeautifulSoup) -> str:
+def _get_soup_text(html_soup: BeautifulSoup) -> Tuple[List[str], List[str]]:
     """Get all text from header and p tags of the BeautifulSoup object.
 
     :param html_soup: BeautifulSoup object of the HTML contents in the payload.
     :type html_soup: BeautifulSoup
-    :return: Joined sentences from all header and p tags.
-    :rtype: str
+    :return: Text per header tag and text per p tag.
+    :rtype: Tuple[List[str], List[str]]
     """
-    text_tags = [text_tag.text for text_tag in html_soup.find_all(re.compile('^h[1-6]$')) + html_soup.find_all('p')
-                 if text_tag.text is not None]
-    return _join_sentences(text_tags)
+    headers = [header.text for header in html_soup.find_all(re.compile('^h[1-6]$'))]
+    paragraphs = [paragraph.text for paragraph in html_soup.find_all('p')]
+    return headers, paragraphs
     # Could also return all text, would also include text included via div or span that is not in h or p tag.
     # return html_soup.get_text()
 
 
-def process_payload(warc_file: str) -> Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]:
-    """Process the payload of a single warc file.
-    Performs the following steps:
-    1. Finds WARC-TREC-ID and HTML content.
-    2. Normalizes the data.
-    3. Processes HTML title, HTML headers, and HTML text tags.
-    4. Return the results as a tuple.
+def _normalize_text(text: str) -> str:
+    """Turn HTML entities and unicode characters of extracted text into python characters.
+    NFKC normalization is skipped for pure ASCII text, which it doesn't change.
 
-    :param warc_file: contents of entire warc file.
-    :type warc_file: str
-    :return: Tuple of WARC-TREC-ID, HTML title, HTML headers, and HTML text tags. None tuple if no contents were found.
-    :rtype: Union[Tuple[str, str, str, str], Tuple[None, None, None, None]
+    :param text: Text extracted from the HTML.
+    :type text: str
+    :return: Normalized text.
+    :rtype: str
+    """
+    text = unescape(text)
+    if text.isascii():
+        return text
+    return unicodedata.normalize("NFKC", text)
+
+
+def _extract_text(html: str, html_engine: str = "bs4") -> Tuple[str, List[str], List[str]]:
+    """Extract the title, header, and p text of the HTML.
+
+    :param html: Decoded HTML.
+    :type html: str
+    :param html_engine: One of HTML_ENGINES. bs4 builds a BeautifulSoup tree, stream collects the same text in a single
+    pass with html_stream.extract_text().
+    :type html_engine: str
+    :return: Title text, text per header tag, and text per p tag.
+    :rtype: Tuple[str, List[str], List[str]]
+    """
+    if html_engine == "stream":
+        # Collect the title, headers, and p tags in a single pass without building a tree.
+        return extract_text(html)
+
+    # Create Soup object from the HTML.
+    html_soup = BeautifulSoup(html, "html.parser")
+
+    # Get HTML title if there is a title.
+    title = html_soup.title
+    title_text = ""
+    if title is not None and title.string is not None:
+        title_text = title.string
+
+    # Get all headers and p tags as defined in _get_soup_text() from HTML.
+    headers, paragraphs = _get_soup_text(html_soup)
+    return title_text, headers, paragraphs
+
+
+def _build_row(file_key: str, title_text: str, headers: List[str], paragraphs: List[str]) -> Tuple[str, str, str, str]:
+    """Process the normalized title, header, and p text into a row.
+
+    :param file_key: WARC-TREC-ID of the warc file.
+    :type file_key: str
+    :param title_text: Normalized title text.
+    :type title_text: str
+    :param headers: Normalized text per header tag.
+    :type headers: List[str]
+    :param paragraphs: Normalized text per p tag.
+    :type paragraphs: List[str]
+    :return: Tuple of WARC-TREC-ID, HTML title, HTML headers, and HTML text tags.
+    :rtype: Tuple[str, str, str, str]
     """
-    # Retrieve key and HTML content of warc file.
-    file_key, html_file = _find_html(warc_file)
+    # Filter the words of the headers once, all text starts with the same words.
+    filtered_headers = _filter_words(_join_sentences(headers))
+    filtered_paragraphs = _filter_words(_join_sentences(paragraphs))
+    filtered_all_text = " ".join(text for text in (filtered_headers, filtered_paragraphs) if len(text) > 0)
 
-    if file_key is not None:
-        # Turn unicode characters into python characters.
-        normalized_html = unicodedata.normalize("NFKC", unescape(" ".join(html_file)))
+    # Process title, headers, and all text into valid sentences.
+    processed_title = _process_text(title_text)
+    processed_headers = _split_sentences(filtered_headers)
+    processed_all_text = _split_sentences(filtered_all_text)
 
-        # Create Soup object from the HTML.
-        html_soup = BeautifulSoup(normalized_html, "html.parser")
+    # Prepend title to all text. Should only happen if _get_soup_text() doesn't include the title.
+    title_and_text = (processed_title + " " + processed_all_text).strip()
 
-        # Get HTML title if there is a title.
-        title = html_soup.title
-        title_text = ""
-        if title is not None and title.string is not None:
-            title_text = title.string
+    return file_key, processed_title, processed_headers, title_and_text
 
-        # Get all headers from HTML.
-        headers = [header.text for header in html_soup.find_all(re.compile('^h[1-6]$'))]
-        headers_text = _join_sentences(headers)
 
-        # Get all text as defined in _get_soup_text() from HTML.
-        all_text = _get_soup_text(html_soup)
+def process_payload(
+        key_html: Tuple[str, bytes],
+        html_engine: str = "bs4"
+) -> Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]:
+    """Process the HTML body of a single warc file.
+    Performs the following steps:
+    1. Decodes the HTML content.
+    2. Extracts HTML title, HTML headers, and HTML text tags.
+    3. Normalizes the extracted text, the markup, scripts, and styles are never normalized.
+    4. Processes the text and returns the results as a tuple.
+
+    :param key_html: WARC-TREC-ID and undecoded HTML body of the warc file as found by html_records().
+    :type key_html: Tuple[str, bytes]
+    :param html_engine: One of HTML_ENGINES. bs4 builds a BeautifulSoup tree, stream collects the same text in a single
+    pass with html_stream.extract_text().
+    :type html_engine: str
+    :return: Tuple of WARC-TREC-ID, HTML title, HTML headers, and HTML text tags. None tuple if no contents were found.
+    :rtype: Union[Tuple[str, str, str, str], Tuple[None, None, None, None]
+    """
+    file_key, html_body = key_html
 
-        # Process title, headers, and all text into valid sentences.
-        processed_title = _process_text(title_text)
-        processed_headers = _process_text(headers_text)
-        processed_all_text = _process_text(all_text)
+    if file_key is not None:
+        # Replace line breaks by spaces like joining the lines did, then decode the HTML. Errors are ignored like the
+        # text mode reader did before.
+        with stage("parse"):
+            html = html_body.translate(_LINE_BREAKS).decode("utf-8", errors="ignore")
+            if not html.isascii():
+                html = _UNICODE_LINE_BREAK_RE.sub(" ", html)
 
-        # Prepend title to all text. Should only happen if _get_soup_text() doesn't include the title.
-        title_and_text = (processed_title + " " + processed_all_text).strip()
+            title_text, headers, paragraphs = _extract_text(html, html_engine)
 
-        return file_key, processed_title, processed_headers, title_and_text
+        # Turn unicode characters into python characters.
+        with stage("text"):
+            return _build_row(
+                file_key,
+                _normalize_text(title_text),
+                [_normalize_text(header) for header in headers],
+                [_normalize_text(paragraph) for paragraph in paragraphs]
+            )
     return None, None, None, None
 
 
-def process_warc_zip() -> List[Tuple[str, str, str, str]]:
+def process_warc_zip(
+        skipped: Optional[Counter] = None,
+        warc_path: str = "data/warcs/sample.warc.gz",
+        pool_size: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        skip_keys: Optional[Container[str]] = None,
+        html_engine: str = "bs4",
+        sentence_splitter: str = "punkt",
+        offline: bool = False,
+        warc_reader: str = "stream",
+        sample: int = 0,
+        sample_seed: Optional[int] = None
+) -> Iterator[Tuple[str, str, str, str]]:
     """Parses warc contents of zip located at /data/warcs/sample.warc.gz.
     Does this using all present CPU cores using the Iterator from split_records.
-    Gives back a list of processed files that were individual warc files in the zip with HTML as content.
-
-    :return: List of processed warc files containing the WARC-TREC-ID, HTML title, HTML headers, and HTML text tags.
-    :rtype: List[Tuple[str, str, str, str]]
+    Records are filtered on their headers before they are sent to the pool, so only HTML bodies are pickled.
+    Gives back an iterator over the processed files that were individual warc files in the zip with HTML as content.
+    The zip is streamed, at most max_pending chunks of records are in memory at the same time.
+
+    :param skipped: Optional counter that receives the amount of skipped records per reason.
+    :type skipped: Optional[Counter]
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :param pool_size: Amount of processes to use, defaults to the CPU count.
+    :type pool_size: Optional[int]
+    :param max_pending: Maximum amount of chunks of records in flight, defaults to 4 per process.
+    :type max_pending: Optional[int]
+    :param skip_keys: WARC-TREC-IDs of records that are not processed, for example because they were processed by an
+    earlier run.
+    :type skip_keys: Optional[Container[str]]
+    :param html_engine: One of HTML_ENGINES, used to extract the text from the HTML.
+    :type html_engine: str
+    :param sentence_splitter: One of sentences.SENTENCE_SPLITTERS, loaded once per process.
+    :type sentence_splitter: str
+    :param offline: Never download the punkt model, fail if it isn't installed.
+    :type offline: bool
+    :param warc_reader: One of WARC_READERS. stream decompresses and splits the zip in this process, indexed lets the
+    workers decompress the gzip members of the records themselves, see _indexed_rows().
+    :type warc_reader: str
+    :param sample: Process a random sample of this amount of gzip members instead of all records, 0 processes all.
+    Requires the indexed reader.
+    :type sample: int
+    :param sample_seed: Seed of the sample.
+    :type sample_seed: Optional[int]
+    :return: Processed warc files containing the WARC-TREC-ID, HTML title, HTML headers, and HTML text tags in
+    completion order.
+    :rtype: Iterator[Tuple[str, str, str, str]]
     """
-    # Dependency of nltk.tokenize
-    nltk.download("punkt", quiet=True)
+    # Resolve the sentence splitter once, downloading the punkt model only if it is missing and offline is False.
+    configure_sentences(sentence_splitter, offline)
 
-    with gzip.open("data/warcs/sample.warc.gz", 'rt', errors='ignore') as fo:
+    if skipped is None:
+        skipped = Counter()
+    if pool_size is None:
         pool_size = mp.cpu_count()
+    if max_pending is None:
+        max_pending = 4 * pool_size
+    process = functools.partial(process_payload, html_engine=html_engine)
+
+    if warc_reader == "indexed":
+        members = load_index(warc_path)
+        if len(members) > 1:
+            yield from _indexed_rows(
+                skipped, warc_path, members, pool_size, max_pending, skip_keys, html_engine, sentence_splitter, sample,
+                sample_seed
+            )
+            return
+        # The whole zip is a single gzip member, which can only be decompressed from its start.
+        print(f"{warc_path} is not compressed per record, reading it as a stream.", file=sys.stderr)
+    if sample > 0:
+        print("Sampling requires a warc zip compressed per record and the indexed reader, processing all records.",
+              file=sys.stderr)
+
+    with gzip.open(warc_path, 'rb') as fo:
+        key_html_pairs = timed_iter(html_records(split_records(fo), skipped), "split")
+        if skip_keys:
+            key_html_pairs = ((key, html) for key, html in key_html_pairs if key not in skip_keys)
 
         # Force single threaded behaviour for debugging.
         # pool_size = 1
         if pool_size > 1:
-            with mp.Pool(processes=pool_size) as pool:
-                processed_files = pool.map(process_payload, split_records(fo))
+            # The workers load the resolved splitter once at startup and never download, also when they are spawned.
+            with mp.Pool(
+                    processes=pool_size,
+                    initializer=configure_sentences,
+                    initargs=(sentence_splitter, True)
+            ) as pool:
+                # The workers send their stage timings along with the rows.
+                processed_files = collect(
+                    bounded_imap_unordered(pool, Profiled(process), key_html_pairs, max_pending, 8)
+                )
+                yield from _valid_rows(processed_files, skipped)
         else:
-            processed_files = [process_payload(payload) for payload in split_records(fo)]
+            processed_files = (process(key_html) for key_html in key_html_pairs)
+            yield from _valid_rows(processed_files, skipped)
+
+
+def process_members(
+        warc_members: Tuple[str, List[Tuple[int, int]]],
+        html_engine: str = "bs4"
+) -> Tuple[List[Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]], Counter]:
+    """Read, decompress, split, and process gzip members of a warc zip. Runs in a worker of the indexed reader, which
+    opens the zip itself so only the offsets and the rows are sent between the processes.
+
+    :param warc_members: Path to the warc zip and the offset and compressed length of every member to process.
+    :type warc_members: Tuple[str, List[Tuple[int, int]]]
+    :param html_engine: One of HTML_ENGINES.
+    :type html_engine: str
+    :return: Rows as returned by process_payload() and the amount of skipped records per reason.
+    :rtype: Tuple[List[Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]], Counter]
+    """
+    warc_path, members = warc_members
+    skipped = Counter()
+    rows = []
+    with open(warc_path, "rb") as file:
+        for offset, length in members:
+            with stage("split"):
+                records = split_records(io.BytesIO(read_member(file, offset, length)))
+                key_html_pairs = list(html_records(records, skipped))
+            rows.extend(process_payload(key_html, html_engine) for key_html in key_html_pairs)
+    return rows, skipped
+
+
+def _indexed_rows(
+        skipped: Counter,
+        warc_path: str,
+        members: List[Tuple[int, int, str]],
+        pool_size: int,
+        max_pending: int,
+        skip_keys: Optional[Container[str]],
+        html_engine: str,
+        sentence_splitter: str,
+        sample: int,
+        sample_seed: Optional[int]
+) -> Iterator[Tuple[str, str, str, str]]:
+    """Process a warc zip that is compressed per record with the workers decompressing their own members, so reading
+    the zip scales with the amount of processes instead of being limited to one core in this process.
+    Members of which the first record is in skip_keys are never read. A member containing more than one record is
+    processed completely and its records in skip_keys are dropped afterwards.
+
+    :param skipped: Counter that receives the amount of skipped records per reason.
+    :type skipped: Counter
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :param members: Index of the gzip members as returned by warc_index.load_index().
+    :type members: List[Tuple[int, int, str]]
+    :param pool_size: Amount of processes to use.
+    :type pool_size: int
+    :param max_pending: Maximum amount of tasks in flight.
+    :type max_pending: int
+    :param skip_keys: WARC-TREC-IDs of records that are not processed.
+    :type skip_keys: Optional[Container[str]]
+    :param html_engine: One of HTML_ENGINES.
+    :type html_engine: str
+    :param sentence_splitter: One of sentences.SENTENCE_SPLITTERS.
+    :type sentence_splitter: str
+    :param sample: Amount of members to sample, 0 processes all.
+    :type sample: int
+    :param sample_seed: Seed of the sample.
+    :type sample_seed: Optional[int]
+    :return: Yields the valid rows in completion order.
+    :rtype: Iterator[Tuple[str, str, str, str]]
+    """
+    ranges = [(offset, length) for offset, length, key in members if not skip_keys or key not in skip_keys]
+    if sample > 0:
+        # Sampled members are read in file order.
+        ranges = sorted(random.Random(sample_seed).sample(ranges, min(sample, len(ranges))))
+    tasks = (
+        (warc_path, ranges[start:start + _MEMBERS_PER_TASK]) for start in range(0, len(ranges), _MEMBERS_PER_TASK)
+    )
+    process = functools.partial(process_members, html_engine=html_engine)
+
+    def valid_rows(results: Iterable[Tuple[List, Counter]]) -> Iterator[Tuple[str, str, str, str]]:
+        for rows, member_skipped in results:
+            skipped.update(member_skipped)
+            if skip_keys:
+                rows = [row for row in rows if row[0] not in skip_keys]
+            yield from _valid_rows(rows, skipped)
+
+    if pool_size > 1:
+        with mp.Pool(
+                processes=pool_size,
+                initializer=configure_sentences,
+                initargs=(sentence_splitter, True)
+        ) as pool:
+            yield from valid_rows(collect(bounded_imap_unordered(pool, Profiled(process), tasks, max_pending)))
+    else:
+        yield from valid_rows(process(task) for task in tasks)
 
-        return [row for row in processed_files if _valid_row(row)]
+
+def _valid_rows(
+        processed_files: Iterable[Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]],
+        skipped: Counter
+) -> Iterator[Tuple[str, str, str, str]]:
+    """Filter the processed files on _valid_row(), counting the dropped rows as "no_text".
+
+    :param processed_files: Rows as returned by process_payload().
+    :type processed_files: Iterable[Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]]
+    :param skipped: Counter that is incremented for every dropped row.
+    :type skipped: Counter
+    :return: Yields the valid rows.
+    :rtype: Iterator[Tuple[str, str, str, str]]
+    """
+    for row in processed_files:
+        if _valid_row(row):
+            yield row
+        else:
+            skipped["no_text"] += 1
+
+
+def format_skipped(skipped: Counter) -> str:
+    """Format the skipped record counters as a single line for the console.
+
+    :param skipped: Amount of skipped records per reason.
+    :type skipped: Counter
+    :return: Line containing the total and the amount per reason.
+    :rtype: str
+    """
+    reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(skipped.items()))
+    return f"Skipped {sum(skipped.values())} warc records ({reasons})"
 
 
 def save_pre_proc(
         pre_proc_dir: str,
-        processed_files: List[Tuple[str, str, str, str]],
-        filename: str
+        processed_files: Iterable[Tuple[str, str, str, str]],
+        filename: str,
+        pre_proc_format: str = "csv"
 ):
-    """Store the processed files as CSV in folder /pre-proc/ under the name of filename.
+    """Store the processed files in folder /pre-proc/ under the name of filename.
 
     :param pre_proc_dir: Directory to store the preprocessed file in.
     :type pre_proc_dir: str
     :param processed_files: Rows to store containing WARC-TREC-ID, HTML title, HTML headers, and HTML text tags.
-    :type processed_files: List[Tuple[str, str, str, str]]
+    :type processed_files: Iterable[Tuple[str, str, str, str]]
     :param filename: Filename of csv to store processed files in.
     :type filename: str
+    :param pre_proc_format: One of preproc_store.PRE_PROC_FORMATS, also used as file extension.
+    :type pre_proc_format: str
     """
+    for _ in stream_pre_proc(pre_proc_dir, processed_files, filename, pre_proc_format=pre_proc_format):
+        pass
 
-    with open(f"{pre_proc_dir}/{filename}.csv", 'w', newline='', encoding='UTF-8') as file:
+
+def stream_pre_proc(
+        pre_proc_dir: str,
+        processed_files: Iterable[Tuple[str, str, str, str]],
+        filename: str,
+        append: bool = False,
+        pre_proc_format: str = "csv"
+) -> Iterator[Tuple[str, str, str, str]]:
+    """Store the processed files in folder /pre-proc/ under the name of filename while passing them through.
+    Every row is written and flushed as soon as it is produced, so later stages can consume the rows at the same time
+    and the rows survive a crash of the program.
+
+    :param pre_proc_dir: Directory to store the preprocessed file in.
+    :type pre_proc_dir: str
+    :param processed_files: Rows to store containing WARC-TREC-ID, HTML title, HTML headers, and HTML text tags.
+    :type processed_files: Iterable[Tuple[str, str, str, str]]
+    :param filename: Filename of csv to store processed files in.
+    :type filename: str
+    :param append: Append to an existing file instead of overwriting it, used when resuming a run.
+    :type append: bool
+    :param pre_proc_format: One of preproc_store.PRE_PROC_FORMATS, also used as file extension. csv writes escaped CSV,
+    bin writes compressed records with an index by WARC-TREC-ID, see preproc_store.PreProcWriter.
+    :type pre_proc_format: str
+    :return: Yields the rows after they have been written.
+    :rtype: Iterator[Tuple[str, str, str, str]]
+    """
+    path = f"{pre_proc_dir}/{filename}.{pre_proc_format}"
+    if pre_proc_format == "bin":
+        with PreProcWriter(path, append=append) as writer:
+            for row in processed_files:
+                writer.write(row)
+                yield row
+        return
+
+    with open(path, 'a' if append else 'w', newline='', encoding='UTF-8') as file:
         writer = csv.writer(file, quoting=csv.QUOTE_NONE, escapechar='\\')
 
-        # Write rows if the row is valid.
-        writer.writerows(processed_files)
+        for row in processed_files:
+            writer.writerow(row)
+            file.flush()
+            yield row
 
 
 def _valid_row(row: Union[Tuple[str, str, str, str], Tuple[None, None, None, None]]) -> bool:
@@ -291,6 +689,57 @@ if __name__ == "__main__":
         help="A file name for the preprocessed warc zip.",
         type=str
     )
+    parser.add_argument(
+        "--html_engine",
+        dest="html_engine",
+        choices=HTML_ENGINES,
+        default="bs4",
+        help="Extract the text with a BeautifulSoup tree or in a single pass with the stream engine."
+    )
+    parser.add_argument(
+        "--sentence_splitter",
+        dest="sentence_splitter",
+        choices=SENTENCE_SPLITTERS,
+        default="punkt",
+        help="Split sentences with the punkt model of NLTK or with a lightweight rule based splitter."
+    )
+    parser.add_argument(
+        "--offline",
+        dest="offline",
+        action="store_true",
+        help="Never download the punkt model, fail if it isn't installed."
+    )
+    parser.add_argument(
+        "--pre_proc_format",
+        dest="pre_proc_format",
+        choices=PRE_PROC_FORMATS,
+        default="csv",
+        help="Store the rows as escaped CSV or as compressed binary records with an index by WARC-TREC-ID."
+    )
+    parser.add_argument(
+        "--warc_reader",
+        dest="warc_reader",
+        choices=WARC_READERS,
+        default="stream",
+        help="Decompress the warc zip in the main process, or let the workers decompress the records themselves using "
+             "an index of the gzip members that is stored next to the warc zip."
+    )
+    parser.add_argument(
+        "--sample_records",
+        dest="sample_records",
+        required=False,
+        default=0,
+        help="Only pre-process a random sample of this amount of warc records, requires --warc_reader indexed.",
+        type=int
+    )
+    parser.add_argument(
+        "--sample_seed",
+        dest="sample_seed",
+        required=False,
+        default=None,
+        help="Seed of --sample_records.",
+        type=int
+    )
     args = parser.parse_args()
 
     if args.filename is None:
@@ -298,6 +747,15 @@ if __name__ == "__main__":
     else:
         warc_filename = args.filename
 
-    pre_proc = process_warc_zip()
-
-    save_pre_proc("pre-proc", pre_proc, warc_filename)
+    skipped_records = Counter()
+    pre_proc = process_warc_zip(
+        skipped_records,
+        html_engine=args.html_engine,
+        sentence_splitter=args.sentence_splitter,
+        offline=args.offline,
+        warc_reader=args.warc_reader,
+        sample=args.sample_records,
+        sample_seed=args.sample_seed
+    )
+    save_pre_proc("pre-proc", pre_proc, warc_filename, args.pre_proc_format)
+    print(format_skipped(skipped_records), file=sys.stderr)
@@ -0,0 +1,232 @@
+import os
+import re
+import struct
+import sys
+import zlib
+from typing import List, Optional, Tuple
+
+_MAGIC = b"WDPSWI01"
+# Size and modification time in nanoseconds of the indexed warc zip, and the amount of members.
+_HEADER = struct.Struct("<QqI")
+# Offset, compressed length, and byte length of the key of a member.
+_ENTRY = struct.Struct("<QIH")
+# wbits of zlib that accept a gzip header and trailer.
+_GZIP_WBITS = 31
+# Amount of decompressed bytes of a member that is searched for the WARC-TREC-ID of its first record.
+_HEAD_SIZE = 4096
+_READ_SIZE = 1 << 20
+_TREC_ID_RE = re.compile(rb"^WARC-TREC-ID:[ \t]*([^\r\n]+)", re.MULTILINE)
+
+
+def _member_key(head: bytes) -> str:
+    """Find the WARC-TREC-ID of the first record of a member.
+
+    :param head: First decompressed bytes of the member.
+    :type head: bytes
+    :return: The WARC-TREC-ID, empty if the first record has none.
+    :rtype: str
+    """
+    header_end = head.find(b"\n\r\n")
+    if header_end == -1:
+        header_end = head.find(b"\n\n")
+    match = _TREC_ID_RE.search(head, 0, len(head) if header_end == -1 else header_end)
+    return "" if match is None else match.group(1).strip().decode("utf-8", errors="ignore")
+
+
+def build_index(warc_path: str, read_size: int = _READ_SIZE) -> List[Tuple[int, int, str]]:
+    """Find the gzip members of a warc zip by decompressing it once.
+    Warc zips normally compress every record as a separate gzip member, the index allows reading and decompressing a
+    record without decompressing the records before it. A truncated last member is left out.
+
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :param read_size: Amount of compressed bytes read at once.
+    :type read_size: int
+    :return: Offset, compressed length, and WARC-TREC-ID of the first record of every member in file order.
+    :rtype: List[Tuple[int, int, str]]
+    """
+    entries = []
+    offset = 0
+    position = 0
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    head = bytearray()
+    pending = b""
+
+    with open(warc_path, "rb") as file:
+        while True:
+            data = pending or file.read(read_size)
+            pending = b""
+            if len(data) == 0:
+                break
+            try:
+                decompressed = decompressor.decompress(data)
+            except zlib.error:
+                if len(entries) == 0:
+                    raise ValueError(f"{warc_path} is not a gzip file.")
+                # Trailing bytes after the last member, for example padding.
+                break
+            if len(head) < _HEAD_SIZE:
+                head += decompressed[:_HEAD_SIZE - len(head)]
+            if not decompressor.eof:
+                position += len(data)
+                continue
+
+            pending = decompressor.unused_data
+            end = position + len(data) - len(pending)
+            entries.append((offset, end - offset, _member_key(bytes(head))))
+            offset = position = end
+            decompressor = zlib.decompressobj(_GZIP_WBITS)
+            head = bytearray()
+    return entries
+
+
+def _index_path(warc_path: str) -> str:
+    """Path of the cached index of a warc zip.
+
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :return: Path of the index next to the warc zip.
+    :rtype: str
+    """
+    return f"{warc_path}.idx"
+
+
+def _file_stamp(path: str) -> Tuple[int, int]:
+    """Size and modification time of a file, used to detect that a cached index is outdated.
+
+    :param path: Path to the file.
+    :type path: str
+    :return: Size in bytes and modification time in nanoseconds.
+    :rtype: Tuple[int, int]
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_index(index_path: str, warc_path: str, entries: List[Tuple[int, int, str]]):
+    """Store the index of a warc zip.
+
+    :param index_path: Path of the index file.
+    :type index_path: str
+    :param warc_path: Path to the indexed warc zip.
+    :type warc_path: str
+    :param entries: Index as returned by build_index().
+    :type entries: List[Tuple[int, int, str]]
+    """
+    body = b"".join(
+        _ENTRY.pack(offset, length, len(key)) + key
+        for offset, length, key in ((offset, length, key.encode("UTF-8")) for offset, length, key in entries)
+    )
+    # Written to a temporary file first, so a reader never sees a partial index.
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(_MAGIC)
+        file.write(_HEADER.pack(*_file_stamp(warc_path), len(entries)))
+        file.write(zlib.compress(body))
+    os.replace(temp_path, index_path)
+
+
+def read_index(index_path: str, warc_path: str) -> Optional[List[Tuple[int, int, str]]]:
+    """Read a stored index if it belongs to the current version of the warc zip.
+
+    :param index_path: Path of the index file.
+    :type index_path: str
+    :param warc_path: Path to the indexed warc zip.
+    :type warc_path: str
+    :return: Index as returned by build_index(), None if the index doesn't exist, is damaged, or is outdated.
+    :rtype: Optional[List[Tuple[int, int, str]]]
+    """
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "rb") as file:
+        data = file.read()
+    if data[:len(_MAGIC)] != _MAGIC or len(data) < len(_MAGIC) + _HEADER.size:
+        return None
+    size, mtime, amount = _HEADER.unpack_from(data, len(_MAGIC))
+    if (size, mtime) != _file_stamp(warc_path):
+        return None
+    try:
+        body = zlib.decompress(data[len(_MAGIC) + _HEADER.size:])
+    except zlib.error:
+        return None
+
+    entries = []
+    position = 0
+    while position < len(body):
+        offset, length, key_length = _ENTRY.unpack_from(body, position)
+        position += _ENTRY.size
+        entries.append((offset, length, body[position:position + key_length].decode("UTF-8")))
+        position += key_length
+    return entries if len(entries) == amount else None
+
+
+def load_index(warc_path: str, index_path: Optional[str] = None, rebuild: bool = False) -> List[Tuple[int, int, str]]:
+    """Get the index of a warc zip, building and storing it if there is no up to date index.
+
+    :param warc_path: Path to the warc zip.
+    :type warc_path: str
+    :param index_path: Path of the index file, defaults to the warc zip path with ".idx" appended.
+    :type index_path: Optional[str]
+    :param rebuild: Build the index even if an up to date one is stored.
+    :type rebuild: bool
+    :return: Index as returned by build_index().
+    :rtype: List[Tuple[int, int, str]]
+    """
+    if index_path is None:
+        index_path = _index_path(warc_path)
+    entries = None if rebuild else read_index(index_path, warc_path)
+    if entries is None:
+        entries = build_index(warc_path)
+        try:
+            write_index(index_path, warc_path, entries)
+        except OSError as error:
+            # The index is only a cache, a read-only data directory just means it is built again next time.
+            print(f"Could not store the warc index {index_path}: {error}", file=sys.stderr)
+    return entries
+
+
+def read_member(file, offset: int, length: int) -> bytes:
+    """Read and decompress a single gzip member.
+
+    :param file: Warc zip opened in binary mode.
+    :type file: BinaryIO
+    :param offset: Offset of the member.
+    :type offset: int
+    :param length: Compressed length of the member.
+    :type length: int
+    :return: The decompressed records of the member.
+    :rtype: bytes
+    """
+    file.seek(offset)
+    return zlib.decompress(file.read(length), _GZIP_WBITS)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("warc_index")
+    parser.add_argument(
+        "--warc",
+        dest="warc",
+        required=True,
+        help="Warc zip to index.",
+        type=str
+    )
+    parser.add_argument(
+        "--index",
+        dest="index",
+        required=False,
+        default=None,
+        help="Path of the index, defaults to the warc zip path with .idx appended.",
+        type=str
+    )
+    parser.add_argument(
+        "--rebuild",
+        dest="rebuild",
+        action="store_true",
+        help="Build the index even if an up to date one exists."
+    )
+    args = parser.parse_args()
+
+    index = load_index(args.warc, args.index, args.rebuild)
+    print(f"{len(index)} gzip members, {sum(1 for _, _, key in index if key)} with a WARC-TREC-ID.")
@@ -0,0 +1,239 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import Iterable, Optional
+
+
+class WorkQueue:
+    queue_dir = None
+    worker_id = None
+    lease_timeout = None
+
+    def __init__(self, queue_dir: str, worker_id: str, lease_timeout: float = 600):
+        """Work queue on a shared file system. A worker claims a shard by creating its lease file with O_CREAT and
+        O_EXCL, which succeeds for only one worker, also across machines. The worker keeps the lease alive by updating
+        its modification time. A lease that hasn't been updated for lease_timeout seconds belongs to a stopped worker
+        and is taken over by the next worker, which resumes the shard from its checkpoint.
+
+        :param queue_dir: Shared directory containing the lease, done, and failed files.
+        :type queue_dir: str
+        :param worker_id: Unique id of this worker.
+        :type worker_id: str
+        :param lease_timeout: Seconds after which a lease that hasn't been renewed expires.
+        :type lease_timeout: float
+        """
+        self.queue_dir = queue_dir
+        self.worker_id = worker_id
+        self.lease_timeout = lease_timeout
+
+    def _path(self, shard: str, state: str) -> str:
+        """Get the path to the lease, done, or failed file of a shard.
+
+        :param shard: Shard id.
+        :type shard: str
+        :param state: lease, done, or failed.
+        :type state: str
+        :return: Path in the queue directory.
+        :rtype: str
+        """
+        return os.path.join(self.queue_dir, f"{shard}.{state}")
+
+    def is_done(self, shard: str) -> bool:
+        """Check whether a shard has been processed.
+
+        :param shard: Shard id.
+        :type shard: str
+        :return: True if the done file of the shard exists.
+        :rtype: bool
+        """
+        return os.path.exists(self._path(shard, "done"))
+
+    def is_failed(self, shard: str) -> bool:
+        """Check whether processing a shard failed.
+
+        :param shard: Shard id.
+        :type shard: str
+        :return: True if the failed file of the shard exists.
+        :rtype: bool
+        """
+        return os.path.exists(self._path(shard, "failed"))
+
+    def _take_over(self, lease_path: str) -> bool:
+        """Remove the lease if it expired.
+
+        :param lease_path: Path to the lease file.
+        :type lease_path: str
+        :return: True if there is no lease anymore.
+        :rtype: bool
+        """
+        try:
+            if time.time() - os.stat(lease_path).st_mtime < self.lease_timeout:
+                return False
+            # Renaming succeeds for only one of the workers taking over the lease at the same time.
+            stale_path = f"{lease_path}.{self.worker_id}.stale"
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+
+        # Another worker may have claimed the shard again between the check and the rename, then the lease is restored.
+        if time.time() - os.stat(stale_path).st_mtime < self.lease_timeout:
+            try:
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        return True
+
+    def claim(self, shards: Iterable[str]) -> Optional[str]:
+        """Claim the first shard that isn't done, failed, or leased by another worker.
+
+        :param shards: Shard ids in the order they are claimed.
+        :type shards: Iterable[str]
+        :return: The claimed shard, None if there are no shards left to claim.
+        :rtype: Optional[str]
+        """
+        for shard in shards:
+            if self.is_done(shard) or self.is_failed(shard):
+                continue
+            lease_path = self._path(shard, "lease")
+            if os.path.exists(lease_path) and not self._take_over(lease_path):
+                continue
+            try:
+                file = os.open(lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                continue
+            try:
+                os.write(file, json.dumps({"worker": self.worker_id, "claimed": time.time()}).encode("UTF-8"))
+            finally:
+                os.close(file)
+            # The shard may have been completed between the check and the claim.
+            if self.is_done(shard):
+                self.release(shard)
+                continue
+            return shard
+        return None
+
+    def owns(self, shard: str) -> bool:
+        """Check whether this worker holds the lease of a shard.
+
+        :param shard: Shard id.
+        :type shard: str
+        :return: True if the lease file belongs to this worker.
+        :rtype: bool
+        """
+        try:
+            with open(self._path(shard, "lease"), encoding="UTF-8") as file:
+                return json.load(file)["worker"] == self.worker_id
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+
+    def heartbeat(self, shard: str) -> bool:
+        """Renew the lease of a shard.
+
+        :param shard: Shard id.
+        :type shard: str
+        :return: False if the lease was taken over by another worker or couldn't be renewed.
+        :rtype: bool
+        """
+        try:
+            if not self.owns(shard):
+                return False
+            os.utime(self._path(shard, "lease"))
+        except OSError:
+            return False
+        return True
+
+    def release(self, shard: str):
+        """Remove the lease of a shard if this worker holds it.
+
+        :param shard: Shard id.
+        :type shard: str
+        """
+        if self.owns(shard):
+            os.remove(self._path(shard, "lease"))
+
+    def _mark(self, shard: str, state: str, content: str) -> bool:
+        """Atomically create the done or failed file of a shard and release its lease. Nothing is written if the lease
+        was taken over, the shard then belongs to the other worker.
+
+        :param shard: Shard id.
+        :type shard: str
+        :param state: done or failed.
+        :type state: str
+        :param content: Content of the file.
+        :type content: str
+        :return: False if this worker doesn't hold the lease of the shard.
+        :rtype: bool
+        """
+        if not self.owns(shard):
+            return False
+        temporary_path = self._path(shard, f"{state}.{self.worker_id}.tmp")
+        with open(temporary_path, "w", encoding="UTF-8") as file:
+            file.write(content)
+        os.replace(temporary_path, self._path(shard, state))
+        self.release(shard)
+        return True
+
+    def complete(self, shard: str, seconds: float) -> bool:
+        """Mark a shard as done.
+
+        :param shard: Shard id.
+        :type shard: str
+        :param seconds: Seconds it took to process the shard.
+        :type seconds: float
+        :return: False if this worker doesn't hold the lease of the shard.
+        :rtype: bool
+        """
+        return self._mark(shard, "done", json.dumps({"worker": self.worker_id, "seconds": round(seconds, 3)}))
+
+    def fail(self, shard: str, error: str) -> bool:
+        """Mark a shard as failed, failed shards aren't claimed again until the failed file is removed.
+
+        :param shard: Shard id.
+        :type shard: str
+        :param error: Traceback of the error.
+        :type error: str
+        :return: False if this worker doesn't hold the lease of the shard.
+        :rtype: bool
+        """
+        return self._mark(shard, "failed", f"worker {self.worker_id}\n{error}")
+
+
+def keep_alive(
+        queue: WorkQueue,
+        shard: str,
+        stop: threading.Event,
+        lost: threading.Event,
+        attempts: int = 3,
+        retry_delay: float = 1.0
+):
+    """Renew the lease of a shard until stop is set. A failed renewal is retried, since reading the lease on a shared
+    file system can fail for a moment. If the lease can't be renewed, lost is set and the run of the shard stops.
+
+    :param queue: Work queue of the shard.
+    :type queue: WorkQueue
+    :param shard: Shard id.
+    :type shard: str
+    :param stop: Event that is set when the shard is processed.
+    :type stop: threading.Event
+    :param lost: Event that is set when the lease is lost.
+    :type lost: threading.Event
+    :param attempts: Amount of times a renewal is tried before the lease is given up.
+    :type attempts: int
+    :param retry_delay: Seconds between the attempts.
+    :type retry_delay: float
+    """
+    while not stop.wait(queue.lease_timeout / 4):
+        for attempt in range(attempts):
+            if queue.heartbeat(shard):
+                break
+            if attempt + 1 < attempts and stop.wait(retry_delay):
+                return
+        else:
+            print(f"Worker {queue.worker_id} lost the lease of shard {shard}.", file=sys.stderr)
+            lost.set()
+            return